@@ -3,15 +3,18 @@ from datetime import timezone, datetime, timedelta
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from starlette import status
-from database import SessionLocal
+from starlette.concurrency import run_in_threadpool
+from database import get_async_db
 from models import Authentication
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from jose import jwt, JWTError, ExpiredSignatureError
-import redis
+from redis.asyncio import Redis
+from redis_store import get_blacklist_redis
 
 router = APIRouter(
     prefix="/auth",
@@ -27,8 +30,8 @@ bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # Note: tokenUrl should be the absolute path where the token is obtained
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
-# Redis để quản lý token blacklist (DB index 1 dành cho blacklist)
-redis_client = redis.Redis(host="localhost", port=6379, db=1, decode_responses=True)
+# Redis để quản lý token blacklist (DB index 1 dành cho blacklist, pool chung trong redis_store.py)
+redis_dependency = Annotated[Redis, Depends(get_blacklist_redis)]
 
 
 # ---------------------- MODELS ----------------------
@@ -42,14 +45,8 @@ class Token(BaseModel):
 
 
 # ---------------------- DB DEPENDENCY ----------------------
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
+# AsyncSession: handler là async def nên chờ DB không được chặn event loop
+db_dependency = Annotated[AsyncSession, Depends(get_async_db)]
 
 
 # ---------------------- CREATE USER ----------------------
@@ -59,17 +56,17 @@ async def create_user(db: db_dependency, create_user_request: CreateUserRequest)
     Create a new user (Authentication table).
     """
     try:
-        hashed_pw = bcrypt_context.hash(create_user_request.password)
+        # bcrypt tốn hàng trăm ms CPU: chạy trên threadpool, không chạy trên event loop
+        hashed_pw = await run_in_threadpool(bcrypt_context.hash, create_user_request.password)
         new_user = Authentication(
             username=create_user_request.username,
             hashed_password=hashed_pw,
         )
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
         return {"id": new_user.userid, "username": new_user.username}
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=400,
             detail="Username already exists."
@@ -86,7 +83,7 @@ async def login_for_access_token(
     Exchange username/password for a JWT access token.
     Token lifetime = 20 minutes by default.
     """
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -98,7 +95,7 @@ async def login_for_access_token(
 
 # ---------------------- LOGOUT ----------------------
 @router.post("/logout")
-async def logout(request: Request, token: Annotated[str, Depends(oauth2_bearer)]):
+async def logout(request: Request, token: Annotated[str, Depends(oauth2_bearer)], redis_client: redis_dependency):
     """
     Logout: put current token into Redis blacklist with TTL = remaining lifetime.
     """
@@ -117,7 +114,7 @@ async def logout(request: Request, token: Annotated[str, Depends(oauth2_bearer)]
             return {"message": "Token already expired"}
 
         # Store token in blacklist with TTL (seconds)
-        redis_client.setex(f"blacklist:{token}", ttl, "true")
+        await redis_client.set(f"blacklist:{token}", "true", ex=ttl)
 
         return {"message": "Logout successful"}
     except ExpiredSignatureError:
@@ -128,15 +125,15 @@ async def logout(request: Request, token: Annotated[str, Depends(oauth2_bearer)]
 
 
 # ---------------------- HELPER FUNCTIONS ----------------------
-def authenticate_user(username: str, password: str, db: Session):
+async def authenticate_user(username: str, password: str, db: AsyncSession):
     """
     Authenticate against Authentication table.
     Returns the user object or False.
     """
-    user = db.query(Authentication).filter(Authentication.username == username).first()
+    user = await db.scalar(select(Authentication).where(Authentication.username == username))
     if not user:
         return False
-    if not bcrypt_context.verify(password, user.hashed_password):
+    if not await run_in_threadpool(bcrypt_context.verify, password, user.hashed_password):
         return False
     return user
 
@@ -156,13 +153,13 @@ def create_access_token(username: str, user_id: int, expires_delta: timedelta):
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
+async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)], redis_client: redis_dependency):
     """
     Dependency to get current user from token.
     Checks blacklist first, then verifies token and returns a dict with username and id.
     """
     # Check blacklist
-    if redis_client.get(f"blacklist:{token}"):
+    if await redis_client.get(f"blacklist:{token}"):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked")
 
     try:
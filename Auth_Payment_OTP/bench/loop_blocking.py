@@ -0,0 +1,184 @@
+"""Event loop bị chặn bao lâu: handler async def gọi Session sync + bcrypt trực tiếp (như trước) so với
+AsyncSession + bcrypt trên threadpool (main.get_payment, auth.login_for_access_token hiện tại).
+
+Gọi app qua httpx.ASGITransport (không qua mạng, không cần Redis), mỗi chế độ:
+  - legacy   /legacy/... : bản cũ của 2 handler, khai báo ngay trong file này
+  - async    /payments/transaction/{id} và /auth/token thật
+--concurrency request GET payment chạy cùng lúc, xen --logins lần đăng nhập (bcrypt).
+Song song có 1 task heartbeat ngủ --tick-ms rồi đo mình bị trễ bao nhiêu: loop bị chặn -> lag lớn,
+mọi request khác trên cùng worker cũng đứng chờ.
+
+--db-latency-ms giả lập round trip tới DB thật (SQLite cục bộ gần như không tốn thời gian chờ):
+mỗi câu SQL ngủ trong thread đang chạy câu đó - với Session sync đó chính là thread của event loop.
+    python bench/loop_blocking.py                       # SQLite tạm
+    DB_POOL_SIZE=40 DB_MAX_OVERFLOW=40 python bench/loop_blocking.py --concurrency 64 --db-latency-ms 5
+--concurrency phải <= DB_POOL_SIZE + DB_MAX_OVERFLOW: chế độ legacy chờ connection của pool ngay trên event loop,
+pool hết thì cả loop đứng tới khi QueuePool timeout.
+"""
+import argparse
+import asyncio
+import math
+import os
+import sys
+import tempfile
+import time
+import uuid
+from decimal import Decimal
+from typing import Annotated
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="loop-"), "bench.db")
+
+import httpx                                                    # noqa: E402
+from fastapi import Depends, HTTPException                      # noqa: E402
+from fastapi.security import OAuth2PasswordRequestForm          # noqa: E402
+from sqlalchemy import event                                    # noqa: E402
+
+import models                                                   # noqa: E402
+from auth import bcrypt_context                                 # noqa: E402
+from database import DB_MAX_OVERFLOW, DB_POOL_SIZE, SessionLocal, async_engine, engine   # noqa: E402
+from main import PaymentResponse, app, db_dependency            # noqa: E402
+
+
+# -------------------- Handler cũ (Session sync trong async def) --------------------
+@app.get("/legacy/payments/transaction/{transaction_id}", response_model=PaymentResponse)
+async def legacy_get_payment(transaction_id: str, db: db_dependency):
+    payment = db.query(models.Payment).filter(models.Payment.transactionId == transaction_id).first()
+    if not payment:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    return payment
+
+@app.post("/legacy/auth/token")
+async def legacy_login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: db_dependency):
+    user = db.query(models.Authentication).filter(models.Authentication.username == form_data.username).first()
+    if not user or not bcrypt_context.verify(form_data.password, user.hashed_password):
+        raise HTTPException(status_code=401, detail="Could not validate user.")
+    return {"userid": user.userid}
+
+
+ROUTES = {
+    "legacy": ("/legacy/payments/transaction/{}", "/legacy/auth/token"),
+    "async": ("/payments/transaction/{}", "/auth/token"),
+}
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+def simulate_db_latency(latency_ms: float):
+    if not latency_ms:
+        return
+    def slow(_statement):
+        time.sleep(latency_ms / 1000)
+
+    @event.listens_for(engine, "connect")
+    def sync_connect(dbapi_connection, _record):
+        dbapi_connection.set_trace_callback(slow)
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def async_connect(dbapi_connection, _record):
+        # aiosqlite: callback chạy trong thread riêng của connection, không phải event loop
+        dbapi_connection.await_(dbapi_connection.driver_connection.set_trace_callback(slow))
+    engine.dispose()
+
+def seed(password: str, payments: int) -> tuple:
+    db = SessionLocal()
+    try:
+        user = models.Authentication(username=f"bench-{uuid.uuid4().hex[:12]}",
+                                     hashed_password=bcrypt_context.hash(password))
+        db.add(user)
+        db.flush()
+        account = models.Account(customerId=user.userid, balance=Decimal("0"))
+        db.add(account)
+        db.flush()
+        transaction_ids = [str(uuid.uuid4()) for _ in range(payments)]
+        db.add_all(models.Payment(transactionId=t, accountId=account.accountId, amount=Decimal("1"),
+                                  payment_status="success") for t in transaction_ids)
+        db.commit()
+        return user.username, transaction_ids
+    finally:
+        db.close()
+
+async def run(mode: str, username: str, password: str, transaction_ids: list, args) -> dict:
+    payment_route, login_route = ROUTES[mode]
+    lags, latencies = [], []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        tick = args.tick_ms / 1000
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(tick)
+            lags.append(time.perf_counter() - start - tick)
+
+    async def call(client, request):
+        start = time.perf_counter()
+        response = await request(client)
+        latencies.append(time.perf_counter() - start)
+        return response.status_code
+
+    slots = asyncio.Semaphore(args.concurrency)
+    async def limited(client, request):
+        async with slots:
+            return await call(client, request)
+
+    requests = [lambda c, t=t: c.get(payment_route.format(t)) for t in transaction_ids]
+    login = lambda c: c.post(login_route, data={"username": username, "password": password})     # noqa: E731
+    step = max(len(requests) // max(args.logins, 1), 1)
+    for i in range(args.logins):
+        requests.insert(i * step + i, login)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        beat = asyncio.create_task(heartbeat())
+        await asyncio.sleep(args.tick_ms / 1000 * 2)
+        start = time.perf_counter()
+        codes = await asyncio.gather(*(limited(client, r) for r in requests))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await beat
+    await async_engine.dispose()
+
+    return {
+        "req_per_s": round(len(requests) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "lag_p95_ms": round(percentile(lags, 95) * 1000, 1),
+        "lag_max_ms": round(max(lags, default=0) * 1000, 1),
+        "errors": sum(1 for code in codes if code != 200),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event-loop lag: sync DB/bcrypt in async handlers vs async DB")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="requests in flight at once (at most DB_POOL_SIZE + DB_MAX_OVERFLOW)")
+    parser.add_argument("--requests", type=int, default=500, help="payment lookups per mode")
+    parser.add_argument("--logins", type=int, default=8, help="logins (bcrypt verify) mixed into the lookups")
+    parser.add_argument("--db-latency-ms", type=float, default=2, help="simulated round trip per SQL statement")
+    parser.add_argument("--tick-ms", type=float, default=5, help="heartbeat interval")
+    args = parser.parse_args()
+    if args.concurrency > DB_POOL_SIZE + DB_MAX_OVERFLOW:
+        parser.error(f"--concurrency {args.concurrency} exceeds the connection pool "
+                     f"(DB_POOL_SIZE {DB_POOL_SIZE} + DB_MAX_OVERFLOW {DB_MAX_OVERFLOW}); raise them or lower it")
+
+    simulate_db_latency(args.db_latency_ms)
+    password = "bench-password"
+    username, transaction_ids = seed(password, args.requests)
+
+    print(f"{engine.url.get_backend_name()}, {args.requests} lookups + {args.logins} logins, "
+          f"concurrency {args.concurrency}, db latency {args.db_latency_ms} ms")
+    print(f"{'mode':8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'lag p95':>10}{'lag max':>10}{'errors':>8}")
+    for mode in ROUTES:
+        r = asyncio.run(run(mode, username, password, transaction_ids, args))
+        print(f"{mode:8}{r['req_per_s']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['lag_p95_ms']:>10}"
+              f"{r['lag_max_ms']:>10}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
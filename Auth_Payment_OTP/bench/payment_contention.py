@@ -0,0 +1,120 @@
+"""So sánh 2 chế độ chống tranh chấp của create_payment trên 1 account "nóng":
+  - pessimistic   SELECT ... WITH (UPDLOCK) giữ khóa dòng tới khi commit
+  - optimistic    UPDATE ... WHERE version = ? + thử lại khi bị ghi trước (PAYMENT_OPTIMISTIC_RETRIES)
+
+Mỗi payment là 1 task asyncio với AsyncSession riêng, gọi main.process_payment trực tiếp (không qua HTTP, không cần Redis).
+Sau mỗi chế độ kiểm tra balance cuối = balance đầu - tổng tiền của các payment success (không mất / trừ trùng).
+
+Chạy trên DB thật để có số đúng. SQLite khóa cả file nên mọi ghi đều tuần tự, và bỏ qua FOR UPDATE
+nên chế độ pessimistic trên SQLite sẽ báo MISMATCH (mất update) - chế độ optimistic thì vẫn đúng:
+    DATABASE_URL="mssql+pyodbc://@HOST/FastAPIDB?driver=ODBC+Driver+17+for+SQL+Server&trusted_connection=yes" \\
+        python bench/payment_contention.py --concurrency 16 --payments 50
+    python bench/payment_contention.py              # SQLite tạm
+"""
+import argparse
+import asyncio
+import math
+import os
+import sys
+import tempfile
+import time
+import uuid
+from decimal import Decimal
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="contention-"), "bench.db")
+
+import models                                                   # noqa: E402
+from database import AsyncSessionLocal, SessionLocal, async_engine   # noqa: E402
+from main import PAYMENT_OPTIMISTIC_RETRIES, PaymentConflict, PaymentRequest, process_payment   # noqa: E402
+from sqlalchemy.exc import SQLAlchemyError                      # noqa: E402
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+def create_hot_account(balance: Decimal) -> int:
+    db = SessionLocal()
+    try:
+        user = models.Authentication(username=f"bench-{uuid.uuid4().hex[:12]}", hashed_password="-")
+        db.add(user)
+        db.flush()
+        account = models.Account(customerId=user.userid, balance=balance)
+        db.add(account)
+        db.commit()
+        return account.accountId
+    finally:
+        db.close()
+
+def get_balance(account_id: int) -> Decimal:
+    db = SessionLocal()
+    try:
+        return db.get(models.Account, account_id).balance
+    finally:
+        db.close()
+
+async def run(mode: str, args) -> dict:
+    account_id = create_hot_account(args.balance)
+    request = PaymentRequest(accountId=account_id, amount=args.amount)
+    stats = {"success": 0, "failed": 0, "conflicts": 0, "gave_up": 0, "errors": 0}
+    latencies = []
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def pay():
+        async with slots, AsyncSessionLocal() as db:
+            start = time.perf_counter()
+            try:
+                payment, attempts = await process_payment(db, request, mode)
+                outcome = payment.payment_status
+            except PaymentConflict:
+                attempts, outcome = PAYMENT_OPTIMISTIC_RETRIES + 1, "gave_up"
+            except SQLAlchemyError:
+                await db.rollback()
+                attempts, outcome = 1, "errors"
+            latencies.append(time.perf_counter() - start)
+            stats[outcome] += 1
+            stats["conflicts"] += attempts - 1
+
+    total = args.concurrency * args.payments
+    start = time.perf_counter()
+    await asyncio.gather(*(pay() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    await async_engine.dispose()        # connection của pool gắn với event loop của lượt này
+
+    expected = args.balance - stats["success"] * args.amount
+    actual = get_balance(account_id)
+    return {
+        **stats,
+        "payments_per_s": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "balance_ok": expected == actual,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pessimistic vs optimistic payments on one hot account")
+    parser.add_argument("--concurrency", type=int, default=8, help="payments in flight at once")
+    parser.add_argument("--payments", type=int, default=25, help="payments per concurrent slot")
+    parser.add_argument("--amount", type=Decimal, default=Decimal("1.25"))
+    parser.add_argument("--balance", type=Decimal, default=Decimal("1000000"))
+    parser.add_argument("--mode", action="append", choices=["pessimistic", "optimistic"],
+                        help="run only this mode (repeatable)")
+    args = parser.parse_args()
+
+    print(f"database: {SessionLocal.kw['bind'].url.render_as_string(hide_password=True)}")
+    print(f"{'mode':13}{'pay/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'success':>9}{'conflicts':>11}{'gave up':>9}"
+          f"{'errors':>8}  balance")
+    for mode in args.mode or ["pessimistic", "optimistic"]:
+        r = asyncio.run(run(mode, args))
+        print(f"{mode:13}{r['payments_per_s']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['success']:>9}"
+              f"{r['conflicts']:>11}{r['gave_up']:>9}{r['errors']:>8}  {'ok' if r['balance_ok'] else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,196 @@
-from sqlalchemy import create_engine
+import os
+import time
+import logging
+from contextlib import contextmanager
+from contextlib import asynccontextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
-SQLALCHEMY_DATABASE_URL = ("mssql+pyodbc://@ADIDAPHAT\\MSSQLSERVER01/FastAPIDB?driver=ODBC+Driver+17+for+SQL+Server&trusted_connection=yes")
+# Đổi backend qua biến môi trường DATABASE_URL, ví dụ chạy offline không cần SQL Server:
+#   DATABASE_URL=sqlite:///./fastapi.db
+SQLALCHEMY_DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    "mssql+pyodbc://@ADIDAPHAT\\MSSQLSERVER01/FastAPIDB?driver=ODBC+Driver+17+for+SQL+Server&trusted_connection=yes"
+)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Read replica cho các endpoint chỉ đọc (không đặt -> đọc luôn từ primary), ví dụ:
+#   READ_DATABASE_URL=mssql+pyodbc://@AG-LISTENER/FastAPIDB?driver=ODBC+Driver+17+for+SQL+Server&trusted_connection=yes&ApplicationIntent=ReadOnly
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+# Replica có thể trễ: trong N giây sau khi process này ghi DB thì vẫn đọc từ primary
+REPLICA_MAX_STALENESS = float(os.getenv("REPLICA_MAX_STALENESS", "2"))
+# Replica lỗi -> dùng primary trong N giây rồi mới thử lại
+REPLICA_RETRY_AFTER = float(os.getenv("REPLICA_RETRY_AFTER", "30"))
+
+# Pool connection (cả engine sync và async):
+#   DB_POOL_SIZE / DB_MAX_OVERFLOW   số connection giữ sẵn / mở thêm lúc cao điểm
+#   DB_POOL_TIMEOUT                  giây chờ connection rảnh trước khi báo lỗi
+#   DB_POOL_RECYCLE                  giây; connection cũ hơn bị mở lại (firewall / SQL Server cắt connection rảnh lâu)
+# pool_pre_ping kiểm tra connection trước khi dùng nên connection đã chết không làm lỗi request.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Driver async tương ứng với driver sync trong DATABASE_URL (ghi đè bằng ASYNC_DATABASE_URL)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "mssql": "mssql+aioodbc",
+    "postgresql": "postgresql+asyncpg",
+}
+
+logger = logging.getLogger("database")
+
+def _connect_args(url: str) -> dict:
+    # SQLite: cho phép dùng connection từ threadpool của FastAPI
+    return {"check_same_thread": False} if url.startswith("sqlite") else {}
+
+def _pool_args(url: str) -> dict:
+    # SQLite in-memory dùng 1 connection cố định (StaticPool), không nhận tham số pool
+    if url.startswith("sqlite") and make_url(url).database in (None, "", ":memory:"):
+        return {}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE, "pool_pre_ping": True}
+
+def async_url(url: str) -> str:
+    backend = make_url(url).get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver known for {backend}; set ASYNC_DATABASE_URL")
+    return make_url(url).set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+connect_args = _connect_args(SQLALCHEMY_DATABASE_URL)
+
+class _TrackedSession(Session):
+    """Session trên primary: ghi nhận lúc commit có ghi (read-your-writes khi dùng read replica)"""
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args, **_pool_args(SQLALCHEMY_DATABASE_URL))
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=_TrackedSession)
 Base = declarative_base()
 
+read_engine = None
+ReadSessionLocal = None
+if READ_DATABASE_URL:
+    read_engine = create_engine(READ_DATABASE_URL, connect_args=_connect_args(READ_DATABASE_URL),
+                                **_pool_args(READ_DATABASE_URL))
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# -------------------- ASYNC --------------------
+# Handler async def dùng AsyncSession: chờ DB không chặn event loop (session sync trong async def thì chặn cả app).
+# expire_on_commit=False: đọc thuộc tính sau commit không phát sinh lazy load (không được phép với AsyncSession).
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_url(SQLALCHEMY_DATABASE_URL)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_pool_args(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False,
+                                       sync_session_class=_TrackedSession)
+
+async_read_engine = None
+AsyncReadSessionLocal = None
+if READ_DATABASE_URL:
+    ASYNC_READ_DATABASE_URL = os.getenv("ASYNC_READ_DATABASE_URL") or async_url(READ_DATABASE_URL)
+    async_read_engine = create_async_engine(ASYNC_READ_DATABASE_URL, **_pool_args(ASYNC_READ_DATABASE_URL))
+    AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# -------------------- READ ROUTING --------------------
+_last_write = float("-inf")     # time.monotonic() của lần commit có ghi gần nhất trên primary
+_replica_down_until = 0.0
+
+# Gắn vào class nên áp dụng cho cả SessionLocal và session sync bên trong AsyncSessionLocal
+@event.listens_for(_TrackedSession, "after_flush")
+def _mark_dirty(session, flush_context):
+    session.info["wrote"] = True
+
+@event.listens_for(_TrackedSession, "after_commit")
+def _remember_write(session):
+    global _last_write
+    if session.info.pop("wrote", False):
+        _last_write = time.monotonic()
+
+def _use_replica() -> bool:
+    now = time.monotonic()
+    return now - _last_write >= REPLICA_MAX_STALENESS and now >= _replica_down_until
+
+def _replica_failed(e: Exception):
+    global _replica_down_until
+    logger.warning("Read replica unavailable, falling back to primary for %ss: %s", REPLICA_RETRY_AFTER, e)
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER
+
+def _open_read_session():
+    """Session cho đọc: replica nếu có cấu hình, không vừa ghi và replica đang sống; ngược lại primary"""
+    if ReadSessionLocal is None or not _use_replica():
+        return SessionLocal()
+
+    db = ReadSessionLocal()
+    try:
+        db.connection()     # lấy connection ngay để phát hiện replica chết trước khi chạy query
+        return db
+    except DBAPIError as e:
+        db.close()
+        _replica_failed(e)
+        return SessionLocal()
+
+def get_read_db():
+    db = _open_read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+@contextmanager
+def read_session():
+    """Như get_read_db nhưng dùng ngoài Depends, vd. trong generator của StreamingResponse
+    (session của dependency có thể đã đóng trước khi response stream xong)"""
+    db = _open_read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# -------------------- ASYNC DEPENDENCIES --------------------
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def _open_async_read_session():
+    """Như _open_read_session cho AsyncSession"""
+    if AsyncReadSessionLocal is None or not _use_replica():
+        return AsyncSessionLocal()
+
+    db = AsyncReadSessionLocal()
+    try:
+        await db.connection()
+        return db
+    except DBAPIError as e:
+        await db.close()
+        _replica_failed(e)
+        return AsyncSessionLocal()
+
+async def get_async_read_db():
+    db = await _open_async_read_session()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+@asynccontextmanager
+async def async_session():
+    """AsyncSession trên primary dùng ngoài Depends (vd. script, benchmark)"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def dispose_engines():
+    """Đóng pool của các async engine khi tắt app (thread của aiosqlite không giữ process lại)"""
+    await async_engine.dispose()
+    if async_read_engine is not None:
+        await async_read_engine.dispose()
@@ -1,25 +1,60 @@
-from fastapi import FastAPI, status, Depends, HTTPException
-import redis, random, hashlib, time
+from fastapi import FastAPI, status, Depends, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+import random, hashlib, os, logging, base64, asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 import models
-from database import engine, SessionLocal
-from typing import Annotated, List
+from database import engine, SessionLocal, dispose_engines, get_async_db, get_async_read_db, read_session
+from typing import Annotated, List, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, and_, or_
 from sqlalchemy.exc import SQLAlchemyError
 import auth
+import http_cache
 import uuid, json
+from decimal import Decimal
 from auth import get_current_user
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from redis_store import close_redis, get_redis
 
 # -------------------- INIT --------------------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_redis()
+    await dispose_engines()
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(auth.router)
+# ETag / 304 cho client poll + nén gzip/brotli response lớn (http_cache.py)
+http_cache.instrument_app(app)
 
 models.Base.metadata.create_all(bind=engine)
 
-# Redis client
-redis_client = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+logger = logging.getLogger("payments")
+
+
+# Redis lỗi / quá REDIS_SOCKET_TIMEOUT (OTP, token blacklist): trả 503 thay vì treo request hoặc 500
+@app.exception_handler(RedisError)
+async def redis_exception_handler(request, exc: RedisError):
+    logger.warning("Redis unavailable on %s: %s", request.url.path, exc)
+    return JSONResponse(status_code=503, content={"detail": "Service temporarily unavailable, please retry"})
+
+# Cách chống trừ tiền trùng khi nhiều payment cùng account:
+#   pessimistic  SELECT ... WITH (UPDLOCK) giữ khóa dòng Account tới khi commit (mặc định)
+#   optimistic   đọc không khóa, UPDATE Account ... WHERE version = <version đã đọc>; bị tranh chấp
+#                (0 dòng được update) thì đọc lại và thử lại tối đa PAYMENT_OPTIMISTIC_RETRIES lần
+PAYMENT_CONCURRENCY = os.getenv("PAYMENT_CONCURRENCY", "pessimistic").lower()
+PAYMENT_OPTIMISTIC_RETRIES = int(os.getenv("PAYMENT_OPTIMISTIC_RETRIES", "5"))
+if PAYMENT_CONCURRENCY not in ("pessimistic", "optimistic"):
+    raise RuntimeError(f"Unknown PAYMENT_CONCURRENCY: {PAYMENT_CONCURRENCY}")
+
+
+class PaymentConflict(Exception):
+    """Hết số lần thử lại của chế độ optimistic (account đang bị ghi liên tục)"""
 
 
 # -------------------- DEPENDENCIES --------------------
@@ -31,20 +66,29 @@ def get_db():
         db.close()
         
 db_dependency = Annotated[Session, Depends(get_db)]
+# Handler async def: AsyncSession, chờ DB không chặn event loop (xem database.py)
+async_db_dependency = Annotated[AsyncSession, Depends(get_async_db)]
+# Chỉ đọc: có thể đi tới read replica (READ_DATABASE_URL)
+async_read_db_dependency = Annotated[AsyncSession, Depends(get_async_read_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
+# redis.asyncio dùng chung pool (redis_store.py); test thay bằng fakeredis qua app.dependency_overrides
+redis_dependency = Annotated[Redis, Depends(get_redis)]
 
 
 # -------------------- MODELS --------------------
 class PaymentRequest(BaseModel):
     accountId: int
-    amount: float
+    # Khớp cột Numeric(18, 2), không cộng trừ tiền bằng float; quá 2 chữ số thập phân -> 422
+    # (không để DB tự làm tròn khiến số tiền lưu khác số tiền trả về)
+    amount: Decimal = Field(gt=0, max_digits=18, decimal_places=2)
     
 class PaymentResponse(BaseModel):
     transactionId: str
     accountId: int
     amount: float
     payment_status: str
-    transaction_history: str
+    dueDate: Optional[datetime] = None
+    transaction_history: Optional[str] = None   # lịch sử theo account chỉ trả khi include_history=true
     
     class Config:
         orm_mode = True
@@ -64,7 +108,7 @@ def hash_otp(otp: str) -> str:
 
 # -------------------- ROOT --------------------
 @app.get("/", status_code=status.HTTP_200_OK)
-async def user(user:user_dependency, db: db_dependency):
+async def user(user:user_dependency):
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
                             detail='Authentication Failed')
@@ -73,38 +117,74 @@ async def user(user:user_dependency, db: db_dependency):
 
 # -------------------- ACCOUNTS --------------------
 @app.get("/accounts/by-customer/{customer_id}")
-def get_accounts_by_customer(customer_id: int, db: Session = Depends(get_db)):
-    accounts = db.query(models.Account).filter(models.Account.customerId == customer_id).all()
+async def get_accounts_by_customer(customer_id: int, db: async_read_db_dependency):
+    accounts = (await db.scalars(select(models.Account).where(models.Account.customerId == customer_id))).all()
     if not accounts:
         raise HTTPException(status_code=404, detail="No accounts found for this customer")
     return accounts        
 
 
 # -------------------- SAFE PAYMENT --------------------
-@app.post("/payments/", response_model=PaymentResponse, status_code=status.HTTP_201_CREATED)
-async def create_payment(payment: PaymentRequest, db: db_dependency):
-    try:
-        account = (
-            db.execute(
-                select(models.Account)
-                .where(models.Account.accountId == payment.accountId)
-                .with_for_update()
-            )
-            .scalars()
-            .first()
+async def _debit_pessimistic(db: AsyncSession, payment: PaymentRequest):
+    """Khóa dòng Account (UPDLOCK) rồi trừ tiền; khóa giữ tới khi commit"""
+    account = (
+        await db.scalars(
+            select(models.Account)
+            .where(models.Account.accountId == payment.accountId)
+            .with_for_update()
         )
+    ).first()
 
-        if not account: 
-            raise HTTPException(status_code=404, detail="Account not found")
-        
-        if account.balance < payment.amount:
-            status_payment = "failed"
-            history = {"event": "Payment failed", "reason": "Insufficient balance"}
+    if not account: 
+        raise HTTPException(status_code=404, detail="Account not found")
+    
+    if account.balance < payment.amount:
+        return "failed", {"event": "Payment failed", "reason": "Insufficient balance"}
+    account.balance -= payment.amount
+    account.version += 1
+    return "success", {"event": "Payment success", "remaining_balance": float(account.balance)}
+
+async def _debit_optimistic(db: AsyncSession, payment: PaymentRequest):
+    """Đọc không khóa rồi UPDATE có điều kiện version; trả None nếu bị payment khác ghi trước"""
+    account = (
+        await db.scalars(
+            select(models.Account)
+            .where(models.Account.accountId == payment.accountId)
+            .execution_options(populate_existing=True)
+        )
+    ).first()
+
+    if not account:
+        raise HTTPException(status_code=404, detail="Account not found")
+
+    if account.balance < payment.amount:
+        return "failed", {"event": "Payment failed", "reason": "Insufficient balance"}
+    remaining = account.balance - payment.amount
+    result = await db.execute(
+        update(models.Account)
+        .where(models.Account.accountId == payment.accountId, models.Account.version == account.version)
+        .values(balance=remaining, version=account.version + 1)
+    )
+    if result.rowcount != 1:
+        return None
+    return "success", {"event": "Payment success", "remaining_balance": float(remaining)}
+
+async def process_payment(db: AsyncSession, payment: PaymentRequest, mode: str = None):
+    """Trừ tiền + ghi Payment trong 1 transaction. Trả (payment, số lần thử)"""
+    mode = mode or PAYMENT_CONCURRENCY
+    attempts = PAYMENT_OPTIMISTIC_RETRIES + 1 if mode == "optimistic" else 1
+    for attempt in range(1, attempts + 1):
+        if mode == "optimistic":
+            outcome = await _debit_optimistic(db, payment)
+            if outcome is None:
+                await db.rollback()
+                # Lùi ngẫu nhiên (tăng dần theo số lần thử) để các payment đang tranh chấp không va nhau lần nữa
+                await asyncio.sleep(random.uniform(0, 0.002 * 2 ** attempt))
+                continue
         else:
-            account.balance -= payment.amount
-            status_payment = "success"
-            history = {"event": "Payment success", "remaining_balance": account.balance}
-            
+            outcome = await _debit_pessimistic(db, payment)
+        status_payment, history = outcome
+
         new_payment = models.Payment(
             transactionId=str(uuid.uuid4()), 
             accountId=payment.accountId,
@@ -114,26 +194,96 @@ async def create_payment(payment: PaymentRequest, db: db_dependency):
         )
         
         db.add(new_payment)
-        db.commit()
-        db.refresh(new_payment)
-        return new_payment
-    
+        await db.commit()       # expire_on_commit=False: không cần refresh, mọi cột đã có giá trị phía Python
+        return new_payment, attempt
+
+    logger.warning("Payment on account %s gave up after %s version conflicts", payment.accountId, attempts)
+    raise PaymentConflict(payment.accountId)
+
+@app.post("/payments/", response_model=PaymentResponse, status_code=status.HTTP_201_CREATED)
+async def create_payment(payment: PaymentRequest, db: async_db_dependency):
+    try:
+        return (await process_payment(db, payment))[0]
+    except PaymentConflict:
+        raise HTTPException(status_code=409, detail="Account is busy, please retry the payment")
     except SQLAlchemyError as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
 # -------------------- GET PAYMENTS --------------------
+# Lịch sử theo account: keyset trên (dueDate, transactionId) mới nhất trước, khớp index ix_Payment_account_due_txn.
+# Cursor = vị trí dòng cuối của trang trước (không dùng OFFSET nên trang sau không chậm dần).
+PAYMENTS_PAGE_SIZE = int(os.getenv("PAYMENTS_PAGE_SIZE", "50"))
+PAYMENTS_MAX_PAGE_SIZE = 500
+PAYMENTS_EXPORT_BATCH = int(os.getenv("PAYMENTS_EXPORT_BATCH", "1000"))
+
+PAYMENT_SUMMARY_COLUMNS = (
+    models.Payment.transactionId,
+    models.Payment.accountId,
+    models.Payment.amount,
+    models.Payment.payment_status,
+    models.Payment.dueDate,
+)
+
+def encode_cursor(due_date: datetime, transaction_id: str) -> str:
+    raw = json.dumps([due_date.isoformat(), transaction_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        due_date, transaction_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(due_date), str(transaction_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def payment_history_query(account_id: int, include_history: bool, cursor: str = None):
+    """Chỉ select các cột cần (không load ORM object, không kéo transaction_history nếu không hỏi)"""
+    columns = PAYMENT_SUMMARY_COLUMNS + ((models.Payment.transaction_history,) if include_history else ())
+    query = select(*columns).where(models.Payment.accountId == account_id)
+    if cursor:
+        due_date, transaction_id = decode_cursor(cursor)
+        # (dueDate, transactionId) < cursor; viết dạng OR vì SQL Server không so sánh được row value
+        query = query.where(or_(
+            models.Payment.dueDate < due_date,
+            and_(models.Payment.dueDate == due_date, models.Payment.transactionId < transaction_id),
+        ))
+    return query.order_by(models.Payment.dueDate.desc(), models.Payment.transactionId.desc())
+
 @app.get("/payments/{account_id}", response_model = List[PaymentResponse])
-async def get_payments(account_id: int, db: db_dependency):
-    payments = db.query(models.Payment).filter(models.Payment.accountId == account_id).all()
-    if not payments:
+async def get_payments(account_id: int, db: async_read_db_dependency, response: Response,
+                       limit: int = Query(PAYMENTS_PAGE_SIZE, ge=1, le=PAYMENTS_MAX_PAGE_SIZE),
+                       cursor: Optional[str] = None, include_history: bool = False):
+    """1 trang lịch sử payment; còn trang sau thì header X-Next-Cursor chứa cursor để gọi tiếp"""
+    query = payment_history_query(account_id, include_history, cursor).limit(limit + 1)
+    rows = (await db.execute(query)).mappings().all()
+    if not rows and not cursor:
         raise HTTPException(status_code=404, detail = "No payments found")
-    return payments
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["dueDate"], rows[-1]["transactionId"])
+    return rows
+
+@app.get("/payments/{account_id}/export")
+def export_payments(account_id: int, include_history: bool = False):
+    """Toàn bộ lịch sử dạng NDJSON (1 payment / dòng), stream theo lô PAYMENTS_EXPORT_BATCH dòng
+    (yield_per) nên bộ nhớ không tăng theo độ dài lịch sử"""
+    def rows():
+        with read_session() as db:
+            result = db.execute(payment_history_query(account_id, include_history)
+                                .execution_options(yield_per=PAYMENTS_EXPORT_BATCH))
+            for row in result.mappings():
+                item = dict(row)
+                item["dueDate"] = item["dueDate"].isoformat() if item["dueDate"] else None
+                item["amount"] = float(item["amount"])
+                yield json.dumps(item) + "\n"
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="payments-{account_id}.ndjson"'})
 
 @app.get("/payments/transaction/{transaction_id}", response_model=PaymentResponse)
-async def get_payment(transaction_id: str, db: db_dependency):
-    payment = db.query(models.Payment).filter(models.Payment.transactionId == transaction_id).first()
+async def get_payment(transaction_id: str, db: async_db_dependency):
+    payment = await db.get(models.Payment, transaction_id)
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
     return payment
@@ -141,14 +291,15 @@ async def get_payment(transaction_id: str, db: db_dependency):
 
 # -------------------- OTP --------------------
 @app.post("/otp/request")
-def request_otp(data: OTPRequest, db: Session = Depends(get_db)):
-    user = db.query(models.Authentication).filter(models.Authentication.userid == data.userId).first()
+async def request_otp(data: OTPRequest, db: async_db_dependency, redis_client: redis_dependency):
+    user = await db.get(models.Authentication, data.userId)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Chặn spam OTP (30s)
+    # Chặn spam OTP (30s): SET NX EX kiểm tra và đặt khóa trong 1 lệnh atomic,
+    # 2 request đồng thời không thể cùng lọt qua như GET rồi SETEX
     last_sent_key = f"otp:sent:{data.userId}"
-    if redis_client.get(last_sent_key):
+    if not await redis_client.set(last_sent_key, "1", ex=30, nx=True):
         raise HTTPException(status_code=429, detail="Wait 30s before requesting a new OTP")
 
     # Tạo OTP 6 số
@@ -156,50 +307,56 @@ def request_otp(data: OTPRequest, db: Session = Depends(get_db)):
     otp_hash = hash_otp(otp)
     expire_time = datetime.now(timezone.utc) + timedelta(seconds=60)
 
-    # Lưu OTP raw vào Redis (để verify)
-    redis_client.setex(f"otp:{data.userId}", 60, otp)
-    redis_client.setex(last_sent_key, 30, "1")
-
-    # Lưu log OTP hashed vào DB
-    new_otp = models.OTP(
-        userId=data.userId,
-        otpCode=otp_hash,
-        expired_at=expire_time,
-        is_used=False
-    )
-    db.add(new_otp)
-    db.commit()
-    db.refresh(new_otp)
+    try:
+        # Lưu log OTP hashed vào DB
+        db.add(models.OTP(
+            userId=data.userId,
+            otpCode=otp_hash,
+            expired_at=expire_time,
+            is_used=False
+        ))
+        await db.commit()
+
+        # Lưu OTP raw vào Redis (để verify)
+        await redis_client.set(f"otp:{data.userId}", otp, ex=60)
+    except (SQLAlchemyError, RedisError):
+        # Không gửi được OTP -> bỏ khóa 30s để người dùng yêu cầu lại ngay
+        await db.rollback()
+        await redis_client.delete(last_sent_key)
+        raise
 
     return {"message": "OTP sent", "otp_demo": otp}  # ⚠️ chỉ để debug
 
 
 @app.post("/otp/verify")
-def verify_otp(data: OTPVerify, db: Session = Depends(get_db)):
-    otp_stored = redis_client.get(f"otp:{data.userId}")
+async def verify_otp(data: OTPVerify, db: async_db_dependency, redis_client: redis_dependency):
+    otp_stored = await redis_client.get(f"otp:{data.userId}")
     if not otp_stored:
         raise HTTPException(status_code=400, detail="OTP expired or not found")
 
     if data.otp != otp_stored:
         raise HTTPException(status_code=400, detail="Invalid OTP")
 
-    otp_entry = db.query(models.OTP).filter(
+    otp_entry = await db.scalar(select(models.OTP).where(
         models.OTP.userId == data.userId,
         models.OTP.is_used == False
-    ).order_by(models.OTP.expired_at.desc()).first()
+    ).order_by(models.OTP.expired_at.desc()).limit(1))
 
     if not otp_entry:
         raise HTTPException(status_code=404, detail="OTP record not found in DB")
 
-    # So sánh timezone-aware datetime
-    if otp_entry.expired_at < datetime.now(timezone.utc):
+    # So sánh timezone-aware datetime (SQLite trả về datetime naive, lưu theo UTC)
+    expired_at = otp_entry.expired_at
+    if expired_at.tzinfo is None:
+        expired_at = expired_at.replace(tzinfo=timezone.utc)
+    if expired_at < datetime.now(timezone.utc):
         raise HTTPException(status_code=400, detail="OTP expired")
 
     # Đánh dấu đã dùng
     otp_entry.is_used = True
-    db.commit()
+    await db.commit()
 
     # Xóa OTP trong Redis sau khi verify thành công
-    redis_client.delete(f"otp:{data.userId}")
+    await redis_client.delete(f"otp:{data.userId}")
 
     return {"message": "OTP verified successfully"}
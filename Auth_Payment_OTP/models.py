@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float, Text, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime, timedelta, timezone
@@ -18,7 +18,10 @@ class  Account(Base):
     
     accountId = Column(Integer, primary_key=True, index=True)
     customerId = Column(Integer, ForeignKey("Authentication.userid"))
-    balance = Column(Float, default=0.0)
+    # Tiền lưu DECIMAL (Float làm tròn sai, vd. 0.1 + 0.2); ORM trả về Decimal
+    balance = Column(Numeric(18, 2), default=0)
+    # Tăng 1 mỗi lần đổi balance; dùng cho PAYMENT_CONCURRENCY=optimistic (UPDATE ... WHERE version = ?)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     
     payments = relationship("Payment", back_populates="account")
     
@@ -27,12 +30,19 @@ class Payment(Base):
     __tablename__ = "Payment"
     transactionId = Column(String(36), primary_key=True, autoincrement=False, index=True)
     accountId = Column(Integer, ForeignKey("Account.accountId"))
-    amount = Column(Integer, nullable=False)
+    amount = Column(Numeric(18, 2), nullable=False)
     payment_status = Column(String(20), default="pending")
     dueDate = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc) + timedelta(days=7))
     transaction_history = Column(Text)
     
     account = relationship("Account", back_populates="payments")
+
+    # Covering index cho lịch sử payment theo account (keyset trên dueDate, transactionId):
+    # đọc 1 trang chỉ cần index, không chạm tới transaction_history
+    __table_args__ = (
+        Index("ix_Payment_account_due_txn", "accountId", "dueDate", "transactionId",
+              mssql_include=["amount", "payment_status"]),
+    )
     
     
 class OTP(Base):
@@ -40,6 +50,6 @@ class OTP(Base):
     otpId = Column(Integer, primary_key=True, index=True, autoincrement=True)
     userId = Column(Integer, ForeignKey("Authentication.userid"))
     otpCode = Column(String(64), nullable=False)
-    expired_at = Column(DATETIMEOFFSET, nullable=False, default=lambda: datetime.now(timezone.utc) + timedelta(seconds=60))
+    expired_at = Column(DateTime(timezone=True).with_variant(DATETIMEOFFSET, "mssql"), nullable=False, default=lambda: datetime.now(timezone.utc) + timedelta(seconds=60))
     is_used = Column(Boolean, default=False)
     user = relationship("Authentication", back_populates="otps")
\ No newline at end of file
@@ -0,0 +1,50 @@
+import os
+from redis import asyncio as aioredis
+
+# Redis dùng chung cho cả app: OTP (main.py, DB 0) và token blacklist (auth.py, DB 1).
+#   REDIS_URL                    địa chỉ Redis, vd. redis://:password@redis:6379
+#   REDIS_MAX_CONNECTIONS        số connection tối đa mỗi pool (mỗi DB index 1 pool)
+#   REDIS_POOL_TIMEOUT           giây chờ connection rảnh khi pool đã dùng hết
+#   REDIS_SOCKET_TIMEOUT         giây chờ 1 lệnh; Redis treo -> lỗi nhanh (503) thay vì giữ request mãi
+#   REDIS_CONNECT_TIMEOUT        giây chờ mở connection
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+REDIS_OTP_DB = int(os.getenv("REDIS_OTP_DB", "0"))
+REDIS_BLACKLIST_DB = int(os.getenv("REDIS_BLACKLIST_DB", "1"))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "2"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "1"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "1"))
+
+
+def _pool(db: int) -> aioredis.BlockingConnectionPool:
+    # BlockingConnectionPool: hết connection thì chờ tối đa REDIS_POOL_TIMEOUT thay vì báo lỗi ngay
+    return aioredis.BlockingConnectionPool.from_url(
+        REDIS_URL,
+        db=db,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        health_check_interval=30,
+        decode_responses=True,
+    )
+
+# Client nhẹ, connection lấy từ pool theo từng lệnh -> dùng chung cho mọi request
+otp_redis = aioredis.Redis(connection_pool=_pool(REDIS_OTP_DB))
+blacklist_redis = aioredis.Redis(connection_pool=_pool(REDIS_BLACKLIST_DB))
+
+
+# -------------------- DEPENDENCIES --------------------
+# Inject qua Depends để test thay bằng fakeredis:
+#   app.dependency_overrides[get_redis] = lambda: fakeredis.FakeAsyncRedis(decode_responses=True)
+def get_redis() -> aioredis.Redis:
+    return otp_redis
+
+def get_blacklist_redis() -> aioredis.Redis:
+    return blacklist_redis
+
+
+async def close_redis():
+    """Đóng các pool khi tắt app"""
+    await otp_redis.connection_pool.disconnect()
+    await blacklist_redis.connection_pool.disconnect()
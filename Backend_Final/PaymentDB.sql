@@ -13,6 +13,13 @@ CREATE TABLE payment (
     transaction_history NVARCHAR(255)
 );
 
+-- Khóa giao dịch theo customer khi chạy nhiều worker (IBANKING_PAYMENT_LOCK=db)
+CREATE TABLE payment_lock (
+    customerId NVARCHAR(50) PRIMARY KEY,
+    token NVARCHAR(64) NOT NULL,
+    claimed_at DATETIME2 NOT NULL
+);
+
 -- Dummy data
 INSERT INTO payment (customerId, amount, status, transaction_history)
 VALUES (101, 900000, 'unpaid', 'Initial unpaid payment for customer 101');
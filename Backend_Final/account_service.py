@@ -1,9 +1,26 @@
-from fastapi import FastAPI,HTTPException, Request
-from pydantic import BaseModel
+from fastapi import FastAPI,HTTPException, Request, Query
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from fastapi.responses import JSONResponse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import atexit
+import contextvars
+import group_commit
 import logging
-import pyodbc   
+import os
+import http_cache
+import metrics
+import tracing
+import log_config
 import requests
+import resilience
+import storage
+import threading
+from cache import TTLCache, VersionedCache
+from digest import DigestNotifier
+from group_commit import GroupCommitWriter
+from repositories import AccountRepository, DebitRejected, LedgerAccountRepository, ShardedAccountRepository
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI()
@@ -23,13 +40,27 @@ app.add_middleware(
     allow_headers=["*"],          # cho phép mọi header
 )
 
+# ETag / 304 cho client poll + nén gzip/brotli response lớn (http_cache.py)
+http_cache.instrument_app(app)
+
+# Endpoint /metrics + đo latency theo route, trace span cho mỗi request
+metrics.instrument_app(app, "account")
+tracing.instrument_app(app, "account")
+
 # Cấu hình logging để theo dõi lỗi
-logging.basicConfig(level=logging.ERROR)
+logger = log_config.setup_logging("account_service", level=logging.ERROR)
 
 class Account(BaseModel):
     customer_id : str
     account_id: str
     balance : float 
+    version: Optional[int] = None   # tăng mỗi lần số dư thay đổi
+
+# Tất cả tài khoản của 1 customer + tổng số dư
+class CustomerAccounts(BaseModel):
+    customer_id: str
+    accounts: List[Account]
+    total_balance: float
 
 class AccountResponse(Account):   # kế thừa từ Account
     status: str
@@ -39,108 +70,189 @@ class BalanceUpdate(BaseModel):
     account_id: str
     amount: float
     description: str 
+
+# Tham số đầu vào cho API trừ tiền nguyên tử (check số dư + trừ trong 1 câu lệnh)
+class DebitRequest(BaseModel):
+    account_id: str
+    amount: float = Field(gt=0)
+    customer_id: Optional[str] = None   # Nếu có: account phải thuộc về customer này
+    description: str = ""
+
+class DebitResponse(BaseModel):
+    customer_id: str
+    account_id: str
+    balance: float
+    status: str
+
+# Số dư tại 1 thời điểm (ledger)
+class BalanceAt(BaseModel):
+    account_id: str
+    balance: float
+    at: datetime
+
+class LedgerEntry(BaseModel):
+    entry_id: int
+    amount: float             # âm = ghi nợ, dương = ghi có
+    description: Optional[str] = None
+    created_at: datetime
+    balance_after: float
+
+class LedgerPage(BaseModel):
+    account_id: str
+    entries: List[LedgerEntry]
+    next_before: Optional[int] = None   # truyền vào ?before= để lấy trang tiếp theo
     
-def get_connection():
-    return pyodbc.connect(
-        "DRIVER={ODBC Driver 17 for SQL Server};"
-        "SERVER=DESKTOP-PV9Q0OQ\SQLEXPRESS;" # Thay bằng tên sever trên máy đang chạy
-        "DATABASE=AccountDB;"
-        "Trusted_Connection=yes;"
-    )    
+# Backend (SQL Server / SQLite) chọn qua IBANKING_STORAGE, xem storage.py
+def get_connection(readonly: bool = False):
+    return storage.get_connection("AccountDB", readonly=readonly)
     
+# ================== Ledger ==================
+# IBANKING_ACCOUNT_LEDGER=1: số dư lấy từ ledger_entry (chỉ INSERT) + balance_snapshot thay vì cột account.balance,
+# xem LedgerAccountRepository. Snapshot được chốt nền mỗi LEDGER_SNAPSHOT_INTERVAL giây cho account nào
+# có >= LEDGER_SNAPSHOT_EVERY bút toán mới -> đọc số dư chỉ cộng tối đa ~LEDGER_SNAPSHOT_EVERY dòng.
+LEDGER_MODE = os.getenv("IBANKING_ACCOUNT_LEDGER", "0").lower() in ("1", "true", "yes")
+LEDGER_SNAPSHOT_INTERVAL = float(os.getenv("IBANKING_LEDGER_SNAPSHOT_INTERVAL", "60"))
+LEDGER_SNAPSHOT_EVERY = int(os.getenv("IBANKING_LEDGER_SNAPSHOT_EVERY", "100"))
+
+# ================== Sharded accounts ==================
+# IBANKING_SHARDED_ACCOUNTS=ACC005,ACC006: số dư các account này chia ra IBANKING_ACCOUNT_BUCKETS dòng account_bucket,
+# xem ShardedAccountRepository. Account bị bỏ khỏi danh sách được gộp bucket về account.balance lúc khởi động.
+# Không dùng chung với ledger (ledger đã bỏ việc ghi vào dòng account).
+SHARDED_ACCOUNTS = {account_id.strip() for account_id in os.getenv("IBANKING_SHARDED_ACCOUNTS", "").split(",")
+                    if account_id.strip()}
+ACCOUNT_BUCKETS = max(int(os.getenv("IBANKING_ACCOUNT_BUCKETS", "8")), 1)
+
+# IBANKING_UNSHARD_ACCOUNTS=1: lúc khởi động gộp bucket của mọi account còn sót (khi đã xóa hết danh sách trên).
+# Không đặt cả 2 biến thì service không đụng tới account_bucket lúc khởi động.
+UNSHARD_ACCOUNTS = os.getenv("IBANKING_UNSHARD_ACCOUNTS", "0").lower() in ("1", "true", "yes")
+
+def account_repository(conn) -> AccountRepository:
+    if LEDGER_MODE:
+        return LedgerAccountRepository(conn)
+    return ShardedAccountRepository(conn) if SHARDED_ACCOUNTS else AccountRepository(conn)
+
+def is_sharded(account_id: str) -> bool:
+    return not LEDGER_MODE and account_id in SHARDED_ACCOUNTS
+
+# ================== Group commit ==================
+# IBANKING_GROUP_COMMIT=1: ghi số dư của các request đồng thời được gom chung 1 transaction, xem group_commit.py
+account_writer = GroupCommitWriter("account", "AccountDB") if group_commit.ENABLED else None
+
+def write_balance(work):
+    """work(conn) trong transaction ghi số dư rồi commit (riêng, hoặc chung lô nếu bật group commit)"""
+    return group_commit.run_in_transaction("AccountDB", work, account_writer)
+
 # Lấy URL gốc của customer_service
 CUSTOMER_SERVICE_URL = "http://127.0.0.1:8000/customers" 
 # Email Service URL
 EMAIL_SERVICE_URL = "http://127.0.0.1:8005/email/send"
 
+# Cache customer đã xác thực (giây); 0 = tắt, lần nào cũng hỏi Customer Service
+CUSTOMER_CACHE_TTL = float(os.getenv("IBANKING_CUSTOMER_CACHE_TTL", "0"))
+customer_cache = TTLCache("customer", CUSTOMER_CACHE_TTL)
+
+# Cache trạng thái account (write-through, theo account_id) + danh sách account_id theo customer_id (giây); 0 = tắt.
+# Entry mang version của dòng DB: ghi dựa trên entry cũ sẽ bị UPDATE ... WHERE version = ? chặn lại.
+ACCOUNT_CACHE_TTL = float(os.getenv("IBANKING_ACCOUNT_CACHE_TTL", "0"))
+account_cache = VersionedCache("account", ACCOUNT_CACHE_TTL)
+customer_accounts_cache = TTLCache("customer_accounts", ACCOUNT_CACHE_TTL)
+
+# Pool để gọi Customer Service song song với truy vấn DB
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("IBANKING_ACCOUNT_WORKERS", "16")),
+                              thread_name_prefix="account")
+
 # Xử lý lỗi hệ thống (500) toàn cục
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logging.error(f"Unexpected error: {exc}")  # log lỗi để debug
+    logger.error("Unexpected error: %s", exc)  # log lỗi để debug
     return JSONResponse(
         status_code=500,
         content={"detail": "Internal Server Error. Please try again later."},
     )  
+
+# Trạng thái circuit breaker / bulkhead của các service phụ thuộc
+@app.get("/resilience/status")
+def resilience_status():
+    return resilience.status()
     
-@app.get("/account/{customer_id}",response_model=Account)
-def getAccountinfo(customer_id : str):
-    res = requests.get(f"{CUSTOMER_SERVICE_URL}/{customer_id}",timeout=5)
-    connct = get_connection()
-    cur = connct.cursor()
-    cur.execute("SELECT customer_id, account_id, balance FROM account WHERE customer_id = ?", customer_id)
-    row = cur.fetchone() 
+# Kiểm tra customer tồn tại + còn hoạt động; chỉ cache kết quả 200
+def check_customer(customer_id: str) -> dict:
+    cached = customer_cache.get(customer_id)
+    if cached is not None:
+        return cached
     try:
-        # Trả về thành công
-        if res.status_code == 200:
-            return row
-        
-        # Không tìm thấy
-        if res.status_code == 404:
-            raise HTTPException(status_code=404,detail="Customer not found")
-        
-        # Bị cấm hoặc lỗi nghiệp vụ khác
-        elif res.status_code == 403:
-            raise HTTPException(status_code=403, detail="Customer is inactive or forbidden")
-        
-        # Lỗi khác 
-        else:
-            raise HTTPException(status_code=502, detail="Customer Service error")
-    
+        res = resilience.call("customer", "GET", f"{CUSTOMER_SERVICE_URL}/{customer_id}")
     except requests.exceptions.RequestException as e:
         # Lỗi khi không kết nối được sang Customer Service (mất mạng, timeout, service chết)
         raise HTTPException(status_code=503, detail="Customer Service unavailable")
-    finally:
-        if connct:
-            connct.close()
 
-def find_account_by_id(account_id: str):
-    conn = get_connection()
+    # Trả về thành công
+    if res.status_code == 200:
+        customer = res.json()
+        customer_cache.put(customer_id, customer)
+        return customer
+    # Không tìm thấy
+    if res.status_code == 404:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    # Bị cấm hoặc lỗi nghiệp vụ khác
+    if res.status_code == 403:
+        raise HTTPException(status_code=403, detail="Customer is inactive or forbidden")
+    # Lỗi khác
+    raise HTTPException(status_code=502, detail="Customer Service error")
+
+# Danh sách account của customer: lấy từ cache nếu đủ mọi account, không thì đọc DB và nạp lại cache
+def list_accounts(customer_id: str, consistent: bool = False) -> list:
+    if not consistent:
+        account_ids = customer_accounts_cache.get(customer_id)
+        if account_ids is not None:
+            cached = [account_cache.get(account_id) for account_id in account_ids]
+            if all(account is not None for account in cached):
+                return cached
+
+    # consistent=true: đọc primary; còn lại được phép đi tới read replica
+    connct = get_connection(readonly=not consistent)
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT customer_id, account_id, balance FROM account WHERE account_id = ?",
-            account_id
-        )
-        row = cur.fetchone()
-        if not row:
-            return None
-        return Account(                    
-            customer_id = row[0],
-            account_id = row[1],
-            balance = float(row[2]),
-        )
+        accounts = account_repository(connct).list_by_customer(customer_id)
     finally:
-        conn.close()
+        connct.close()
 
-# Lấy email khách hàng từ Customer Service
-def get_customer_email(customer_id: str) -> str:
-    try:
-        res = requests.get(f"{CUSTOMER_SERVICE_URL}/{customer_id}", timeout=5)
-        if res.status_code == 200:
-            data = res.json()
-            return data.get("email")
-        elif res.status_code == 404:
-            raise HTTPException(status_code=404, detail="Customer not found in Customer Service")
-        else:
-            raise HTTPException(status_code=502, detail="Customer Service error")
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Customer Service unavailable: {e}")
-        raise HTTPException(status_code=503, detail="Customer Service unavailable")
-    
-# Lấy tên khách hàng
-def get_customer_name(customer_id: str) -> str:
-    try:
-        res = requests.get(f"{CUSTOMER_SERVICE_URL}/{customer_id}", timeout=5)
-        if res.status_code == 200:
-            data = res.json()
-            return data.get("full_name")
-        elif res.status_code == 404:
-            raise HTTPException(status_code=404, detail="Customer not found in Customer Service")
-        else:
-            raise HTTPException(status_code=502, detail="Customer Service error")
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Customer Service unavailable: {e}")
-        raise HTTPException(status_code=503, detail="Customer Service unavailable")
+    if accounts:
+        for account in accounts:
+            account_cache.put(account["account_id"], account)
+        customer_accounts_cache.put(customer_id, [account["account_id"] for account in accounts])
+    return accounts
+
+# consistent=true: bỏ qua cache, luôn đọc DB
+@app.get("/account/{customer_id}",response_model=CustomerAccounts)
+def getAccountinfo(customer_id : str, consistent: bool = False):
+    # Gọi Customer Service trên thread khác (kèm trace context) trong lúc truy vấn DB
+    customer_check = executor.submit(contextvars.copy_context().run, check_customer, customer_id)
+
+    accounts = list_accounts(customer_id, consistent)
+
+    # Lỗi của customer (404/403/502/503) ưu tiên hơn "không có tài khoản"
+    customer_check.result()
+    if not accounts:
+        raise HTTPException(status_code=404, detail="Account not found")
+
+    return CustomerAccounts(
+        customer_id=customer_id,
+        accounts=accounts,
+        total_balance=round(sum(a["balance"] for a in accounts), 2)
+    )
+
+def find_account_by_id(account_id: str, consistent: bool = False):
+    row = None if consistent else account_cache.get(account_id)
+    if row is None:
+        conn = get_connection()
+        try:
+            row = account_repository(conn).get(account_id)
+        finally:
+            conn.close()
+        if not row:
+            return None
+        account_cache.put(account_id, row)
+    return Account(**row)
 
 # Hàm gửi email bằng cách gọi sang Email Service
 def notify_email(recipient: str, subject: str, body: str):
@@ -150,68 +262,71 @@ def notify_email(recipient: str, subject: str, body: str):
         "body": body
     }
     try:
-        res = requests.post(EMAIL_SERVICE_URL, json=payload, timeout=5)
+        res = resilience.call("email", "POST", EMAIL_SERVICE_URL, json=payload)
         if res.status_code != 200:
-            logging.error(f"Email service returned {res.status_code}: {res.text}")
+            logger.error("Email service returned %s: %s", res.status_code, res.text)
             return False
         return True
     except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to connect to Email Service: {e}")
+        logger.error("Failed to connect to Email Service: %s", e)
         return False      
     
-@app.put("/account/update-balance",response_model=AccountResponse)
-def update_balance(data: BalanceUpdate):
-    logging.info("Get account by id")
+# ================== Balance digest ==================
+# Các biến động số dư của cùng 1 account trong BALANCE_DIGEST_WINDOW giây được gom thành 1 email
+# (thanh toán nhiều hóa đơn liên tiếp -> 1 mail thay vì N mail). 0 = gửi từng mail như cũ.
+# Mail OTP không đi qua đây (Email Service gửi thẳng).
+BALANCE_DIGEST_WINDOW = float(os.getenv("IBANKING_BALANCE_DIGEST_WINDOW", "30"))
+BALANCE_DIGEST_MAX_EVENTS = int(os.getenv("IBANKING_BALANCE_DIGEST_MAX_EVENTS", "20"))
 
-    # Lấy account theo account_id từ DB
-    account = find_account_by_id(data.account_id)
+def balance_change(amount: float) -> tuple:
+    """(nhãn, số tiền có dấu, màu) của 1 biến động: amount dương = ghi nợ (trừ tiền), âm = ghi có (nạp tiền)"""
+    if amount < 0:
+        return "Credit", f"+{-amount:,.2f}", "green"
+    return "Debit", f"-{amount:,.2f}", "#C0392B"
 
-    if not account:
-        raise HTTPException(status_code=404, detail="Account not found")
-    # Tính số dư mới
-    new_balance = account.balance - data.amount
-    if new_balance < 0:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
-
-    # Chặn amount = 0
-    if data.amount == 0:
-        raise HTTPException(status_code=400, detail="Amount must be non-zero")
-    
-    logging.info("Chuan bi cap nhat balance")
-
-    # Cập nhật DB trong transaction
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE account SET balance = ? WHERE account_id = ?",
-            (new_balance, data.account_id)
+def balance_email_body(customer_name: str, account_id: str, events: list) -> str:
+    final = events[-1]
+    if len(events) == 1:
+        label, change, color = balance_change(final["amount"])
+        details = f"""
+        <p>Your account <b>{account_id}</b> has been updated successfully.</p>
+        <p>
+            <b>{label}:</b> <span style="color:{color};">{change} VND</span><br>
+            <b>New Balance:</b> <span style="color:green;">{final["balance"]:,.2f} VND</span><br>
+            <b>Description:</b> {final["description"]}
+        </p>"""
+    else:
+        rows = "".join(
+            f"""
+            <tr>
+                <td style="padding:6px; border-bottom:1px solid #eee;">{event["time"]:%H:%M:%S}</td>
+                <td style="padding:6px; border-bottom:1px solid #eee;">{event["description"]}</td>
+                <td style="padding:6px; border-bottom:1px solid #eee;">{label}</td>
+                <td style="padding:6px; border-bottom:1px solid #eee; text-align:right; color:{color};">{change}</td>
+                <td style="padding:6px; border-bottom:1px solid #eee; text-align:right;">{event["balance"]:,.2f}</td>
+            </tr>"""
+            for event in events
+            for label, change, color in [balance_change(event["amount"])]
         )
-        conn.commit()
-    except pyodbc.Error as e:
-        logging.error(f"DB error in update_balance: {e}")
-        conn.rollback()
-        raise HTTPException(status_code=500, detail="Database error")
-    finally:
-        conn.close()
-    
-    logging.info("Chuan bi gui mail")
-    # Lấy email khách hàng từ Customer Service
-    customer_email = get_customer_email(account.customer_id)
-    customer_name = get_customer_name(account.customer_id)
-    # Gọi Email Service để gửi thông báo
-    subject = "Account Balance Updated"
-    body = f"""
+        details = f"""
+        <p>Your account <b>{account_id}</b> had <b>{len(events)}</b> balance changes:</p>
+        <table style="width:100%; border-collapse:collapse; font-size:14px;">
+            <tr style="background:#f2f4f4;">
+                <th style="padding:6px; text-align:left;">Time</th>
+                <th style="padding:6px; text-align:left;">Description</th>
+                <th style="padding:6px; text-align:left;">Type</th>
+                <th style="padding:6px; text-align:right;">Amount (VND)</th>
+                <th style="padding:6px; text-align:right;">Balance (VND)</th>
+            </tr>{rows}
+        </table>
+        <p><b>New Balance:</b> <span style="color:green;">{final["balance"]:,.2f} VND</span></p>"""
+
+    return f"""
     <html>
     <body style="font-family: Arial, sans-serif; color: #333; background-color: #f8f9fa; padding: 20px;">
         <div style="max-width: 600px; margin: auto; background: #fff; padding: 20px; border-radius: 10px; box-shadow: 0 2px 6px rgba(0,0,0,0.15);">
         <h2 style="color: #2E86C1; text-align:center;">Elevate iBanking - Account Balance Update</h2>
-        <p>Dear <b>{customer_name}</b>,</p>
-        <p>Your account <b>{account.account_id}</b> has been updated successfully.</p>
-        <p>
-            <b>New Balance:</b> <span style="color:green;">{new_balance:,.2f} VND</span><br>
-            <b>Description:</b> {data.description}
-        </p>
+        <p>Dear <b>{customer_name}</b>,</p>{details}
         <p style="margin-top:20px;">Thank you for using <b>Elevate iBanking</b>.</p>
         <hr>
         <footer style="font-size:12px; text-align:center; color:#999;">
@@ -221,15 +336,246 @@ def update_balance(data: BalanceUpdate):
     </body>
     </html>
     """
-    # Muốn test thì thay customer_email thành gmail của mình
-    notify_email(customer_email, subject, body)
+
+# Gửi 1 mail cho cả nhóm biến động (lấy tên + email từ Customer Service, 1 lần cho cả digest)
+def send_balance_digest(account_id: str, events: list):
+    # Request song song có thể tới lệch thứ tự: xếp theo version của dòng account
+    events = sorted(events, key=lambda event: event["version"])
+    try:
+        customer = check_customer(events[-1]["customer_id"])
+    except HTTPException as e:
+        logger.error("Balance notification for %s skipped: %s", account_id, e.detail)
+        return
+
+    subject = "Account Balance Updated"
+    if len(events) > 1:
+        subject = f"Account Balance Updated ({len(events)} transactions)"
+    # Muốn test thì thay customer["email"] thành gmail của mình
+    notify_email(customer["email"], subject, balance_email_body(customer["full_name"], account_id, events))
+
+balance_notifier = DigestNotifier("balance", send_balance_digest, BALANCE_DIGEST_WINDOW,
+                                  max_events=BALANCE_DIGEST_MAX_EVENTS)
+
+# Không chặn request: chỉ đưa sự kiện vào digest, mail được gửi trên thread khác
+def notify_balance_change(row: dict, amount: float, description: str):
+    balance_notifier.add(row["account_id"], {**row, "amount": amount, "description": description, "time": datetime.now()})
+
+def ledger_credit(account_id: str, amount: float, description: str) -> dict:
+    try:
+        row = write_balance(lambda conn: LedgerAccountRepository(conn).credit(account_id, amount, description))
+    except storage.DB_ERRORS as e:
+        logger.error("DB error in ledger credit: %s", e)
+        raise HTTPException(status_code=500, detail="Database error")
+    if not row:
+        raise HTTPException(status_code=404, detail="Account not found")
+    account_cache.put(account_id, row)
+    return row
+
+# Account sharded: cộng/trừ thẳng vào 1 bucket thay vì đọc version rồi ghi số dư tuyệt đối (sẽ phải khóa mọi bucket)
+def sharded_update(account_id: str, amount: float, description: str) -> dict:
+    def work(conn):
+        repo = ShardedAccountRepository(conn)
+        if amount > 0:
+            return repo.debit(account_id, amount, description=description)
+        return repo.credit(account_id, -amount, description)
+
+    try:
+        row = write_balance(work)
+    except DebitRejected as e:
+        if e.reason == "not_found":
+            raise HTTPException(status_code=404, detail="Account not found")
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    except storage.DB_ERRORS as e:
+        logger.error("DB error in sharded update_balance: %s", e)
+        raise HTTPException(status_code=500, detail="Database error")
+    if not row:
+        raise HTTPException(status_code=404, detail="Account not found")
+    # Số dư / version trả về chỉ là ước lượng (không đọc các bucket khác) -> không đưa vào cache,
+    # bỏ entry cũ để lần đọc sau lấy tổng thật từ DB
+    account_cache.invalidate(account_id)
+    return row
+
+@app.put("/account/update-balance",response_model=AccountResponse)
+def update_balance(data: BalanceUpdate):
+    # Chặn amount = 0
+    if data.amount == 0:
+        raise HTTPException(status_code=400, detail="Amount must be non-zero")
+
+    if is_sharded(data.account_id):
+        row = sharded_update(data.account_id, data.amount, data.description)
+        notify_balance_change(row, data.amount, data.description)
+        return AccountResponse(**row, status="Success")
+
+    # Ledger: nạp tiền (amount âm) chỉ là 1 INSERT, không cần đọc version / khóa account
+    if LEDGER_MODE and data.amount < 0:
+        row = ledger_credit(data.account_id, -data.amount, data.description)
+        notify_balance_change(row, data.amount, data.description)
+        return AccountResponse(**row, status="Success")
+
+    # Lần 1 có thể đọc từ cache; nếu version đã cũ thì đọc lại thẳng từ DB và thử thêm 1 lần
+    for attempt in range(2):
+        logger.debug("Get account by id")
+
+        # Lấy account theo account_id (cache hoặc DB)
+        account = find_account_by_id(data.account_id, consistent=attempt > 0)
+
+        if not account:
+            raise HTTPException(status_code=404, detail="Account not found")
+        # Tính số dư mới
+        new_balance = account.balance - data.amount
+        if new_balance < 0:
+            raise HTTPException(status_code=400, detail="Insufficient funds")
+
+        logger.debug("Chuan bi cap nhat balance")
+
+        # Cập nhật DB trong transaction, chỉ khi version chưa đổi kể từ lúc đọc
+        try:
+            row = write_balance(lambda conn: account_repository(conn).set_balance(
+                data.account_id, new_balance, account.version, data.description))
+        except storage.DB_ERRORS as e:
+            logger.error("DB error in update_balance: %s", e)
+            raise HTTPException(status_code=500, detail="Database error")
+
+        if row:
+            # Write-through: cache nhận ngay trạng thái vừa ghi
+            account_cache.put(data.account_id, row)
+            break
+        # Entry cũ (worker khác / request khác vừa ghi): bỏ khỏi cache rồi đọc lại
+        account_cache.invalidate(data.account_id)
+    else:
+        raise HTTPException(status_code=409, detail="Account was modified concurrently, please retry")
+    
+    logger.debug("Chuan bi gui mail")
+    notify_balance_change(row, data.amount, data.description)
     
     return AccountResponse(
     customer_id=account.customer_id,
     account_id=account.account_id,
     balance=new_balance,
+    version=row["version"],
     status="Success"
 )
 
-    
-    
\ No newline at end of file
+# Trừ tiền nguyên tử: kiểm tra chủ tài khoản + số dư và trừ tiền trong cùng 1 câu UPDATE,
+# không gọi Customer Service trên đường đi chính (mail thông báo gom vào digest, gửi nền)
+@app.post("/account/debit", response_model=DebitResponse)
+def debit(data: DebitRequest):
+    try:
+        row = write_balance(lambda conn: account_repository(conn).debit(
+            data.account_id, data.amount, data.customer_id, data.description))
+    except DebitRejected as e:
+        # Trả đúng mã lỗi theo lý do không trừ được
+        if e.reason == "not_found":
+            raise HTTPException(status_code=404, detail="Account not found")
+        if e.reason == "forbidden":
+            raise HTTPException(status_code=403, detail="Account does not belong to this customer")
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    except storage.DB_ERRORS as e:
+        logger.error("DB error in debit: %s", e)
+        raise HTTPException(status_code=500, detail="Database error")
+
+    if is_sharded(data.account_id):
+        account_cache.invalidate(data.account_id)      # như sharded_update: dòng trả về là ước lượng
+    else:
+        account_cache.put(data.account_id, row)
+    customer_id, new_balance = row["customer_id"], row["balance"]
+    notify_balance_change(row, data.amount, data.description)
+
+    return DebitResponse(
+        customer_id=customer_id,
+        account_id=data.account_id,
+        balance=new_balance,
+        status="Success"
+    )
+
+# ================== Ledger queries ==================
+def require_ledger():
+    if not LEDGER_MODE:
+        raise HTTPException(status_code=501, detail="Ledger is not enabled (IBANKING_ACCOUNT_LEDGER=1)")
+
+# Số dư tại thời điểm `at` (mặc định: hiện tại), tính từ snapshot gần nhất trước `at`
+@app.get("/account/{account_id}/balance", response_model=BalanceAt)
+def get_balance_at(account_id: str, at: Optional[datetime] = None):
+    require_ledger()
+    at = at or datetime.now()
+    if at.tzinfo is not None:
+        at = at.astimezone().replace(tzinfo=None)   # DB lưu giờ local không kèm múi giờ
+    conn = get_connection(readonly=True)
+    try:
+        balance = LedgerAccountRepository(conn).balance_at(account_id, at)
+    finally:
+        conn.close()
+    if balance is None:
+        raise HTTPException(status_code=404, detail="No balance recorded for this account at that time")
+    return BalanceAt(account_id=account_id, balance=balance, at=at)
+
+# Lịch sử bút toán, mới nhất trước; trang sau: ?before=<next_before>
+@app.get("/account/{account_id}/ledger", response_model=LedgerPage)
+def get_ledger(account_id: str, limit: int = Query(50, ge=1, le=500), before: Optional[int] = None):
+    require_ledger()
+    conn = get_connection(readonly=True)
+    try:
+        entries = LedgerAccountRepository(conn).history(account_id, limit, before)
+    finally:
+        conn.close()
+    next_before = entries[-1]["entry_id"] if len(entries) == limit else None
+    return LedgerPage(account_id=account_id, entries=entries, next_before=next_before)
+
+def take_ledger_snapshots() -> int:
+    conn = get_connection()
+    try:
+        taken = LedgerAccountRepository(conn).take_snapshots(LEDGER_SNAPSHOT_EVERY)
+        conn.commit()
+        return taken
+    except storage.DB_ERRORS as e:
+        # Worker khác vừa chốt cùng snapshot (trùng khóa) hoặc DB lỗi: lần sau thử lại
+        conn.rollback()
+        logger.warning("Ledger snapshot round failed: %s", e)
+        return 0
+    finally:
+        conn.close()
+
+def run_ledger_snapshots(stop: threading.Event):
+    while not stop.wait(LEDGER_SNAPSHOT_INTERVAL):
+        take_ledger_snapshots()
+
+def start_ledger():
+    # Lần đầu bật ledger: số dư hiện tại thành snapshot mở đầu
+    conn = get_connection()
+    try:
+        LedgerAccountRepository(conn).ensure_opening_snapshots()
+        conn.commit()
+    finally:
+        conn.close()
+    stop = threading.Event()
+    threading.Thread(target=run_ledger_snapshots, args=(stop,), name="ledger-snapshots", daemon=True).start()
+    atexit.register(stop.set)
+
+# Chia bucket cho các account trong SHARDED_ACCOUNTS (hoặc chia lại nếu đổi số bucket), gộp lại account đã bỏ khỏi danh sách
+def start_sharding():
+    conn = None
+    try:
+        conn = get_connection()
+        repo = ShardedAccountRepository(conn)
+        for account_id in set(repo.sharded_accounts()) - SHARDED_ACCOUNTS:
+            repo.unshard(account_id)
+        for account_id in sorted(SHARDED_ACCOUNTS):
+            if not repo.shard(account_id, ACCOUNT_BUCKETS):
+                logger.error("IBANKING_SHARDED_ACCOUNTS: account %s not found", account_id)
+        conn.commit()
+    except storage.DB_ERRORS as e:
+        # DB chưa lên, worker khác đang chia cùng account (trùng khóa) hoặc DB chưa có bảng account_bucket:
+        # service vẫn khởi động, lần khởi động sau sẽ chia lại
+        if conn is not None:
+            conn.rollback()
+        logger.warning("Account sharding skipped: %s", e)
+    finally:
+        if conn is not None:
+            conn.close()
+
+if LEDGER_MODE:
+    if SHARDED_ACCOUNTS:
+        logger.error("IBANKING_SHARDED_ACCOUNTS is ignored while IBANKING_ACCOUNT_LEDGER=1")
+    start_ledger()
+elif SHARDED_ACCOUNTS or UNSHARD_ACCOUNTS:
+    start_sharding()
@@ -16,7 +16,35 @@ GO
 CREATE TABLE account (
     account_id NVARCHAR(50) PRIMARY KEY,
     customer_id NVARCHAR(50),
-    balance DECIMAL(18,2) DEFAULT 0
+    balance DECIMAL(18,2) DEFAULT 0,
+    version INT NOT NULL DEFAULT 1      -- tăng 1 mỗi lần cập nhật số dư (cache + optimistic check)
+);
+
+-- Ledger (IBANKING_ACCOUNT_LEDGER=1): bút toán chỉ INSERT, số dư = snapshot gần nhất + các bút toán sau nó
+CREATE TABLE ledger_entry (
+    entry_id BIGINT IDENTITY PRIMARY KEY,
+    account_id NVARCHAR(50) NOT NULL,
+    amount DECIMAL(18,2) NOT NULL,          -- âm = ghi nợ, dương = ghi có
+    description NVARCHAR(255),
+    created_at DATETIME2 NOT NULL DEFAULT SYSDATETIME()
+);
+CREATE INDEX ix_ledger_entry_account ON ledger_entry (account_id, entry_id) INCLUDE (amount, created_at);
+
+CREATE TABLE balance_snapshot (
+    account_id NVARCHAR(50) NOT NULL,
+    entry_id BIGINT NOT NULL,               -- bút toán cuối đã tính vào balance (0 = số dư mở đầu)
+    balance DECIMAL(18,2) NOT NULL,
+    as_of DATETIME2 NOT NULL,
+    PRIMARY KEY (account_id, entry_id)
+);
+
+-- Account sharded (IBANKING_SHARDED_ACCOUNTS): số dư chia ra N bucket, mỗi giao dịch chỉ khóa 1 bucket
+CREATE TABLE account_bucket (
+    account_id NVARCHAR(50) NOT NULL,
+    bucket_no INT NOT NULL,
+    balance DECIMAL(18,2) NOT NULL DEFAULT 0,
+    version INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (account_id, bucket_no)
 );
 
 -- Thêm dữ liệu mẫu
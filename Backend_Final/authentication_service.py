@@ -2,7 +2,11 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import logging
-import pyodbc
+import metrics
+import storage
+from repositories import AuthRepository
+import tracing
+import log_config
 from passlib.context import CryptContext
 from fastapi import Depends, status
 # from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
@@ -34,26 +38,25 @@ app.add_middleware(
     allow_headers=["*"],          # cho phép mọi header
 )
 
+# Endpoint /metrics + đo latency theo route, trace span cho mỗi request
+metrics.instrument_app(app, "auth")
+tracing.instrument_app(app, "auth")
+
 # OAuth2PasswordBearer sẽ làm Swagger UI hiện nút Authorize
 # oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 # ================== Logging Config ==================
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = log_config.setup_logging("authentication_service", level=logging.INFO)
 
 # ================== Global Exception Handler ==================
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logging.error(f"Unexpected error: {exc}")
+    logger.error("Unexpected error: %s", exc)
     return JSONResponse(status_code=500, content={"detail": "Internal Server Error. Please try again later."})
 
 # ================== DB Connection ==================
 def get_connection():
-    return pyodbc.connect(
-        "DRIVER={ODBC Driver 17 for SQL Server};"
-        "SERVER=DESKTOP-PV9Q0OQ\SQLEXPRESS;"
-        "DATABASE=AuthenticationDB;"
-        "Trusted_Connection=yes;"
-    )
+    return storage.get_connection("AuthenticationDB")
 
 # ================== Password Hash ==================
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -103,26 +106,24 @@ class HashRequest(BaseModel):
 def generate_hash(data: HashRequest):
     try:
         hashed = hash_password(data.password)
-        logging.info("Password hashed successfully")
+        logger.info("Password hashed successfully")
         return {"password": data.password, "hash": hashed}
     except Exception as e:
-        logging.error(f"Error generating hash: {e}")
+        logger.error("Error generating hash: %s", e)
         raise HTTPException(status_code=500, detail="Error generating hash")
     
 @app.post("/auth/login")
 def login(data: LoginRequest):
     conn = get_connection()
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT userId, customer_id, password_hash FROM authentication WHERE username = ?", (data.username,))
-        row = cur.fetchone()
+        row = AuthRepository(conn).find_by_username(data.username)
         if not row:
-            logging.warning(f"Login failed for non-existent user {data.username}")
+            logger.warning("Login failed for non-existent user %s", data.username)
             raise HTTPException(status_code=401, detail="Invalid username or password")
 
-        user_id, customer_id, password_hash = row
+        customer_id, password_hash = row["customer_id"], row["password_hash"]
         if not verify_password(data.password, password_hash):
-            logging.warning(f"Login failed for user {data.username} due to wrong password")
+            logger.warning("Login failed for user %s due to wrong password", data.username)
             raise HTTPException(status_code=401, detail="Invalid username or password")
 
         access_token = create_access_token(data={"sub": data.username})
@@ -134,7 +135,7 @@ def login(data: LoginRequest):
     
     except Exception as e:
         # Các lỗi khác -> 500
-        logging.error(f"Unexpected error in login: {e}")
+        logger.error("Unexpected error in login: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
     
     finally:
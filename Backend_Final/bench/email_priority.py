@@ -0,0 +1,98 @@
+"""Độ trễ mail OTP khi đang có 1 đợt bulk lớn: hàng đợi ưu tiên (delivery.py) so với 1 hàng FIFO chung.
+
+Chạy hoàn toàn trong process với 1 hàm gửi giả lập (--send-ms mỗi mail), không cần service nào:
+  - fifo       cùng số worker, mọi mail chung 1 lớp (như trước khi có hàng đợi ưu tiên)
+  - priority   cấu hình của email_service: otp > notification > bulk, --otp-workers worker riêng cho OTP,
+               bulk gửi theo chunk và nhường worker khi có OTP chờ
+
+Ví dụ:
+    python bench/email_priority.py --bulk 2000 --otp 50 --workers 4 --otp-workers 1
+"""
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from delivery import DeliveryScheduler   # noqa: E402
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+def fake_send(send_ms: float):
+    def send(items):
+        time.sleep(send_ms / 1000 * len(items))
+        return [None] * len(items)
+    return send
+
+def run(args, priority: bool) -> dict:
+    if priority:
+        scheduler = DeliveryScheduler("bench-priority", fake_send(args.send_ms), ("otp", "notification", "bulk"),
+                                      workers=args.workers, reserved={"otp": args.otp_workers}, chunk=args.chunk)
+        otp_class, bulk_class = "otp", "bulk"
+    else:
+        scheduler = DeliveryScheduler("bench-fifo", fake_send(args.send_ms), ("all",), workers=args.workers,
+                                      chunk=args.chunk)
+        otp_class = bulk_class = "all"
+
+    # Đợt bulk: mỗi request /email/send-bulk là 1 job --bulk-size người nhận
+    bulk_futures = [scheduler.submit(bulk_class, [None] * args.bulk_size)
+                    for _ in range(args.bulk // args.bulk_size)]
+
+    latencies = []
+    lock = threading.Lock()
+
+    def send_otp():
+        start = time.perf_counter()
+        scheduler.submit(otp_class, [None]).result()
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    threads = []
+    for _ in range(args.otp):
+        thread = threading.Thread(target=send_otp)
+        thread.start()
+        threads.append(thread)
+        time.sleep(args.otp_interval_ms / 1000)
+    for thread in threads:
+        thread.join()
+
+    start = time.perf_counter()
+    for future in bulk_futures:
+        future.result()
+    scheduler.close()
+    return {
+        "otp_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "otp_p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "otp_max_ms": round(max(latencies) * 1000, 1),
+        "bulk_drain_s": round(time.perf_counter() - start, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OTP email latency under a bulk flood")
+    parser.add_argument("--bulk", type=int, default=2000, help="bulk messages queued before the OTPs")
+    parser.add_argument("--bulk-size", type=int, default=200, help="recipients per send-bulk request")
+    parser.add_argument("--otp", type=int, default=30)
+    parser.add_argument("--otp-interval-ms", type=float, default=20)
+    parser.add_argument("--send-ms", type=float, default=5, help="simulated provider time per message")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--otp-workers", type=int, default=1)
+    parser.add_argument("--chunk", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'mode':10}{'otp p50 ms':>12}{'otp p95 ms':>12}{'otp max ms':>12}{'bulk left s':>13}")
+    for name, priority in (("fifo", False), ("priority", True)):
+        result = run(args, priority)
+        print(f"{name:10}{result['otp_p50_ms']:>12}{result['otp_p95_ms']:>12}{result['otp_max_ms']:>12}"
+              f"{result['bulk_drain_s']:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""So sánh throughput gửi mail giữa các provider (email_providers.py).
+
+Chạy sẵn 1 SMTP sink local (bench/smtp_sink.py) rồi gửi --messages mail với --concurrency thread:
+  - smtp-pooled        SmtpProvider, phiên được dùng lại (mặc định của service)
+  - smtp-per-message   SmtpProvider với max_messages_per_connection=1 (mở phiên mới cho mỗi mail)
+  - smtp-bulk          SmtpProvider.send_many theo lô (đường /email/send-bulk)
+  - gmail              Gmail API thật, chỉ khi có --gmail-to (cần token.json; gửi mail thật!)
+
+--connect-delay-ms / --sink-delay-ms giả lập chi phí mở phiên (TLS + AUTH) và xử lý mỗi mail của server thật.
+
+Ví dụ:
+    python bench/email_throughput.py --messages 500 --concurrency 8 --connect-delay-ms 150
+    python bench/email_throughput.py --gmail-to me@example.com --gmail-messages 10
+"""
+import argparse
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from email_providers import GmailProvider, SmtpProvider   # noqa: E402
+from smtp_sink import SmtpSink                              # noqa: E402
+
+
+def make_message(provider, recipient: str, i: int) -> EmailMessage:
+    message = EmailMessage()
+    message["Subject"] = f"Throughput test #{i}"
+    message["To"] = recipient
+    message["From"] = provider.sender_address()
+    message.set_content(f"<p>Message {i}</p>", subtype="html")
+    return message
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+def run_single(provider, recipient: str, messages: int, concurrency: int) -> dict:
+    def send(i):
+        start = time.perf_counter()
+        provider.send(make_message(provider, recipient, i))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(send, range(messages)))
+    return summarize(messages, time.perf_counter() - start, latencies)
+
+def run_bulk(provider, recipient: str, messages: int, concurrency: int, batch: int) -> dict:
+    def send(offset):
+        start = time.perf_counter()
+        errors = provider.send_many([make_message(provider, recipient, i) for i in range(offset, min(offset + batch, messages))])
+        if any(errors):
+            raise next(e for e in errors if e)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(send, range(0, messages, batch)))
+    return summarize(messages, time.perf_counter() - start, latencies)
+
+def summarize(messages: int, elapsed: float, latencies: list) -> dict:
+    return {
+        "messages": messages,
+        "seconds": round(elapsed, 3),
+        "msg_per_s": round(messages / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Email provider throughput benchmark")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=50, help="messages per send_many call for smtp-bulk")
+    parser.add_argument("--connect-delay-ms", type=float, default=100, help="simulated SMTP session setup (TLS + AUTH)")
+    parser.add_argument("--sink-delay-ms", type=float, default=0, help="simulated server time per message")
+    parser.add_argument("--gmail-to", help="also benchmark the real Gmail API, sending to this address")
+    parser.add_argument("--gmail-messages", type=int, default=10)
+    args = parser.parse_args()
+
+    sink = SmtpSink(delay_ms=args.sink_delay_ms, connect_delay_ms=args.connect_delay_ms).start()
+    recipient = "bench@example.com"
+
+    def smtp(**kwargs):
+        return SmtpProvider(host=sink.host, port=sink.port, security="none", user="", sender="bench@ibanking.local",
+                            pool_size=args.concurrency, **kwargs)
+
+    runs = {
+        "smtp-pooled": lambda: run_single(smtp(), recipient, args.messages, args.concurrency),
+        "smtp-per-message": lambda: run_single(smtp(max_messages_per_connection=1), recipient, args.messages, args.concurrency),
+        "smtp-bulk": lambda: run_bulk(smtp(), recipient, args.messages, args.concurrency, args.batch),
+    }
+    if args.gmail_to:
+        runs["gmail"] = lambda: run_single(GmailProvider(), args.gmail_to, args.gmail_messages, args.concurrency)
+
+    print(f"{'provider':18}{'messages':>9}{'msg/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'sessions':>10}")
+    try:
+        for name, run in runs.items():
+            connections_before = sink.connections
+            result = run()
+            sessions = sink.connections - connections_before if name.startswith("smtp") else "-"
+            print(f"{name:18}{result['messages']:>9}{result['msg_per_s']:>9}{result['p50_ms']:>10}"
+                  f"{result['p95_ms']:>10}{sessions:>10}")
+    finally:
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Commit riêng từng request so với group commit (group_commit.py) cho lệnh ghi settlement của make_payment.
+
+Tạo --threads x --ops payment unpaid trong PaymentDB, rồi --threads thread cùng đánh dấu đã trả
+(UPDATE payment SET status='paid', như make_payment):
+  - per-request      mỗi lệnh 1 transaction + 1 commit (mặc định của service)
+  - group/<linger>   GroupCommitWriter với --max-batch và từng giá trị --linger-ms
+Sau mỗi lượt kiểm tra mọi payment của lượt đó đều đã 'paid'.
+
+Chi phí chính là flush log lúc commit, nên chạy trên đĩa thật (không phải tmpfs) hoặc SQL Server:
+    IBANKING_STORAGE=sqlite IBANKING_SQLITE_DIR=.bench-data python bench/group_commit.py --threads 32
+    IBANKING_STORAGE=mssql python bench/group_commit.py --threads 64 --linger-ms 1,2,5
+"""
+import argparse
+import math
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import storage                                                          # noqa: E402
+from group_commit import FLUSHES, GroupCommitWriter, run_in_transaction   # noqa: E402
+from repositories import PaymentRepository                              # noqa: E402
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+def seed_payments(customer_id: int, count: int) -> list:
+    def work(conn):
+        payments = PaymentRepository(conn)
+        for i in range(count):
+            payments.create(customer_id, 1000 + i, "group commit bench")
+        payments.cur.execute("SELECT transactionId FROM payment WHERE customerId = ?", (customer_id,))
+        return [row[0] for row in payments.cur.fetchall()]
+    return run_in_transaction("PaymentDB", work)
+
+def count_paid(customer_id: int) -> int:
+    def work(conn):
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM payment WHERE customerId = ? AND status = 'paid'", (customer_id,))
+        return cur.fetchone()[0]
+    return run_in_transaction("PaymentDB", work)
+
+def run(name: str, writer, args) -> dict:
+    customer_id = 900000 + uuid.uuid4().int % 100000     # customer riêng cho mỗi lượt, không đụng dữ liệu mẫu
+    transaction_ids = seed_payments(customer_id, args.threads * args.ops)
+
+    def mark_paid(transaction_id):
+        start = time.perf_counter()
+        run_in_transaction("PaymentDB", lambda conn: PaymentRepository(conn).mark_paid(transaction_id, "Paid"),
+                           writer)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        latencies = list(pool.map(mark_paid, transaction_ids))
+    elapsed = time.perf_counter() - start
+
+    commits = len(transaction_ids)
+    if writer is not None:
+        writer.close()
+        commits = int(FLUSHES.labels(writer.name, "committed")._value)
+    return {
+        "tx_per_s": round(len(transaction_ids) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "commits": commits,
+        "avg_batch": round(len(transaction_ids) / max(commits, 1), 1),
+        "all_paid": count_paid(customer_id) == len(transaction_ids),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request commit vs group commit for payment settlement writes")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=50, help="writes per thread")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--linger-ms", default="1,2,5", help="comma separated linger values for group commit")
+    args = parser.parse_args()
+
+    print(f"storage: {storage.STORAGE_BACKEND}, {args.threads} threads x {args.ops} writes, max batch {args.max_batch}")
+    print(f"{'mode':16}{'tx/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'commits':>9}{'avg batch':>11}  check")
+    runs = [("per-request", None)]
+    runs += [(f"group/{linger}ms", float(linger)) for linger in args.linger_ms.split(",")]
+    for name, linger in runs:
+        writer = None if linger is None else GroupCommitWriter(f"bench-{name}", "PaymentDB", args.max_batch, linger)
+        r = run(name, writer, args)
+        print(f"{name:16}{r['tx_per_s']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['commits']:>9}{r['avg_batch']:>11}"
+              f"  {'ok' if r['all_paid'] else 'MISSING'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Kiểm tra thời gian import (cold start) của từng service so với ngân sách trong bench/import_budget.json.
+
+Mỗi service được import trong 1 process Python mới (không cache trong process), lấy median của N lần.
+Thất bại (exit 1) khi:
+  - median vượt budget_ms, hoặc
+  - module nằm trong "forbid" / "forbid_all" bị import sẵn lúc khởi động (phải import lười lúc dùng).
+
+Ví dụ:
+    python bench/import_budget.py
+    python bench/import_budget.py --service email_service --runs 10
+    python bench/import_budget.py --scale 1.5        # máy CI chậm hơn: nới mọi budget x1.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BUDGETS = os.path.join(BENCH_DIR, "import_budget.json")
+
+# Chạy trong process con: đo riêng phần import service, trả JSON qua stdout
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in {forbid!r} if m in sys.modules]}}))
+"""
+
+
+def probe_env() -> dict:
+    # Mặc định sqlite + fake email để chạy được trên mọi máy (không cần SQL Server / pyodbc / Gmail)
+    env = dict(os.environ)
+    env.setdefault("IBANKING_STORAGE", "sqlite")
+    env.setdefault("IBANKING_SQLITE_DIR", ":memory:")
+    env.setdefault("IBANKING_EMAIL_PROVIDER", "fake")
+    env.setdefault("IBANKING_LOG_LEVEL", "ERROR")
+    return env
+
+def probe(module: str, forbid: list, env: dict) -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE.format(module=module, forbid=forbid)],
+                         cwd=SERVICE_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def slowest_imports(module: str, env: dict, top: int = 8) -> list:
+    """Các module tốn nhiều thời gian import nhất (self time, theo python -X importtime) để biết chỗ cần sửa"""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=SERVICE_DIR, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-service import-time budget check")
+    parser.add_argument("--budgets", default=DEFAULT_BUDGETS)
+    parser.add_argument("--service", action="append", help="only check this service (repeatable)")
+    parser.add_argument("--runs", type=int, help="imports per service (default: value in the budgets file)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget by this factor")
+    args = parser.parse_args()
+
+    with open(args.budgets, encoding="utf-8") as f:
+        config = json.load(f)
+    runs = args.runs or config.get("runs", 5)
+    services = config["services"]
+    if args.service:
+        services = {name: services[name] for name in args.service}
+    env = probe_env()
+
+    failed = False
+    print(f"{'service':24}{'median ms':>10}{'budget ms':>11}  result")
+    for module, spec in services.items():
+        forbid = sorted(set(config.get("forbid_all", [])) | set(spec.get("forbid", [])))
+        samples = [probe(module, forbid, env) for _ in range(runs)]
+        median = statistics.median(s["ms"] for s in samples)
+        budget = spec["budget_ms"] * args.scale
+        loaded = sorted({m for s in samples for m in s["loaded"]})
+
+        problems = []
+        if median > budget:
+            problems.append("over budget")
+        if loaded:
+            problems.append("eagerly imports " + ", ".join(loaded))
+        print(f"{module:24}{median:>10.1f}{budget:>11.0f}  {'; '.join(problems) or 'ok'}")
+
+        if problems:
+            failed = True
+            for self_us, name in slowest_imports(module, env):
+                print(f"{'':26}{self_us / 1000:>8.1f} ms  {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""Load test cho luồng thanh toán chính:
+    email/send-confirmation (tùy chọn) -> otp/generate -> otp/verify -> payment/make (-> account/debit)
+
+Ví dụ:
+    python bench/loadtest.py --boot                                  # tự khởi động 6 service rồi chạy mọi scenario
+    python bench/loadtest.py --scenario hot-customer-contention      # service đã chạy sẵn
+    python bench/loadtest.py --boot --compare bench/results/baseline.json
+
+Kết quả (JSON) được ghi vào bench/results/<timestamp>.json để so sánh giữa các build.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+HOST = "127.0.0.1"
+
+
+# ================== Boot services ==================
+def boot_services(services: dict, env=None) -> list:
+    processes = []
+    for module, port in services.items():
+        cmd = [sys.executable, "-m", "uvicorn", f"{module}:app", "--host", HOST, "--port", str(port), "--log-level", "warning"]
+        processes.append(subprocess.Popen(cmd, cwd=SERVICE_DIR, env={**os.environ, **(env or {})}))
+    try:
+        for port in services.values():
+            wait_ready(port)
+    except Exception:
+        stop_services(processes)
+        raise
+    return processes
+
+def wait_ready(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://{HOST}:{port}/metrics", timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Service on port {port} did not become ready")
+
+def stop_services(processes: list):
+    for proc in processes:
+        proc.terminate()
+    for proc in processes:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# ================== Metrics scraping ==================
+def scrape(port: int) -> dict:
+    """Đọc các sample dạng 'name{labels} value' từ /metrics (bỏ qua nếu service không trả)"""
+    samples = {}
+    try:
+        text = requests.get(f"http://{HOST}:{port}/metrics", timeout=5).text
+    except requests.exceptions.RequestException:
+        return samples
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            key, _, value = line.rpartition(" ")
+            try:
+                samples[key] = float(value)
+            except ValueError:
+                pass
+    return samples
+
+def lock_stats(before: dict, after: dict) -> dict:
+    def delta(key):
+        return after.get(key, 0.0) - before.get(key, 0.0)
+    acquired = delta("payment_lock_hold_seconds_count")
+    return {
+        "contention_rejections": delta("payment_lock_contention_total"),
+        "acquired": acquired,
+        "avg_hold_ms": delta("payment_lock_hold_seconds_sum") / acquired * 1000 if acquired else None,
+        "avg_wait_ms": (delta("payment_lock_wait_seconds_sum") / delta("payment_lock_wait_seconds_count") * 1000
+                        if delta("payment_lock_wait_seconds_count") else None),
+    }
+
+
+# ================== Workload ==================
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)     # step -> [(latency_s, status)]
+        self._lock = threading.Lock()
+
+    def record(self, step: str, latency: float, status: int):
+        with self._lock:
+            self.samples[step].append((latency, status))
+
+    def timed(self, step: str, session: requests.Session, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            res = session.request(method, url, timeout=30, **kwargs)
+            status = res.status_code
+        except requests.exceptions.RequestException:
+            res, status = None, 599      # lỗi kết nối -> tính như 5xx
+        self.record(step, time.perf_counter() - start, status)
+        return res
+
+def run_worker(worker_id: int, scenario: dict, ports: dict, recorder: Recorder):
+    customer = scenario["customers"][worker_id % len(scenario["customers"])]
+    customer_id, account_id = customer["customer_id"], customer["account_id"]
+    base = {name: f"http://{HOST}:{port}" for name, port in ports.items()}
+    session = requests.Session()
+
+    for _ in range(scenario["iterations"]):
+        flow_start = time.perf_counter()
+        ok = True
+
+        # Tạo hóa đơn unpaid để make_payment luôn có việc
+        recorder.timed("seed_payment", session, "POST", f"{base['payment_service']}/payment/create",
+                       json={"customerId": int(customer_id), "amount": scenario["amount"], "description": "loadtest"})
+
+        if scenario.get("send_confirmation"):
+            res = recorder.timed("send_confirmation", session, "POST", f"{base['email_service']}/email/send-confirmation",
+                                 json={"customerId": customer_id})
+            ok = ok and res is not None and res.status_code < 300
+
+        res = recorder.timed("otp_generate", session, "POST", f"{base['otp_service']}/otp/generate",
+                             params={"userId": customer_id})
+        otp_code = res.json().get("otpCode") if res is not None and res.status_code == 200 else None
+
+        if otp_code:
+            res = recorder.timed("otp_verify", session, "POST", f"{base['otp_service']}/otp/verify",
+                                 json={"userId": int(customer_id), "otpCode": otp_code})
+            ok = ok and res is not None and res.status_code == 200
+        else:
+            ok = False
+
+        status = 500
+        if ok:
+            res = recorder.timed("make_payment", session, "POST", f"{base['payment_service']}/payment/make",
+                                 json={"customerId": customer_id, "customerPaymentId": customer_id, "accountId": account_id})
+            status = res.status_code if res is not None else 599
+
+        # end_to_end mang status của make_payment (409/400 giữ nguyên), 500 nếu hỏng trước đó
+        recorder.record("end_to_end", time.perf_counter() - flow_start, status)
+
+
+# ================== Report ==================
+def percentile(sorted_values: list, p: float):
+    if not sorted_values:
+        return None
+    # nearest-rank
+    index = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(samples: list, elapsed: float) -> dict:
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = [status for _, status in samples]
+    n = len(samples)
+    to_ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "count": n,
+        "throughput_rps": round(n / elapsed, 2) if elapsed else None,
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p95_ms": to_ms(percentile(latencies, 95)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+        "max_ms": to_ms(latencies[-1] if latencies else None),
+        "rate_409": round(statuses.count(409) / n, 4) if n else 0,
+        "rate_5xx": round(sum(1 for s in statuses if s >= 500) / n, 4) if n else 0,
+    }
+
+def run_scenario(scenario: dict, ports: dict) -> dict:
+    recorder = Recorder()
+    before = scrape(ports["payment_service"])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=scenario["concurrency"]) as pool:
+        for future in [pool.submit(run_worker, i, scenario, ports, recorder) for i in range(scenario["concurrency"])]:
+            future.result()
+    elapsed = time.perf_counter() - start
+    after = scrape(ports["payment_service"])
+    return {
+        "name": scenario["name"],
+        "concurrency": scenario["concurrency"],
+        "iterations": scenario["iterations"],
+        "elapsed_s": round(elapsed, 3),
+        "steps": {step: summarize(samples, elapsed) for step, samples in recorder.samples.items()},
+        "lock": lock_stats(before, after),
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Trả về danh sách regression: p95 tăng hoặc throughput giảm quá `tolerance` (0.1 = 10%)"""
+    regressions = []
+    base_by_name = {s["name"]: s for s in baseline.get("scenarios", [])}
+    for scenario in current["scenarios"]:
+        base = base_by_name.get(scenario["name"])
+        if not base:
+            continue
+        for step, stats in scenario["steps"].items():
+            old = base["steps"].get(step)
+            if not old:
+                continue
+            if old["p95_ms"] and stats["p95_ms"] and stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+                regressions.append(f'{scenario["name"]}/{step}: p95 {old["p95_ms"]} -> {stats["p95_ms"]} ms')
+            if old["throughput_rps"] and stats["throughput_rps"] and \
+                    stats["throughput_rps"] < old["throughput_rps"] * (1 - tolerance):
+                regressions.append(f'{scenario["name"]}/{step}: throughput {old["throughput_rps"]} -> {stats["throughput_rps"]} rps')
+    return regressions
+
+def print_report(result: dict):
+    print(f'\n== {result["name"]} (concurrency={result["concurrency"]}, {result["elapsed_s"]} s)')
+    print(f'{"step":<18}{"count":>7}{"rps":>9}{"p50":>9}{"p95":>9}{"p99":>9}{"409":>8}{"5xx":>8}')
+    for step, s in result["steps"].items():
+        print(f'{step:<18}{s["count"]:>7}{s["throughput_rps"] or 0:>9}{s["p50_ms"] or 0:>9}{s["p95_ms"] or 0:>9}'
+              f'{s["p99_ms"] or 0:>9}{s["rate_409"]:>8}{s["rate_5xx"]:>8}')
+    print(f'lock: {result["lock"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="iBanking payment-flow load test")
+    parser.add_argument("--config", default=os.path.join(BENCH_DIR, "scenarios.json"))
+    parser.add_argument("--scenario", action="append", help="chỉ chạy scenario có tên này (lặp lại được)")
+    parser.add_argument("--boot", action="store_true", help="tự khởi động các service bằng uvicorn")
+    parser.add_argument("--concurrency", type=int, help="ghi đè concurrency của mọi scenario")
+    parser.add_argument("--iterations", type=int, help="ghi đè số vòng lặp mỗi worker")
+    parser.add_argument("--out", help="file kết quả (mặc định bench/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="file kết quả cũ để phát hiện regression")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    with open(args.config, encoding="utf-8") as f:
+        config = json.load(f)
+    ports = config["services"]
+    scenarios = [s for s in config["scenarios"] if not args.scenario or s["name"] in args.scenario]
+    for scenario in scenarios:
+        if args.concurrency:
+            scenario["concurrency"] = args.concurrency
+        if args.iterations:
+            scenario["iterations"] = args.iterations
+
+    processes = boot_services(ports) if args.boot else []
+    try:
+        results = []
+        for scenario in scenarios:
+            result = run_scenario(scenario, ports)
+            print_report(result)
+            results.append(result)
+    finally:
+        stop_services(processes)
+
+    output = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR,
+                                     capture_output=True, text=True).stdout.strip() or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scenarios": results,
+    }
+    out_path = args.out or os.path.join(BENCH_DIR, "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"\nResults written to {out_path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(output, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Throughput của 1 account merchant "nóng" theo số bucket (ShardedAccountRepository, IBANKING_SHARDED_ACCOUNTS).
+
+Tạo 1 account tạm trong AccountDB, với mỗi giá trị --buckets chia số dư ra N bucket rồi cho --threads thread
+cùng ghi có (merchant nhận tiền) / ghi nợ (--debit-ratio) vào account đó:
+  - 0            account thường, mọi giao dịch khóa cùng 1 dòng account (như trước khi có sharding)
+  - N >= 1       mỗi giao dịch chỉ khóa 1 bucket ngẫu nhiên; bucket thiếu tiền -> khóa hết để chia lại
+--hold-ms giả lập phần còn lại của transaction (ghi payment, audit...) trong lúc vẫn giữ khóa dòng.
+Cuối mỗi lượt kiểm tra số dư = số dư đầu + tổng ghi có - tổng ghi nợ thành công.
+
+Cần SQL Server để thấy throughput tăng theo N. SQLite khóa cả file khi ghi nên mọi N cho cùng 1 con số:
+    IBANKING_STORAGE=mssql python bench/sharded_accounts.py --threads 32 --hold-ms 5
+    IBANKING_STORAGE=sqlite IBANKING_SQLITE_DIR=:memory: python bench/sharded_accounts.py
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import storage                                                              # noqa: E402
+from repositories import BUCKET_REBALANCES, DebitRejected, ShardedAccountRepository   # noqa: E402
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+def rebalances() -> float:
+    return BUCKET_REBALANCES.labels("rebalanced")._value
+
+def in_transaction(work):
+    conn = storage.get_connection("AccountDB")
+    try:
+        result = work(ShardedAccountRepository(conn))
+        conn.commit()
+        return result
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def run(account_id: str, buckets: int, args) -> dict:
+    def reshard(repo):
+        if buckets:
+            repo.shard(account_id, buckets)
+        else:
+            repo.unshard(account_id)
+        return repo.get(account_id)["balance"]
+    opening = in_transaction(reshard)
+
+    stats = {"credited": 0.0, "debited": 0.0, "rejected": 0, "errors": 0}
+    latencies = []
+    lock = threading.Lock()
+    rebalances_before = rebalances()
+
+    def transact(_):
+        debit = random.random() < args.debit_ratio
+        amount = round(random.uniform(1, args.max_amount), 2)
+
+        def work(repo):
+            if debit:
+                repo.debit(account_id, amount)
+            else:
+                repo.credit(account_id, amount)
+            if args.hold_ms:
+                time.sleep(args.hold_ms / 1000)
+
+        start = time.perf_counter()
+        try:
+            in_transaction(work)
+            outcome = "debited" if debit else "credited"
+        except DebitRejected:
+            outcome = "rejected"
+        except storage.DB_ERRORS:
+            outcome = "errors"      # deadlock / lock timeout
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            if outcome in ("debited", "credited"):
+                stats[outcome] += amount
+            else:
+                stats[outcome] += 1
+
+    total = args.threads * args.ops
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(transact, range(total)))
+    elapsed = time.perf_counter() - start
+
+    closing = in_transaction(lambda repo: repo.get(account_id)["balance"])
+    return {
+        **stats,
+        "tx_per_s": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "rebalances": int(rebalances() - rebalances_before),
+        "balance_ok": round(opening + stats["credited"] - stats["debited"], 2) == closing,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot merchant account throughput vs number of balance buckets")
+    parser.add_argument("--buckets", default="0,1,2,4,8,16", help="comma separated bucket counts (0 = not sharded)")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=50, help="transactions per thread")
+    parser.add_argument("--debit-ratio", type=float, default=0.5, help="share of payouts / refunds")
+    parser.add_argument("--max-amount", type=float, default=100000)
+    parser.add_argument("--balance", type=float, default=500000,
+                        help="opening balance; small enough that some debits hit an empty bucket")
+    parser.add_argument("--hold-ms", type=float, default=2, help="simulated work done while the row lock is held")
+    args = parser.parse_args()
+
+    account_id = f"BENCH-{uuid.uuid4().hex[:8]}"
+    in_transaction(lambda repo: repo.cur.execute(
+        "INSERT INTO account (account_id, customer_id, balance) VALUES (?, ?, ?)", (account_id, "bench", args.balance)))
+
+    print(f"storage: {storage.STORAGE_BACKEND}, account {account_id}, {args.threads} threads x {args.ops} tx")
+    print(f"{'buckets':>8}{'tx/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'rejected':>10}{'rebalances':>12}{'errors':>8}  balance")
+    try:
+        for buckets in (int(n) for n in args.buckets.split(",")):
+            r = run(account_id, buckets, args)
+            print(f"{buckets:>8}{r['tx_per_s']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['rejected']:>10}"
+                  f"{r['rebalances']:>12}{r['errors']:>8}  {'ok' if r['balance_ok'] else 'MISMATCH'}")
+    finally:
+        def cleanup(repo):
+            repo.cur.execute("DELETE FROM account_bucket WHERE account_id = ?", (account_id,))
+            repo.cur.execute("DELETE FROM account WHERE account_id = ?", (account_id,))
+        in_transaction(cleanup)
+
+
+if __name__ == "__main__":
+    main()
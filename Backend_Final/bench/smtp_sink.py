@@ -0,0 +1,114 @@
+"""SMTP sink tối giản để test / benchmark SmtpProvider mà không gửi mail thật.
+
+Nhận mọi message (EHLO, AUTH PLAIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT), chỉ đếm chứ không lưu.
+Người nhận thuộc domain reject.invalid bị từ chối (550) để thử đường lỗi theo từng message.
+
+Ví dụ:
+    python bench/smtp_sink.py --port 1025
+    IBANKING_EMAIL_PROVIDER=smtp IBANKING_SMTP_PORT=1025 IBANKING_SMTP_SECURITY=none python email_service.py
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+REJECT_DOMAIN = "@reject.invalid"
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        sink = self.server.sink
+        sink._count("connections")
+        if sink.connect_delay_ms:
+            time.sleep(sink.connect_delay_ms / 1000)
+        self.reply("220 smtp-sink ready")
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            command = raw.decode(errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-smtp-sink")
+                self.reply("250-PIPELINING")
+                self.reply("250-8BITMIME")
+                self.reply("250 AUTH PLAIN")
+            elif verb == "HELO":
+                self.reply("250 smtp-sink")
+            elif verb == "AUTH":
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb == "RCPT":
+                if REJECT_DOMAIN in command.lower():
+                    self.reply("550 5.1.1 Recipient rejected")
+                else:
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                if sink.delay_ms:
+                    time.sleep(sink.delay_ms / 1000)
+                sink._count("messages")
+                self.reply("250 OK queued")
+            elif verb in ("MAIL", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SmtpSink:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay_ms: float = 0, connect_delay_ms: float = 0):
+        self.delay_ms = delay_ms
+        self.connect_delay_ms = connect_delay_ms     # giả lập chi phí mở phiên (TCP + TLS + AUTH tới server thật)
+        self.messages = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, name="smtp-sink", daemon=True)
+
+    def _count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def start(self) -> "SmtpSink":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SMTP sink")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--delay-ms", type=float, default=0, help="simulated processing time per message")
+    parser.add_argument("--connect-delay-ms", type=float, default=0, help="simulated session setup time")
+    args = parser.parse_args()
+
+    sink = SmtpSink(args.host, args.port, args.delay_ms, args.connect_delay_ms).start()
+    print(f"SMTP sink listening on {sink.host}:{sink.port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"connections={sink.connections} messages={sink.messages}")
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
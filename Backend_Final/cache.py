@@ -0,0 +1,81 @@
+import time
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# ================== In-process TTL cache ==================
+# Cache nhỏ trong bộ nhớ của 1 process (mỗi worker uvicorn có cache riêng).
+# ttl <= 0 nghĩa là tắt cache: get() luôn miss, put() không lưu gì.
+
+CACHE_REQUESTS = metrics.counter("cache_requests_total", "In-process cache lookups by result", ("cache", "result"))
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, name: str, ttl: float, maxsize: int = 10000):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()     # key -> (expires_at, value), thứ tự LRU
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, key, default=None):
+        if not self.enabled:
+            return default
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._data.move_to_end(key)
+                value = entry[1]
+            else:
+                if entry is not _MISSING:
+                    del self._data[key]
+                value = _MISSING
+        CACHE_REQUESTS.labels(self.name, "miss" if value is _MISSING else "hit").inc()
+        return default if value is _MISSING else value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        # Gọi khi đang giữ self._lock
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class VersionedCache(TTLCache):
+    """TTLCache cho giá trị có version tăng dần (vd. dòng account): put() không bao giờ
+    ghi đè bản mới hơn bằng bản cũ hơn, kể cả khi các thread ghi lệch thứ tự"""
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 10000, version_key: str = "version"):
+        super().__init__(name, ttl, maxsize)
+        self.version_key = version_key
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1][self.version_key] > value[self.version_key]:
+                return
+            self._store(key, value)
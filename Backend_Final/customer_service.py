@@ -4,7 +4,12 @@ from pydantic import BaseModel, EmailStr, Field
 from fastapi.responses import JSONResponse
 from typing import Annotated
 import logging
-import pyodbc
+import http_cache
+import metrics
+import storage
+from repositories import CustomerRepository
+import tracing
+import log_config
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI()
@@ -24,8 +29,15 @@ app.add_middleware(
     allow_headers=["*"],          # cho phép mọi header
 )
 
+# ETag / 304 cho client poll + nén gzip/brotli response lớn (http_cache.py)
+http_cache.instrument_app(app)
+
+# Endpoint /metrics + đo latency theo route, trace span cho mỗi request
+metrics.instrument_app(app, "customer")
+tracing.instrument_app(app, "customer")
+
 # Cấu hình logging để theo dõi lỗi
-logging.basicConfig(level=logging.ERROR)
+logger = log_config.setup_logging("customer_service", level=logging.ERROR)
 
 class Customer(BaseModel):
     customer_id : str
@@ -33,19 +45,14 @@ class Customer(BaseModel):
     phone_number: Annotated[str, Field(pattern=r"^(0\d{9})$")]# Bắt đầu bằng 0 + 9 số = 10 số
     email: EmailStr 
     
-def get_connection():
-    return pyodbc.connect(
-        "DRIVER={ODBC Driver 17 for SQL Server};"
-        "SERVER=DESKTOP-PV9Q0OQ\SQLEXPRESS;"       # Thay bằng tên sever trên máy đang chạy
-        "DATABASE=CustomerDB;"
-        "Trusted_Connection=yes;"
-    )    
+def get_connection(readonly: bool = False):
+    return storage.get_connection("CustomerDB", readonly=readonly)
     
     
 # Xử lý lỗi hệ thống (500) toàn cục
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logging.error(f"Unexpected error: {exc}")  # log lỗi để debug
+    logger.error("Unexpected error: %s", exc)  # log lỗi để debug
     return JSONResponse(
         status_code=500,
         content={"detail": "Internal Server Error. Please try again later."},
@@ -54,10 +61,8 @@ async def global_exception_handler(request: Request, exc: Exception):
    
 @app.get("/customers/{customer_id}",response_model=Customer)
 def getCustomerInfo(customer_id : str): 
-    connct = get_connection()
-    cur = connct.cursor()
-    cur.execute("SELECT customer_id, full_name, phone_number, email FROM Customers WHERE customer_id = ?", customer_id)
-    row = cur.fetchone()
+    connct = get_connection(readonly=True)
+    row = CustomerRepository(connct).get(customer_id)
     try:
         # Trường hợp 404
         if not row:
@@ -71,7 +76,7 @@ def getCustomerInfo(customer_id : str):
         raise http_exc
     except Exception as e:
         # Các lỗi khác -> 500
-        logging.error(f"Unexpected error in get_customer: {e}")
+        logger.error("Unexpected error in get_customer: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
     
     finally:
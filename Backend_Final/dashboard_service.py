@@ -0,0 +1,126 @@
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import contextvars
+import logging
+import os
+import time
+import requests
+import http_cache
+import metrics
+import tracing
+import log_config
+import resilience
+from fastapi.middleware.cors import CORSMiddleware
+
+app = FastAPI(title="Dashboard Service")
+
+# Cho phép origin từ React
+origins = [
+    "http://localhost:5173",   # Vite dev server
+    "http://127.0.0.1:5173",
+    # có thể thêm domain production sau này
+]
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=origins,        # danh sách origin được phép
+    allow_credentials=True,
+    allow_methods=["*"],          # GET, POST, PUT, DELETE...
+    allow_headers=["*"],          # cho phép mọi header
+)
+
+# ETag / 304 cho client poll + nén gzip/brotli response lớn (http_cache.py)
+http_cache.instrument_app(app)
+
+# Endpoint /metrics + đo latency theo route, trace span cho mỗi request
+metrics.instrument_app(app, "dashboard")
+tracing.instrument_app(app, "dashboard")
+
+# ================== Logging ==================
+logger = log_config.setup_logging("dashboard_service", level=logging.INFO)
+
+# ================== URL các service ==================
+CUSTOMER_SERVICE_URL = "http://127.0.0.1:8000/customers"
+ACCOUNT_SERVICE_URL = "http://127.0.0.1:8001/account"
+PAYMENT_SERVICE_URL = "http://127.0.0.1:8003/payment"
+
+# Thời gian tối đa chờ cả 3 phần (giây); phần nào chưa xong thì trả null + lỗi
+DASHBOARD_TIMEOUT = float(os.getenv("IBANKING_DASHBOARD_TIMEOUT", "3"))
+
+# Pool dùng chung cho các lời gọi fan-out (mỗi request dùng 3 thread)
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("IBANKING_DASHBOARD_WORKERS", "32")),
+                              thread_name_prefix="dashboard")
+
+# ================== Exception Handler ==================
+@app.exception_handler(Exception)
+async def global_exception_handler(request: Request, exc: Exception):
+    logger.error("Unexpected error: %s", exc)
+    return JSONResponse(status_code=500, content={"detail": "Internal Server Error. Please try again later."})
+
+# ================== Fan-out helpers ==================
+class PartError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def fetch_json(dependency: str, url: str, not_found_ok: bool = False):
+    """GET 1 phần của dashboard; 404 -> None nếu not_found_ok (ví dụ không có hóa đơn unpaid)"""
+    try:
+        res = resilience.call(dependency, "GET", url)
+    except requests.exceptions.RequestException as e:
+        raise PartError(503, f"{dependency} service unavailable: {e}")
+    if res.status_code == 200:
+        return res.json()
+    if res.status_code == 404 and not_found_ok:
+        return None
+    try:
+        detail = res.json().get("detail", "error")
+    except ValueError:
+        detail = res.text or "error"
+    raise PartError(res.status_code, detail)
+
+def submit(fn, *args, **kwargs):
+    # Chép context để span hiện tại (trace) đi theo sang thread của pool
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, fn, *args, **kwargs)
+
+# ================== Endpoints ==================
+@app.get("/dashboard/{customer_id}")
+def get_dashboard(customer_id: str):
+    """Profile + accounts + hóa đơn unpaid lấy song song; phần nào lỗi thì null và ghi vào `errors`"""
+    futures = {
+        "profile": submit(fetch_json, "customer", f"{CUSTOMER_SERVICE_URL}/{customer_id}"),
+        "accounts": submit(fetch_json, "account", f"{ACCOUNT_SERVICE_URL}/{customer_id}"),
+        "unpaid": submit(fetch_json, "payment", f"{PAYMENT_SERVICE_URL}/unpaid/{customer_id}", not_found_ok=True),
+    }
+
+    deadline = time.monotonic() + DASHBOARD_TIMEOUT
+    result = {"customer_id": customer_id, "errors": {}}
+    for part, future in futures.items():
+        try:
+            result[part] = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except PartError as e:
+            result[part] = None
+            result["errors"][part] = {"status": e.status_code, "detail": e.detail}
+        except FutureTimeoutError:
+            result[part] = None
+            result["errors"][part] = {"status": 504, "detail": f"{part} timed out"}
+
+    # Account Service trả {accounts, total_balance}: đưa lên cùng cấp với profile
+    accounts = result.pop("accounts")
+    result["accounts"] = accounts["accounts"] if accounts else None
+    result["total_balance"] = accounts["total_balance"] if accounts else None
+
+    # Không có customer thì cả dashboard không có nghĩa
+    if result["errors"].get("profile", {}).get("status") == 404:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    if result["errors"]:
+        logger.warning("Dashboard for %s degraded: %s", customer_id, list(result["errors"]))
+    return result
+
+# ================== Run ==================
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=8006)
@@ -0,0 +1,172 @@
+import atexit
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import metrics
+
+# ================== Priority delivery scheduler ==================
+# Hàng đợi theo lớp ưu tiên (vd. otp > notification > bulk) dùng chung 1 nhóm worker:
+#   - worker chung luôn lấy job của lớp cao nhất đang có việc
+#   - một số worker được giữ riêng cho từng lớp (reserved) -> lớp đó không bao giờ phải chờ lớp khác chiếm hết worker
+#   - job nhiều phần tử (bulk) được gửi theo từng chunk; giữa 2 chunk, nếu lớp cao hơn đang có việc chờ
+#     thì phần còn lại được trả về đầu hàng đợi của nó (preempt) để worker quay sang lớp cao hơn
+#   - job quá max_age của lớp (vd. OTP đã hết hạn) thì bỏ, không gửi nữa
+# Chỉ xếp hàng trong 1 process: nhiều worker uvicorn thì mỗi process có scheduler riêng.
+
+QUEUE_DEPTH = metrics.gauge("delivery_queue_depth", "Items queued or being sent by a delivery scheduler", ("queue", "class"))
+QUEUE_WAIT = metrics.histogram("delivery_queue_wait_seconds", "Time from submit until a worker starts the job",
+                               ("queue", "class"))
+DELIVERY_LATENCY = metrics.histogram("delivery_latency_seconds", "Time from submit until an item has been sent",
+                                     ("queue", "class"))
+DELIVERY_ITEMS = metrics.counter("delivery_items_total", "Items delivered by outcome", ("queue", "class", "outcome"))
+PREEMPTIONS = metrics.counter("delivery_preemptions_total", "Jobs put back because a higher class was waiting",
+                              ("queue", "class"))
+
+logger = logging.getLogger("delivery")
+
+
+class DeliveryExpired(Exception):
+    pass
+
+
+class _Job:
+    def __init__(self, cls: str, items: list, deadline):
+        self.cls = cls
+        self.items = items
+        self.errors = []                # lỗi của từng item đã xử lý (None = gửi được)
+        self.deadline = deadline
+        self.submitted = time.monotonic()
+        self.started = False
+        self.future = Future()
+        self.context = contextvars.copy_context()   # giữ trace context của request đã submit
+
+
+class DeliveryScheduler:
+    def __init__(self, name: str, send, classes: tuple, workers: int, reserved: dict = None,
+                 chunk: int = 10, max_age: dict = None, on_expired=None):
+        self.name = name
+        self.send = send                # send(items) -> list lỗi (None = ok), chạy trên thread worker
+        self.classes = tuple(classes)   # thứ tự ưu tiên giảm dần
+        self.chunk = max(chunk, 1)
+        self.max_age = max_age or {}    # class -> giây
+        self.on_expired = on_expired    # on_expired(items, error) để ghi log các item bị bỏ
+        self._queues = {cls: deque() for cls in self.classes}
+        self._depth = {cls: 0 for cls in self.classes}     # item chưa xong (đang chờ + đang gửi)
+        self._cond = threading.Condition()
+        self._closed = False
+
+        reserved = reserved or {}
+        shared = workers - sum(reserved.values())
+        if shared < 1:
+            raise ValueError(f"{name}: need at least 1 shared worker ({workers} workers, reserved {reserved})")
+        lanes = [(self.classes, f"delivery-{name}-{i}") for i in range(shared)]
+        for cls, count in reserved.items():
+            lanes += [((cls,), f"delivery-{name}-{cls}-{i}") for i in range(count)]
+        self._threads = [threading.Thread(target=self._run, args=(serves,), name=thread_name, daemon=True)
+                         for serves, thread_name in lanes]
+        for thread in self._threads:
+            thread.start()
+        atexit.register(self.close)
+
+    def submit(self, cls: str, items: list) -> Future:
+        """Xếp items vào lớp cls; Future trả về list lỗi theo đúng thứ tự items"""
+        if cls not in self._queues:
+            raise ValueError(f"Unknown delivery class: {cls}")
+        max_age = self.max_age.get(cls)
+        job = _Job(cls, list(items), None if max_age is None else time.monotonic() + max_age)
+        if not job.items:
+            job.future.set_result([])
+            return job.future
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Delivery scheduler {self.name} is closed")
+            self._queues[cls].append(job)
+            self._depth[cls] += len(job.items)
+            QUEUE_DEPTH.labels(self.name, cls).inc(len(job.items))
+            self._cond.notify_all()
+        return job.future
+
+    def depth(self) -> dict:
+        with self._cond:
+            return dict(self._depth)
+
+    def _next_job(self, serves: tuple):
+        with self._cond:
+            while True:
+                for cls in serves:
+                    if self._queues[cls]:
+                        return self._queues[cls].popleft()
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+    def _higher_waiting(self, cls: str) -> bool:
+        with self._cond:
+            return any(self._queues[higher] for higher in self.classes[:self.classes.index(cls)])
+
+    def _requeue(self, job: _Job):
+        with self._cond:
+            self._queues[job.cls].appendleft(job)
+            self._cond.notify_all()
+
+    def _run(self, serves: tuple):
+        while True:
+            job = self._next_job(serves)
+            if job is None:
+                return
+            try:
+                self._process(job)
+            except Exception as e:
+                # Lỗi ngoài dự kiến trong send(): các item còn lại coi như thất bại, worker vẫn chạy tiếp
+                logger.error("Delivery %s/%s failed: %s", self.name, job.cls, e)
+                self._finish(job, [e] * (len(job.items) - len(job.errors)))
+
+    def _process(self, job: _Job):
+        if not job.started:
+            job.started = True
+            QUEUE_WAIT.labels(self.name, job.cls).observe(time.monotonic() - job.submitted)
+        while len(job.errors) < len(job.items):
+            if job.deadline is not None and time.monotonic() > job.deadline:
+                error = DeliveryExpired(f"{job.cls} delivery expired after {self.max_age[job.cls]}s in queue")
+                remaining = job.items[len(job.errors):]
+                if self.on_expired is not None:
+                    job.context.run(self.on_expired, remaining, error)
+                self._finish(job, [error] * len(remaining))
+                return
+            chunk = job.items[len(job.errors):len(job.errors) + self.chunk]
+            errors = job.context.run(self.send, chunk)
+            self._finish(job, errors)
+            if len(job.errors) < len(job.items) and self._higher_waiting(job.cls):
+                PREEMPTIONS.labels(self.name, job.cls).inc()
+                self._requeue(job)
+                return
+
+    def _finish(self, job: _Job, errors: list):
+        """Ghi nhận kết quả của 1 phần job; xong hết thì trả Future"""
+        job.errors += errors
+        with self._cond:
+            self._depth[job.cls] -= len(errors)
+        QUEUE_DEPTH.labels(self.name, job.cls).dec(len(errors))
+        elapsed = time.monotonic() - job.submitted
+        for error in errors:
+            if isinstance(error, DeliveryExpired):
+                DELIVERY_ITEMS.labels(self.name, job.cls, "expired").inc()
+                continue
+            DELIVERY_LATENCY.labels(self.name, job.cls).observe(elapsed)
+            DELIVERY_ITEMS.labels(self.name, job.cls, "sent" if error is None else "failed").inc()
+        if len(job.errors) >= len(job.items):
+            job.future.set_result(job.errors)
+
+    def close(self):
+        """Gửi nốt các job đang chờ rồi dừng worker (khi tắt service)"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
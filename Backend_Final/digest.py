@@ -0,0 +1,94 @@
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# ================== Coalescing notifier ==================
+# Gom các sự kiện cùng key (vd. account_id) trong 1 cửa sổ thời gian rồi gọi flush(key, events) 1 lần.
+# Cửa sổ tính từ sự kiện đầu tiên của key -> độ trễ tối đa của 1 thông báo = window.
+# Chỉ gom trong 1 process: nhiều worker thì mỗi worker gửi digest riêng.
+
+DIGEST_EVENTS = metrics.counter("digest_events_total", "Events handed to a coalescing notifier", ("digest",))
+DIGEST_FLUSHES = metrics.counter("digest_flushes_total", "Digests sent by a coalescing notifier", ("digest",))
+
+logger = logging.getLogger("digest")
+
+
+class DigestNotifier:
+    def __init__(self, name: str, flush, window: float, max_events: int = 50, senders: int = 4):
+        self.name = name
+        self.flush = flush              # flush(key, events) chạy trên thread của pool, không phải thread gọi add()
+        self.window = window            # <= 0: tắt gom, add() gửi ngay
+        self.max_events = max_events    # đủ số sự kiện thì gửi sớm, không chờ hết cửa sổ
+        self._pending = {}              # key -> (deadline, [events])
+        self._cond = threading.Condition()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=senders, thread_name_prefix=f"digest-{name}")
+        self._thread = threading.Thread(target=self._run, name=f"digest-{name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, key, event):
+        DIGEST_EVENTS.labels(self.name).inc()
+        with self._cond:
+            closed = self._closed
+            ready = [event]
+            if not closed and self.window > 0:
+                deadline, events = self._pending.setdefault(key, (time.monotonic() + self.window, []))
+                events.append(event)
+                if len(events) < self.max_events:
+                    self._cond.notify()
+                    return
+                ready = self._pending.pop(key)[1]
+        if closed:
+            # Đang tắt: pool đã dừng, gửi luôn trên thread hiện tại
+            DIGEST_FLUSHES.labels(self.name).inc()
+            self._flush_safe(key, ready)
+            return
+        self._dispatch(key, ready)
+
+    def _dispatch(self, key, events):
+        DIGEST_FLUSHES.labels(self.name).inc()
+        try:
+            self._executor.submit(self._flush_safe, key, events)
+        except RuntimeError:
+            # Interpreter đang tắt (concurrent.futures đã dừng nhận việc): gửi luôn trên thread hiện tại
+            self._flush_safe(key, events)
+
+    def _flush_safe(self, key, events):
+        try:
+            self.flush(key, events)
+        except Exception as e:
+            logger.error("Digest %s flush for %s failed: %s", self.name, key, e)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                due = [key for key, (deadline, _) in self._pending.items() if deadline <= now]
+                ready = [(key, self._pending.pop(key)[1]) for key in due]
+                if not ready:
+                    next_deadline = min((deadline for deadline, _ in self._pending.values()), default=None)
+                    self._cond.wait(None if next_deadline is None else next_deadline - now)
+                    continue
+            for key, events in ready:
+                self._dispatch(key, events)
+
+    def close(self):
+        """Gửi hết các digest đang chờ (khi tắt service) rồi dừng"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            pending, self._pending = self._pending, {}
+            self._cond.notify()
+        # Chạy từ atexit, lúc concurrent.futures đã thôi nhận việc mới: gửi trên thread gọi close()
+        for key, (_, events) in pending.items():
+            DIGEST_FLUSHES.labels(self.name).inc()
+            self._flush_safe(key, events)
+        self._executor.shutdown(wait=True)
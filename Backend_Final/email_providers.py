@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import base64
+import queue
+import random
+import smtplib
+import functools
+import logging
+import threading
+from collections import deque
+from email.message import EmailMessage
+
+import tracing
+
+# ================== Config ==================
+# IBANKING_EMAIL_PROVIDER = gmail (mặc định) | smtp | fake (không gửi thật, dùng cho load test / profiling)
+EMAIL_PROVIDER = os.getenv("IBANKING_EMAIL_PROVIDER", "gmail").lower()
+FAKE_EMAIL_DELAY_MS = float(os.getenv("IBANKING_FAKE_EMAIL_DELAY_MS", "0"))      # giả lập latency của Gmail
+FAKE_EMAIL_FAILURE_RATE = float(os.getenv("IBANKING_FAKE_EMAIL_FAILURE_RATE", "0"))
+
+# SMTP (vd. smtp.gmail.com:587 với App Password, hoặc relay nội bộ)
+SMTP_HOST = os.getenv("IBANKING_SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("IBANKING_SMTP_PORT", "587"))
+SMTP_USER = os.getenv("IBANKING_SMTP_USER", "")
+SMTP_PASSWORD = os.getenv("IBANKING_SMTP_PASSWORD", "")
+SMTP_SECURITY = os.getenv("IBANKING_SMTP_SECURITY", "starttls").lower()      # starttls | ssl | none
+SMTP_FROM = os.getenv("IBANKING_SMTP_FROM", SMTP_USER or "noreply@ibanking.local")
+SMTP_POOL_SIZE = int(os.getenv("IBANKING_SMTP_POOL_SIZE", "4"))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("IBANKING_SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+SMTP_TIMEOUT = float(os.getenv("IBANKING_SMTP_TIMEOUT", "10"))
+
+# Gmail API scopes
+SCOPES = [
+    'https://www.googleapis.com/auth/gmail.readonly',
+    'https://www.googleapis.com/auth/gmail.send',
+    'https://www.googleapis.com/auth/gmail.compose'
+]
+
+logger = logging.getLogger("email_service.providers")
+
+# google-* được import trong hàm (không phải đầu file): service không gửi Gmail thì không tốn thời gian import
+@functools.lru_cache(maxsize=None)
+def _gmail_discovery_document() -> dict:
+    """Discovery document của Gmail v1 đóng gói sẵn trong google-api-python-client (không tải qua mạng), parse 1 lần"""
+    from googleapiclient.discovery_cache import get_static_doc
+
+    doc = get_static_doc("gmail", "v1")
+    if doc is None:
+        raise RuntimeError("Static discovery document for gmail v1 not found; upgrade google-api-python-client")
+    return json.loads(doc)
+
+
+class EmailSendError(Exception):
+    pass
+
+
+class EmailProvider:
+    """Interface: gửi 1 EmailMessage đã có To/Subject/nội dung; From do provider điền"""
+
+    name = ""
+
+    def sender_address(self) -> str:
+        raise NotImplementedError
+
+    def send(self, message: EmailMessage):
+        raise NotImplementedError
+
+    def send_many(self, messages: list) -> list:
+        """Gửi nhiều message; trả về list lỗi tương ứng (None = thành công). Provider có thể gửi chung 1 kết nối"""
+        errors = []
+        for message in messages:
+            try:
+                self.send(message)
+                errors.append(None)
+            except EmailSendError as e:
+                errors.append(e)
+        return errors
+
+
+# ================== Gmail API ==================
+class GmailProvider(EmailProvider):
+    name = "gmail"
+
+    def __init__(self, token_file: str = "token.json", client_secrets_file: str = "credentials_desktop_apps.json",
+                 port: int = 0):
+        self.token_file = token_file
+        self.client_secrets_file = client_secrets_file
+        self.port = port
+        self._creds = None
+        self._creds_lock = threading.Lock()
+        self._sender = None
+        # Service của googleapiclient (httplib2) không thread-safe: mỗi thread giữ 1 bản, tạo 1 lần
+        self._local = threading.local()
+
+    def _credentials(self):
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        with self._creds_lock:
+            creds = self._creds
+            if creds is None and os.path.exists(self.token_file):
+                creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
+
+            if not creds or not creds.valid:
+                if creds and creds.expired and creds.refresh_token:
+                    creds.refresh(Request())
+                else:
+                    flow = InstalledAppFlow.from_client_secrets_file(self.client_secrets_file, SCOPES)
+                    creds = flow.run_local_server(port=self.port)
+
+                with open(self.token_file, 'w') as token:
+                    token.write(creds.to_json())
+            self._creds = creds
+            return creds
+
+    def _service(self):
+        service = getattr(self._local, "service", None)
+        if service is None:
+            from googleapiclient.discovery import build_from_document
+
+            # Credentials tự refresh trước mỗi request khi hết hạn, nên service dùng lại được lâu dài
+            with tracing.start_span("gmail.build", kind="internal"):
+                service = build_from_document(_gmail_discovery_document(), credentials=self._credentials())
+            self._local.service = service
+        return service
+
+    def sender_address(self) -> str:
+        from googleapiclient.errors import HttpError
+
+        # Địa chỉ của tài khoản gửi không đổi: chỉ hỏi Gmail 1 lần
+        if self._sender is None:
+            try:
+                with tracing.start_span("gmail.users.getProfile", kind="client"):
+                    self._sender = self._service().users().getProfile(userId='me').execute()['emailAddress']
+            except HttpError as e:
+                raise EmailSendError(str(e)) from e
+        return self._sender
+
+    def send(self, message: EmailMessage):
+        from googleapiclient.errors import HttpError
+
+        encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+        try:
+            with tracing.start_span("gmail.users.messages.send", kind="client"):
+                self._service().users().messages().send(userId="me", body={'raw': encoded_message}).execute()
+        except HttpError as e:
+            raise EmailSendError(str(e)) from e
+
+
+# ================== SMTP (pooled) ==================
+class _SmtpSession:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SmtpProvider(EmailProvider):
+    """Giữ tối đa pool_size phiên SMTP đã đăng nhập và dùng lại cho nhiều message
+    (không TLS handshake + AUTH lại mỗi lần). Phiên được thay mới sau max_messages_per_connection message."""
+
+    name = "smtp"
+    IDLE_CHECK_AFTER = 30      # phiên rảnh lâu hơn N giây thì NOOP kiểm tra trước khi dùng lại
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, user: str = SMTP_USER,
+                 password: str = SMTP_PASSWORD, security: str = SMTP_SECURITY, sender: str = SMTP_FROM,
+                 pool_size: int = SMTP_POOL_SIZE, max_messages_per_connection: int = SMTP_MAX_MESSAGES_PER_CONNECTION,
+                 timeout: float = SMTP_TIMEOUT):
+        if security not in ("starttls", "ssl", "none"):
+            raise RuntimeError(f"Unknown IBANKING_SMTP_SECURITY: {security}")
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.security = security
+        self.sender = sender
+        self.max_messages_per_connection = max_messages_per_connection
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()     # phiên rảnh; LIFO để phiên ít dùng tự hết hạn phía server
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def sender_address(self) -> str:
+        return self.sender
+
+    def _connect(self) -> _SmtpSession:
+        with tracing.start_span("smtp.connect", kind="client", attributes={"net.peer.name": self.host}):
+            if self.security == "ssl":
+                smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+            else:
+                smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+                if self.security == "starttls":
+                    smtp.starttls()
+            if self.user:
+                smtp.login(self.user, self.password)
+        return _SmtpSession(smtp)
+
+    @staticmethod
+    def _close(session: _SmtpSession):
+        try:
+            session.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            session.smtp.close()
+
+    def _checkout(self) -> _SmtpSession:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise EmailSendError("SMTP pool exhausted")
+        try:
+            while True:
+                try:
+                    session = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if time.monotonic() - session.last_used < self.IDLE_CHECK_AFTER:
+                    return session
+                try:
+                    if session.smtp.noop()[0] == 250:
+                        return session
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self._close(session)
+        except (smtplib.SMTPException, OSError) as e:
+            self._slots.release()
+            raise EmailSendError(f"SMTP connect failed: {e}") from e
+
+    def _checkin(self, session: _SmtpSession, broken: bool = False):
+        if broken or session.sent >= self.max_messages_per_connection:
+            self._close(session)
+        else:
+            session.last_used = time.monotonic()
+            self._idle.put(session)
+        self._slots.release()
+
+    def _send_on(self, session: _SmtpSession, message: EmailMessage):
+        with tracing.start_span("smtp.send", kind="client", attributes={"net.peer.name": self.host}):
+            session.smtp.send_message(message)
+        session.sent += 1
+
+    def send(self, message: EmailMessage):
+        error = self.send_many([message])[0]
+        if error is not None:
+            raise error
+
+    def send_many(self, messages: list) -> list:
+        """Các message được gửi nối tiếp trên cùng 1 phiên; mất kết nối thì mở phiên mới và gửi lại message đó 1 lần"""
+        errors = []
+        session = None
+        try:
+            for message in messages:
+                error = None
+                for attempt in range(2):
+                    try:
+                        if session is None or session.sent >= self.max_messages_per_connection:
+                            if session is not None:
+                                self._checkin(session)
+                                session = None
+                            session = self._checkout()
+                        self._send_on(session, message)
+                        error = None
+                        break
+                    except EmailSendError as e:
+                        # Không mở được phiên: các message còn lại cũng không gửi được
+                        errors += [e] * (len(messages) - len(errors))
+                        return errors
+                    except smtplib.SMTPServerDisconnected as e:
+                        # Server đóng phiên rảnh: bỏ phiên cũ, thử lại trên phiên mới
+                        self._checkin(session, broken=True)
+                        session = None
+                        error = EmailSendError(f"SMTP connection lost: {e}")
+                    except smtplib.SMTPException as e:
+                        # Lỗi theo từng message (người nhận bị từ chối, ...): phiên vẫn dùng tiếp được
+                        error = EmailSendError(str(e))
+                        break
+                    except OSError as e:
+                        # Lỗi mạng (SMTPException cũng là OSError nên phải bắt sau)
+                        self._checkin(session, broken=True)
+                        session = None
+                        error = EmailSendError(f"SMTP connection lost: {e}")
+                errors.append(error)
+        finally:
+            if session is not None:
+                self._checkin(session)
+        return errors
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+# ================== Fake (offline) ==================
+class FakeProvider(EmailProvider):
+    """Không gửi ra ngoài: giữ lại các message gần nhất trong outbox (để test / benchmark)"""
+
+    name = "fake"
+
+    def __init__(self, delay_ms: float = FAKE_EMAIL_DELAY_MS, failure_rate: float = FAKE_EMAIL_FAILURE_RATE,
+                 keep: int = 1000):
+        self.delay_ms = delay_ms
+        self.failure_rate = failure_rate
+        self.outbox = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def sender_address(self) -> str:
+        return "noreply@ibanking.local"
+
+    def send(self, message: EmailMessage):
+        if self.delay_ms:
+            time.sleep(self.delay_ms / 1000)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise EmailSendError("Simulated send failure")
+        with self._lock:
+            self.outbox.append(message)
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def get_provider() -> EmailProvider:
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            if EMAIL_PROVIDER == "gmail":
+                _provider = GmailProvider()
+            elif EMAIL_PROVIDER == "smtp":
+                _provider = SmtpProvider()
+            elif EMAIL_PROVIDER == "fake":
+                _provider = FakeProvider()
+            else:
+                raise RuntimeError(f"Unknown IBANKING_EMAIL_PROVIDER: {EMAIL_PROVIDER}")
+        return _provider
+
+def set_provider(provider: EmailProvider):
+    global _provider
+    with _provider_lock:
+        _provider = provider
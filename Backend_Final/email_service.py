@@ -2,13 +2,56 @@ from typing import List, Optional
 from fastapi import FastAPI, HTTPException, status
 from pydantic import BaseModel
 from datetime import datetime
-from send_email import send_email_v1, send_bulk_email, get_email_logs
+from send_email import send_batch, record_failures, get_email_logs
+from delivery import DeliveryScheduler, DeliveryExpired
+from cache import TTLCache
+import os
+import uuid
 import requests
+import http_cache
+import metrics
+import tracing
+import log_config
+import logging
+import resilience
 from fastapi.middleware.cors import CORSMiddleware
 
+logger = log_config.setup_logging("email_service", level=logging.INFO)
+
 OTP_SERVICE_URL = "http://127.0.0.1:8004/otp/generate"
 CUSTOMER_SERVICE_URL = "http://127.0.0.1:8000/customers"
 
+# ================== Hàng đợi gửi mail theo độ ưu tiên ==================
+# otp > notification (biến động số dư, /email/send) > bulk (/email/send-bulk).
+# EMAIL_OTP_WORKERS worker chỉ gửi OTP -> OTP không phải chờ sau 1 đợt bulk lớn; bulk gửi theo từng
+# EMAIL_BULK_CHUNK mail và nhường worker khi có OTP / notification đang chờ.
+# OTP nằm trong hàng đợi quá OTP_EMAIL_MAX_AGE giây (mã đã hết hạn) thì bỏ, không gửi.
+# Với SMTP nên để IBANKING_SMTP_POOL_SIZE >= EMAIL_WORKERS, nếu không worker OTP vẫn có thể phải chờ phiên SMTP.
+EMAIL_CLASSES = ("otp", "notification", "bulk")
+EMAIL_WORKERS = int(os.getenv("IBANKING_EMAIL_WORKERS", "4"))
+EMAIL_OTP_WORKERS = int(os.getenv("IBANKING_EMAIL_OTP_WORKERS", "1"))
+EMAIL_BULK_CHUNK = int(os.getenv("IBANKING_EMAIL_BULK_CHUNK", "10"))
+OTP_EMAIL_MAX_AGE = float(os.getenv("IBANKING_OTP_EMAIL_MAX_AGE", "120"))
+
+delivery = DeliveryScheduler("email", send_batch, EMAIL_CLASSES, workers=EMAIL_WORKERS,
+                             reserved={"otp": EMAIL_OTP_WORKERS}, chunk=EMAIL_BULK_CHUNK,
+                             max_age={"otp": OTP_EMAIL_MAX_AGE}, on_expired=record_failures)
+
+# Trạng thái các mail xác nhận đã nhận 202 (queued -> sent | failed), giữ DELIVERY_STATUS_TTL giây.
+# Lưu trong bộ nhớ process: chạy 1 worker cho email_service (launcher kiểm tra).
+# Cache là LRU: phải chứa đủ mọi mail nhận trong DELIVERY_STATUS_TTL giây, nếu không entry "queued" của mail còn
+# đang gửi bị đẩy ra và GET /email/deliveries/{id} trả 404. Mặc định = TTL x DELIVERY_STATUS_RATE (mail/giây
+# lúc cao điểm), ghi đè bằng IBANKING_DELIVERY_STATUS_MAX.
+DELIVERY_STATUS_TTL = float(os.getenv("IBANKING_DELIVERY_STATUS_TTL", "600"))
+DELIVERY_STATUS_RATE = float(os.getenv("IBANKING_DELIVERY_STATUS_RATE", "50"))
+DELIVERY_STATUS_MAX = int(os.getenv("IBANKING_DELIVERY_STATUS_MAX",
+                                    str(max(int(DELIVERY_STATUS_TTL * DELIVERY_STATUS_RATE), 10000))))
+delivery_status = TTLCache("email_delivery_status", DELIVERY_STATUS_TTL, maxsize=DELIVERY_STATUS_MAX)
+
+def deliver(cls: str, recipients: list, subject: str, body: str) -> list:
+    """Xếp mail vào hàng đợi lớp cls và chờ gửi xong; trả list lỗi (None = ok) theo thứ tự recipients"""
+    return delivery.submit(cls, [(recipient, subject, body, True) for recipient in recipients]).result()
+
 app = FastAPI()
 
 # Cho phép origin từ React
@@ -26,6 +69,13 @@ app.add_middleware(
     allow_headers=["*"],          # cho phép mọi header
 )
 
+# ETag / 304 cho client poll + nén gzip/brotli response lớn (http_cache.py)
+http_cache.instrument_app(app)
+
+# Endpoint /metrics + đo latency theo route, trace span cho mỗi request
+metrics.instrument_app(app, "email")
+tracing.instrument_app(app, "email")
+
 class EmailConfirmationRequest(BaseModel):
     customerId: str
     
@@ -40,6 +90,20 @@ class EmailSingleResponse(BaseModel):
     success: bool
     message: Optional[str] = None  # Thông điệp kết quả
 
+# Kết quả khi mail đã được nhận vào hàng đợi (202)
+class EmailDeliveryAccepted(BaseModel):
+    success: bool
+    deliveryId: str
+    status: str                    # luôn "queued"
+    message: Optional[str] = None
+
+# Trạng thái 1 lần gửi (GET /email/deliveries/{deliveryId})
+class EmailDeliveryStatus(BaseModel):
+    deliveryId: str
+    status: str                    # queued | sent | failed
+    error: Optional[str] = None
+    updatedAt: datetime
+
 # Kết quả trả về khi gửi nhiều email
 class EmailBulkResponse(BaseModel):
     success: bool
@@ -56,7 +120,7 @@ class EmailLog(BaseModel):
 # Gọi Customer Service để lấy email
 def get_customer_email(customer_id: str) -> str:
     try:
-        res = requests.get(f"{CUSTOMER_SERVICE_URL}/{customer_id}", timeout=5)
+        res = resilience.call("customer", "GET", f"{CUSTOMER_SERVICE_URL}/{customer_id}")
         if res.status_code == 200:
             data = res.json()
             return data.get("email")
@@ -67,83 +131,113 @@ def get_customer_email(customer_id: str) -> str:
     except requests.exceptions.RequestException as e:
         raise HTTPException(status_code=503, detail=f"Customer Service unavailable: {e}")
 
-@app.post("/email/send-confirmation", response_model=EmailSingleResponse, status_code=status.HTTP_200_OK)
-def send_confirmation_email(request: EmailConfirmationRequest):
-    try:
-        # Lấy email từ Customer Service
-        recipient_email = get_customer_email(request.customerId)
-        
-        # Gọi OTP Service
-        res = requests.post(OTP_SERVICE_URL, params={"userId": request.customerId}, timeout=5)
-        if res.status_code != 200:
-            raise HTTPException(status_code=502, detail="Failed to generate OTP from OTP Service")
-
-        otp_code = res.json().get("otpCode")
-
-        subject = "Payment Confirmation Email - Elevate iBanking"
-        body = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; background-color: #f4f6f8; padding: 20px; color: #333;">
-            <div style="max-width: 600px; margin: auto; background: #fff;
-                        padding: 20px; border-radius: 10px; 
-                        box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
-
-            <!-- Header -->
-            <h2 style="color: #2E86C1; text-align: center; margin-bottom: 20px;">
-                Elevate iBanking - Payment Confirmation
-            </h2>
-
-            <!-- Greeting -->
-            <p style="font-size: 16px;">Dear <b>Customer</b>,</p>
-
-            <!-- Message -->
-            <p style="font-size: 15px; line-height: 1.6;">
-                This is a confirmation email from <b>Elevate iBanking</b>.
-                Please use the OTP code below to enter in the web application:
-            </p>
-
-            <!-- OTP Box -->
-            <div style="text-align: center; margin: 20px 0;">
-                <span style="display: inline-block; 
-                            padding: 12px 20px; 
-                            font-size: 22px; 
-                            font-weight: bold; 
-                            color: #fff; 
-                            background: #E74C3C; 
-                            border-radius: 8px;">
-                {otp_code}
-                </span>
-            </div>
-
-            <!-- Note -->
-            <p style="font-size: 14px; color: #D35400;">
-                <b>Note:</b> This OTP will expire in <b>2 minutes</b>.
-            </p>
-
-            <!-- Footer -->
-            <p style="margin-top: 30px; font-size: 14px;">
-                Thank you for using our service.  
-                <br>
-                — <b>Elevate iBanking Team</b>
-            </p>
-            <hr style="margin: 20px 0;">
-            <footer style="font-size: 12px; text-align: center; color: #999;">
-                © 2025 Elevate iBanking - All rights reserved
-            </footer>
-            </div>
-        </body>
-        </html>
-        """
-
-        # Gửi email
-        ok = send_email_v1(recipient_email, subject, body, html=True)
-        if not ok:
-            raise HTTPException(status_code=500, detail="Failed to send confirmation email")
-
-        return {"success": True, "message": f"Confirmation email sent to {recipient_email}"}
+# Trạng thái circuit breaker / bulkhead của các service phụ thuộc
+@app.get("/resilience/status")
+def resilience_status():
+    return resilience.status()
 
+# Gọi OTP Service sinh mã OTP cho customer
+def generate_otp(customer_id: str) -> str:
+    try:
+        res = resilience.call("otp", "POST", OTP_SERVICE_URL, params={"userId": customer_id})
     except requests.exceptions.RequestException as e:
         raise HTTPException(status_code=503, detail=f"OTP Service unavailable: {e}")
+    if res.status_code != 200:
+        raise HTTPException(status_code=502, detail="Failed to generate OTP from OTP Service")
+    return res.json().get("otpCode")
+
+CONFIRMATION_SUBJECT = "Payment Confirmation Email - Elevate iBanking"
+
+def confirmation_email_body(otp_code: str) -> str:
+    return f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; background-color: #f4f6f8; padding: 20px; color: #333;">
+        <div style="max-width: 600px; margin: auto; background: #fff;
+                    padding: 20px; border-radius: 10px; 
+                    box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
+
+        <!-- Header -->
+        <h2 style="color: #2E86C1; text-align: center; margin-bottom: 20px;">
+            Elevate iBanking - Payment Confirmation
+        </h2>
+
+        <!-- Greeting -->
+        <p style="font-size: 16px;">Dear <b>Customer</b>,</p>
+
+        <!-- Message -->
+        <p style="font-size: 15px; line-height: 1.6;">
+            This is a confirmation email from <b>Elevate iBanking</b>.
+            Please use the OTP code below to enter in the web application:
+        </p>
+
+        <!-- OTP Box -->
+        <div style="text-align: center; margin: 20px 0;">
+            <span style="display: inline-block; 
+                        padding: 12px 20px; 
+                        font-size: 22px; 
+                        font-weight: bold; 
+                        color: #fff; 
+                        background: #E74C3C; 
+                        border-radius: 8px;">
+            {otp_code}
+            </span>
+        </div>
+
+        <!-- Note -->
+        <p style="font-size: 14px; color: #D35400;">
+            <b>Note:</b> This OTP will expire in <b>2 minutes</b>.
+        </p>
+
+        <!-- Footer -->
+        <p style="margin-top: 30px; font-size: 14px;">
+            Thank you for using our service.  
+            <br>
+            — <b>Elevate iBanking Team</b>
+        </p>
+        <hr style="margin: 20px 0;">
+        <footer style="font-size: 12px; text-align: center; color: #999;">
+            © 2025 Elevate iBanking - All rights reserved
+        </footer>
+        </div>
+    </body>
+    </html>
+    """
+
+def set_delivery_status(delivery_id: str, state: str, error=None):
+    delivery_status.put(delivery_id, {"deliveryId": delivery_id, "status": state,
+                                      "error": None if error is None else str(error), "updatedAt": datetime.now()})
+
+def on_confirmation_done(delivery_id: str, future):
+    error = future.result()[0]
+    if isinstance(error, DeliveryExpired):
+        error = "OTP expired before the email could be sent (email queue backed up)"
+    if error is None:
+        set_delivery_status(delivery_id, "sent")
+    else:
+        # Lỗi đã được ghi vào EmailLogs + log bởi send_email.record_result
+        set_delivery_status(delivery_id, "failed", error)
+
+@app.post("/email/send-confirmation", response_model=EmailDeliveryAccepted, status_code=status.HTTP_202_ACCEPTED)
+def send_confirmation_email(request: EmailConfirmationRequest):
+    """Lấy email customer rồi mới sinh OTP, xếp mail vào hàng đợi otp rồi trả 202 ngay.
+    Kết quả gửi: GET /email/deliveries/{deliveryId}"""
+    # Tuần tự: customer lỗi (404 ...) thì không sinh OTP mồ côi không bao giờ được gửi
+    recipient_email = get_customer_email(request.customerId)
+    otp_code = generate_otp(request.customerId)
+
+    delivery_id = uuid.uuid4().hex
+    set_delivery_status(delivery_id, "queued")
+    future = delivery.submit("otp", [(recipient_email, CONFIRMATION_SUBJECT, confirmation_email_body(otp_code), True)])
+    future.add_done_callback(lambda f: on_confirmation_done(delivery_id, f))
+    return {"success": True, "deliveryId": delivery_id, "status": "queued",
+            "message": f"Confirmation email queued for {recipient_email}"}
+
+@app.get("/email/deliveries/{delivery_id}", response_model=EmailDeliveryStatus)
+def get_delivery_status(delivery_id: str):
+    state = delivery_status.get(delivery_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Delivery not found (unknown id or older than the status TTL)")
+    return state
     
 # Dùng cho việc gửi mail update balance bên account service
 @app.post("/email/send", response_model=EmailSingleResponse,status_code=status.HTTP_200_OK)
@@ -154,8 +248,8 @@ def send_single_email(request: EmailRequest):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Only 1 recipient allowed"
         )
-    ok = send_email_v1(request.toList[0], request.subject, request.body,html=True)
-    if not ok:
+    error = deliver("notification", request.toList, request.subject, request.body)[0]
+    if error is not None:
         # Nếu gửi thất bại → lỗi 500 (Internal Server Error)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -170,8 +264,14 @@ def send_bulk(request: EmailRequest):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="The recipient list (toList) cannot be empty."
         )
-    count, failed = send_bulk_email(request.toList, request.subject, request.body)
-    return {"success": True, "sentCount": count, "failed": failed}
+    errors = deliver("bulk", request.toList, request.subject, request.body)
+    failed = [recipient for recipient, error in zip(request.toList, errors) if error is not None]
+    return {"success": True, "sentCount": len(errors) - len(failed), "failed": failed}
+
+# Số mail đang chờ / đang gửi theo từng lớp ưu tiên (chi tiết latency xem /metrics: delivery_*)
+@app.get("/email/queue")
+def email_queue():
+    return {"workers": EMAIL_WORKERS, "reserved": {"otp": EMAIL_OTP_WORKERS}, "depth": delivery.depth()}
 
 
 @app.get("/email/logs", response_model=List[EmailLog],status_code=status.HTTP_200_OK)
@@ -0,0 +1,158 @@
+import atexit
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+import storage
+
+# ================== Group commit ==================
+# IBANKING_GROUP_COMMIT=1: các lệnh ghi settlement (đánh dấu đã trả, trừ / cộng số dư) của nhiều request đồng thời
+# được 1 thread writer gom trong tối đa LINGER_MS (hoặc tới MAX_BATCH lệnh) rồi chạy chung 1 transaction, 1 lần commit
+# -> 1 lần flush log cho cả lô thay vì mỗi request 1 lần.
+#   - mỗi lệnh chạy sau 1 savepoint: lệnh lỗi (vd. không đủ tiền) chỉ rollback phần của nó, các lệnh khác vẫn commit
+#   - commit lỗi (hoặc DB hủy cả transaction, vd. deadlock) -> mọi lệnh trong lô cùng nhận lỗi, không lệnh nào được ghi
+# Request chờ tới khi lô của nó commit xong (không trả lời trước khi dữ liệu đã bền) nên độ trễ tăng tối đa LINGER_MS.
+# Chỉ gom trong 1 process: nhiều worker thì mỗi worker có writer riêng.
+ENABLED = os.getenv("IBANKING_GROUP_COMMIT", "0").lower() in ("1", "true", "yes")
+MAX_BATCH = int(os.getenv("IBANKING_GROUP_COMMIT_MAX_BATCH", "64"))
+LINGER_MS = float(os.getenv("IBANKING_GROUP_COMMIT_LINGER_MS", "2"))
+
+BATCH_SIZE = metrics.histogram("group_commit_batch_size", "Writes committed together in one transaction",
+                               ("writer",), buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+COMMIT_WAIT = metrics.histogram("group_commit_wait_seconds", "Time from submit until the write's batch committed",
+                                ("writer",))
+FLUSHES = metrics.counter("group_commit_flushes_total", "Group-commit transactions by outcome", ("writer", "outcome"))
+
+logger = logging.getLogger("group_commit")
+
+
+class _Write:
+    def __init__(self, work):
+        self.work = work                # work(conn) -> kết quả, không tự commit
+        self.submitted = time.monotonic()
+        self.future = Future()
+        self.context = contextvars.copy_context()   # giữ trace context của request
+        self.error = None
+        self.result = None
+
+
+class GroupCommitWriter:
+    def __init__(self, name: str, database: str, max_batch: int = MAX_BATCH, linger_ms: float = LINGER_MS):
+        self.name = name
+        self.database = database
+        self.max_batch = max(max_batch, 1)
+        self.linger = max(linger_ms, 0) / 1000
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"group-commit-{name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def run(self, work):
+        """Chạy work(conn) trong lô kế tiếp; chờ lô commit xong rồi trả kết quả / ném lại lỗi của work"""
+        write = _Write(work)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Group-commit writer {self.name} is closed")
+            self._pending.append(write)
+            self._cond.notify()
+        return write.future.result()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            # Linger tính từ lệnh cũ nhất: lúc writer đang bận commit lô trước thì lô sau đi ngay khi tới lượt
+            deadline = self._pending[0].submitted + self.linger
+            while len(self._pending) < self.max_batch and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._flush(batch)
+            except Exception as e:
+                # Cả lô hỏng (commit lỗi, DB hủy transaction...): không lệnh nào được ghi
+                FLUSHES.labels(self.name, "failed").inc()
+                logger.error("Group commit %s failed for %s writes: %s", self.name, len(batch), e)
+                for write in batch:
+                    write.future.set_exception(e)
+                continue
+            FLUSHES.labels(self.name, "committed").inc()
+            BATCH_SIZE.labels(self.name).observe(len(batch))
+            now = time.monotonic()
+            for write in batch:
+                COMMIT_WAIT.labels(self.name).observe(now - write.submitted)
+                if write.error is not None:
+                    write.future.set_exception(write.error)
+                else:
+                    write.future.set_result(write.result)
+
+    def _flush(self, batch: list):
+        mssql = storage.is_mssql()
+        # Connection autocommit: transaction của lô do writer tự BEGIN / COMMIT bằng câu SQL. Với autocommit tắt,
+        # pyodbc chạy SQL Server ở IMPLICIT_TRANSACTIONS ON và BEGIN TRANSACTION sẽ lồng thành @@TRANCOUNT = 2.
+        conn = storage.get_connection(self.database, autocommit=True)
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute("BEGIN TRANSACTION" if mssql else "BEGIN")
+            for i, write in enumerate(batch):
+                cur.execute(f"SAVE TRANSACTION gc{i}" if mssql else f"SAVEPOINT gc{i}")
+                try:
+                    write.result = write.context.run(write.work, conn)
+                except Exception as e:
+                    write.error = e
+                    cur.execute(f"ROLLBACK TRANSACTION gc{i}" if mssql else f"ROLLBACK TO gc{i}")
+            cur.execute("COMMIT TRANSACTION" if mssql else "COMMIT")
+            conn.commit()       # không còn gì để commit; chỉ ghi nhận lần ghi (read replica) + metrics / trace
+        except BaseException:
+            if cur is not None:
+                try:
+                    cur.execute("IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION" if mssql else "ROLLBACK")
+                except storage.DB_ERRORS:
+                    pass
+            raise
+        finally:
+            conn.close()
+
+    def close(self):
+        """Commit nốt các lệnh đang chờ rồi dừng writer (khi tắt service)"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+def run_in_transaction(database: str, work, writer: GroupCommitWriter = None):
+    """work(conn) rồi commit: qua writer (gom lô) nếu có, không thì 1 transaction riêng như trước"""
+    if writer is not None:
+        return writer.run(work)
+    conn = storage.get_connection(database)
+    try:
+        result = work(conn)
+        conn.commit()
+        return result
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,156 @@
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+
+import metrics
+
+# ================== Conditional GET + nén response ==================
+# React client poll các endpoint đọc (thông tin khách hàng, tài khoản, payment chưa trả, email log...) vài giây 1 lần,
+# phần lớn lần poll dữ liệu không đổi. Middleware này, cho mọi response 200 của GET có body 1 khối (JSON):
+#   - ETag mạnh = hash nội dung (handler tự đặt ETag, vd. theo version của dòng, thì giữ nguyên);
+#     request gửi If-None-Match khớp -> 304 không body
+#   - body >= COMPRESS_MIN_SIZE byte và client chấp nhận -> nén brotli (nếu đã cài gói brotli) hoặc gzip
+# ETag gắn thêm hậu tố theo encoding ("...-br", "...-gzip") vì mỗi bản nén là 1 representation khác nhau.
+# Response stream nhiều khối (StreamingResponse) đi thẳng, không ETag / không nén.
+ENABLED = os.getenv("IBANKING_HTTP_CACHE", "1").lower() in ("1", "true", "yes")
+COMPRESS_MIN_SIZE = int(os.getenv("IBANKING_COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("IBANKING_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("IBANKING_BROTLI_QUALITY", "4"))
+
+# brotli là tùy chọn (pip install brotli): không cài thì chỉ dùng gzip
+brotli = importlib.import_module("brotli") if importlib.util.find_spec("brotli") is not None else None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/xml", "application/javascript")
+
+CONDITIONAL = metrics.counter("http_conditional_requests_total", "GET responses by ETag outcome", ("route", "result"))
+COMPRESSED_BYTES = metrics.counter("http_compressed_bytes_total", "Response bytes before/after compression",
+                                   ("encoding", "stage"))
+
+
+def _accepted_encodings(header: str) -> set:
+    """Các encoding client nhận (bỏ những cái có q=0)"""
+    accepted = set()
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+def choose_encoding(accept_encoding: str):
+    accepted = _accepted_encodings(accept_encoding)
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+def content_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def _with_suffix(etag: str, encoding: str) -> str:
+    return etag if encoding is None else etag[:-1] + f'-{encoding}"'
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match so khớp kiểu weak: bỏ tiền tố W/
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in tags)
+
+
+# ================== ASGI Middleware ==================
+class HttpCacheMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        conditional = scope["method"] == "GET"
+        if_none_match = request_headers.get("if-none-match")
+        accept_encoding = request_headers.get("accept-encoding", "")
+        start_message = None
+        streaming = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, streaming
+            if message["type"] == "http.response.start":
+                start_message = message          # giữ lại tới khi biết body có 1 khối hay nhiều khối
+                return
+            if message["type"] != "http.response.body" or streaming:
+                await send(message)
+                return
+            if message.get("more_body", False):
+                streaming = True
+                await send(start_message)
+                await send(message)
+                return
+            await self._finish(scope, start_message, message.get("body", b""), conditional,
+                               if_none_match, accept_encoding, send)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _finish(self, scope, start_message, body: bytes, conditional: bool, if_none_match,
+                      accept_encoding: str, send):
+        status = start_message["status"]
+        headers = MutableHeaders(scope=start_message)
+
+        encoding = None
+        content_type = headers.get("content-type", "")
+        if (len(body) >= self.minimum_size and "content-encoding" not in headers
+                and content_type.startswith(COMPRESSIBLE_TYPES) and status not in (204, 304)):
+            encoding = choose_encoding(accept_encoding)
+        if encoding is not None or content_type.startswith(COMPRESSIBLE_TYPES):
+            headers.add_vary_header("Accept-Encoding")
+
+        if conditional and status == 200:
+            etag = _with_suffix(headers.get("etag") or content_etag(body), encoding)
+            headers["etag"] = etag
+            if "cache-control" not in headers:
+                # Trình duyệt được giữ bản sao nhưng phải hỏi lại server (If-None-Match) mỗi lần dùng
+                headers["cache-control"] = "private, no-cache"
+            route = getattr(scope.get("route"), "path", "unmatched")
+            if if_none_match and _matches(if_none_match, etag):
+                CONDITIONAL.labels(route, "not_modified").inc()
+                for name in ("content-length", "content-type", "content-encoding"):
+                    if name in headers:
+                        del headers[name]
+                start_message["status"] = 304
+                await send(start_message)
+                await send({"type": "http.response.body", "body": b""})
+                return
+            CONDITIONAL.labels(route, "modified").inc()
+
+        if encoding is not None:
+            compressed = compress(body, encoding)
+            COMPRESSED_BYTES.labels(encoding, "raw").inc(len(body))
+            COMPRESSED_BYTES.labels(encoding, "sent").inc(len(compressed))
+            body = compressed
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(body))
+
+        await send(start_message)
+        await send({"type": "http.response.body", "body": body})
+
+
+def instrument_app(app, minimum_size: int = COMPRESS_MIN_SIZE):
+    """Gắn ETag / 304 và nén response cho 1 FastAPI app"""
+    app.add_middleware(HttpCacheMiddleware, minimum_size=minimum_size)
@@ -0,0 +1,212 @@
+"""Khởi động toàn bộ service của Backend_Final theo file cấu hình (mặc định launcher.json).
+
+Mỗi service chạy bằng uvicorn trong 1 process riêng, với số worker, event loop (uvloop),
+HTTP parser (httptools), backlog và thời gian drain riêng. Ctrl+C / SIGTERM: gửi SIGTERM cho
+mọi service, uvicorn ngừng nhận kết nối mới và chờ request đang chạy xong (timeout_graceful_shutdown).
+
+Ví dụ:
+    python launcher.py                            # chạy mọi service trong launcher.json
+    python launcher.py --only payment_service account_service
+    python launcher.py --check                    # chỉ kiểm tra cấu hình multi-worker rồi thoát
+"""
+import argparse
+import atexit
+import importlib.util
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG = os.path.join(SERVICE_DIR, "launcher.json")
+
+# Thứ tự tham số uvicorn lấy từ config (None = dùng mặc định của uvicorn)
+UVICORN_OPTIONS = ("workers", "loop", "http", "backlog", "timeout_keep_alive", "timeout_graceful_shutdown",
+                   "limit_concurrency", "log_level")
+
+
+def log(message: str):
+    print(f"[launcher] {message}", flush=True)
+
+
+# ================== Config ==================
+def load_config(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    defaults = config.get("defaults", {})
+    services = {}
+    for name, options in config["services"].items():
+        services[name] = {**defaults, **options, "env": {**os.environ, **options.get("env", {})}}
+    return {"host": config.get("host", "127.0.0.1"), "services": services}
+
+def resolve_runtime(service: dict):
+    """uvloop/httptools là tùy chọn: không cài (hoặc Windows với uvloop) thì để uvicorn tự chọn"""
+    if service["loop"] == "uvloop" and (sys.platform == "win32" or importlib.util.find_spec("uvloop") is None):
+        service["loop"] = "auto"
+    if service["http"] == "httptools" and importlib.util.find_spec("httptools") is None:
+        service["http"] = "auto"
+
+def share_sqlite_dir(services: dict):
+    # ":memory:" = thư mục tạm riêng cho từng process -> các worker của 1 service sẽ thấy DB khác nhau.
+    # Launcher tạo 1 thư mục tạm chung cho mọi service và tự xóa khi thoát.
+    shared = None
+    for service in services.values():
+        env = service["env"]
+        if env.get("IBANKING_STORAGE", "mssql") == "sqlite" and env.get("IBANKING_SQLITE_DIR") == ":memory:":
+            if shared is None:
+                shared = tempfile.mkdtemp(prefix="ibanking-")
+                atexit.register(shutil.rmtree, shared, True)
+            env["IBANKING_SQLITE_DIR"] = shared
+
+
+# ================== Multi-worker safety checks ==================
+# Mỗi check trả về list (level, message); level "error" chặn khởi động (trừ khi --unsafe)
+def check_payment_lock(name: str, service: dict) -> list:
+    if name != "payment_service" or service["workers"] <= 1:
+        return []
+    if service["env"].get("IBANKING_PAYMENT_LOCK", "local") != "db":
+        return [("error", "account_locks is per process: with several workers two payments for the same "
+                          "customer can run at once. Set IBANKING_PAYMENT_LOCK=db or workers=1.")]
+    return []
+
+def check_caches(name: str, service: dict) -> list:
+    if name != "account_service" or service["workers"] <= 1:
+        return []
+    issues = []
+    for var in ("IBANKING_CUSTOMER_CACHE_TTL", "IBANKING_ACCOUNT_CACHE_TTL"):
+        if float(service["env"].get(var, "0")) > 0:
+            issues.append(("warning", f"{var} is set: each worker has its own cache, so reads may be stale for "
+                                      f"up to the TTL (balance writes are still version-checked)."))
+    return issues
+
+def check_read_replica(name: str, service: dict) -> list:
+    env = service["env"]
+    if service["workers"] > 1 and env.get("IBANKING_READ_REPLICA", "0").lower() in ("1", "true", "yes"):
+        return [("warning", "read-your-writes window is tracked per worker; a read on another worker may hit "
+                            "a lagging replica right after a write.")]
+    return []
+
+def check_gmail_token(name: str, service: dict) -> list:
+    env = service["env"]
+    if name == "email_service" and env.get("IBANKING_EMAIL_PROVIDER", "gmail") == "gmail" \
+            and not os.path.exists(os.path.join(SERVICE_DIR, "token.json")):
+        return [("warning", "token.json not found: the first send will start the interactive Gmail OAuth flow "
+                            "inside a worker. Run it once by hand first.")]
+    return []
+
+def check_email_delivery(name: str, service: dict) -> list:
+    if name != "email_service" or service["workers"] <= 1:
+        return []
+    return [("error", "the delivery queue and send-confirmation status are per process: "
+                      "GET /email/deliveries/{id} answered by another worker returns 404. Use workers=1.")]
+
+def check_account_modes(name: str, service: dict) -> list:
+    env = service["env"]
+    if name == "account_service" and env.get("IBANKING_SHARDED_ACCOUNTS", "").strip() \
+            and env.get("IBANKING_ACCOUNT_LEDGER", "0").lower() in ("1", "true", "yes"):
+        return [("error", "IBANKING_SHARDED_ACCOUNTS has no effect with IBANKING_ACCOUNT_LEDGER=1 "
+                          "(the ledger already avoids writing the account row). Pick one.")]
+    return []
+
+SAFETY_CHECKS = (check_payment_lock, check_caches, check_read_replica, check_gmail_token, check_email_delivery,
+                 check_account_modes)
+
+def run_checks(services: dict) -> bool:
+    ok = True
+    for name, service in services.items():
+        for check in SAFETY_CHECKS:
+            for level, message in check(name, service):
+                log(f"{level.upper()} {name} (workers={service['workers']}): {message}")
+                ok = ok and level != "error"
+    return ok
+
+
+# ================== Processes ==================
+def build_command(name: str, service: dict, host: str) -> list:
+    cmd = [sys.executable, "-m", "uvicorn", f"{name}:app", "--host", host, "--port", str(service["port"])]
+    for option in UVICORN_OPTIONS:
+        if service.get(option) is not None:
+            cmd += ["--" + option.replace("_", "-"), str(service[option])]
+    return cmd
+
+def start(services: dict, host: str) -> dict:
+    processes = {}
+    for name, service in services.items():
+        resolve_runtime(service)
+        log(f"starting {name} on {host}:{service['port']} (workers={service['workers']}, "
+            f"loop={service['loop']}, http={service['http']}, backlog={service['backlog']})")
+        # Session riêng: Ctrl+C chỉ tới launcher; nếu service cũng nhận SIGINT thì SIGTERM sau đó
+        # thành tín hiệu thứ 2 và uvicorn sẽ thoát ngay, không drain
+        processes[name] = subprocess.Popen(build_command(name, service, host), cwd=SERVICE_DIR, env=service["env"],
+                                           start_new_session=True)
+    return processes
+
+def stop(processes: dict, services: dict):
+    """Drain: SIGTERM cho mọi service cùng lúc, chờ hết timeout_graceful_shutdown rồi mới kill"""
+    for proc in processes.values():
+        if proc.poll() is None:
+            proc.terminate()
+    for name, proc in processes.items():
+        grace = (services[name].get("timeout_graceful_shutdown") or 10) + 5
+        try:
+            proc.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            log(f"{name} did not stop within {grace}s, killing")
+            proc.kill()
+
+def supervise(processes: dict):
+    # 1 service chết -> dừng cả hệ thống (không chạy nửa vời)
+    while True:
+        for name, proc in processes.items():
+            if proc.poll() is not None:
+                log(f"{name} exited with code {proc.returncode}, shutting down")
+                return
+        time.sleep(0.5)
+
+
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start the iBanking services")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--only", nargs="+", metavar="SERVICE", help="start only these services")
+    parser.add_argument("--check", action="store_true", help="run the multi-worker safety checks and exit")
+    parser.add_argument("--unsafe", action="store_true", help="start even if a safety check fails")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    services = config["services"]
+    if args.only:
+        unknown = set(args.only) - set(services)
+        if unknown:
+            parser.error(f"unknown services: {', '.join(sorted(unknown))}")
+        services = {name: services[name] for name in args.only}
+
+    ok = run_checks(services)
+    if args.check:
+        sys.exit(0 if ok else 1)
+    if not ok and not args.unsafe:
+        log("refusing to start; fix the errors above or pass --unsafe")
+        sys.exit(1)
+
+    share_sqlite_dir(services)
+    processes = start(services, config["host"])
+
+    # SIGTERM (docker stop, systemd) xử lý giống Ctrl+C
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    try:
+        supervise(processes)
+    except KeyboardInterrupt:
+        log("shutting down, draining in-flight requests")
+    finally:
+        stop(processes, services)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import os
+import json
+import atexit
+import queue
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+import tracing
+
+# ================== Config ==================
+LOG_LEVEL = os.getenv("IBANKING_LOG_LEVEL")
+LOG_QUEUE_SIZE = int(os.getenv("IBANKING_LOG_QUEUE_SIZE", "10000"))
+# Tỉ lệ giữ lại log DEBUG/INFO theo logger, ví dụ "payment_service=0.1,otp_service=0"
+# WARNING trở lên luôn được giữ
+LOG_SAMPLING = os.getenv("IBANKING_LOG_SAMPLING", "")
+
+LOG_DROPPED = metrics.counter("log_records_dropped_total", "Log records dropped because the log queue was full",
+                              ("service",))
+LOG_SAMPLED_OUT = metrics.counter("log_records_sampled_out_total", "DEBUG/INFO log records skipped by sampling",
+                                  ("service", "logger"))
+
+# Thuộc tính chuẩn của LogRecord, phần còn lại (extra=...) được đưa vào JSON
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id", "span_id"}
+
+
+def parse_sampling(spec: str) -> dict:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+# ================== Filters ==================
+class SamplingFilter(logging.Filter):
+    """Giữ ngẫu nhiên 1 phần log DEBUG/INFO của các logger có cấu hình (kể cả logger con)"""
+
+    def __init__(self, service: str, rates: dict):
+        super().__init__()
+        self.service = service
+        self.rates = rates
+
+    def _rate_for(self, name: str):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return self.rates.get("root")
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        if rate is None or rate >= 1.0 or random.random() < rate:
+            return True
+        LOG_SAMPLED_OUT.labels(self.service, record.name).inc()
+        return False
+
+class TraceContextFilter(logging.Filter):
+    """Gắn trace_id/span_id ngay ở thread ghi log (contextvar không sang được thread listener)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = tracing.current_span()
+        if span is not None:
+            record.trace_id = span.trace_id
+            record.span_id = span.span_id
+        return True
+
+
+# ================== Handlers / Formatter ==================
+class NonBlockingQueueHandler(QueueHandler):
+    """Không chờ khi queue đầy (bỏ record + đếm), không format trên thread của request"""
+
+    def __init__(self, log_queue, service: str):
+        super().__init__(log_queue)
+        self.service = service
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Listener chạy cùng process nên giữ nguyên msg/args, format lười ở thread listener
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.labels(self.service).inc()
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+            entry["span_id"] = record.span_id
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+# ================== Setup ==================
+_listener = None
+_setup_lock = threading.Lock()
+
+def setup_logging(service: str, level: int = logging.INFO, handlers=None) -> logging.Logger:
+    """Thay cho logging.basicConfig: root logger -> queue -> thread listener -> stderr (JSON)"""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            queue_handler = NonBlockingQueueHandler(log_queue, service)
+            queue_handler.addFilter(SamplingFilter(service, parse_sampling(LOG_SAMPLING)))
+            queue_handler.addFilter(TraceContextFilter())
+
+            if handlers is None:
+                stream_handler = logging.StreamHandler()
+                stream_handler.setFormatter(JsonFormatter(service))
+                handlers = [stream_handler]
+
+            root = logging.getLogger()
+            for existing in list(root.handlers):
+                root.removeHandler(existing)
+            root.addHandler(queue_handler)
+            root.setLevel(logging.getLevelName(LOG_LEVEL.upper()) if LOG_LEVEL else level)
+
+            _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+            _listener.start()
+            # Đẩy nốt log còn trong queue khi tắt process
+            atexit.register(_listener.stop)
+    return logging.getLogger(service)
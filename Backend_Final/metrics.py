@@ -0,0 +1,281 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# ================== Metric Types ==================
+# Bản tối giản của prometheus_client: Counter / Gauge / Histogram + xuất text format 0.0.4
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+            return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        # Metric không có label -> dùng trực tiếp metric.inc()/observe()
+        return self.labels()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self._value)}"]
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)   # ô cuối là +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        lines, cumulative = [], 0
+        for bound, count in zip(list(self._buckets) + [float("inf")], counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+        return lines
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+# ================== Registry ==================
+_registry = {}
+_registry_lock = threading.Lock()
+
+def _register(metric):
+    # Mỗi tên chỉ đăng ký 1 lần; import lại module trả về metric cũ
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+def counter(name, documentation, labelnames=()) -> Counter:
+    return _register(Counter(name, documentation, labelnames))
+
+def gauge(name, documentation, labelnames=()) -> Gauge:
+    return _register(Gauge(name, documentation, labelnames))
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ================== Shared Metrics ==================
+REQUEST_LATENCY = histogram("http_request_duration_seconds", "HTTP request latency by route",
+                            ("service", "method", "route", "status"))
+REQUESTS_IN_FLIGHT = gauge("http_requests_in_flight", "HTTP requests currently being served", ("service",))
+DOWNSTREAM_LATENCY = histogram("downstream_request_duration_seconds", "Outgoing HTTP call latency by target service",
+                               ("target", "method", "outcome"))
+DB_LATENCY = histogram("db_operation_duration_seconds", "Database execute/commit latency",
+                       ("database", "operation"))
+LOCK_WAIT = histogram("payment_lock_wait_seconds", "Time spent claiming the per-customer payment lock row (db mode)",
+                      buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+LOCK_HOLD = histogram("payment_lock_hold_seconds", "Time the per-customer payment lock is held")
+LOCK_CONTENTION = counter("payment_lock_contention_total", "make_payment requests rejected because the lock was busy")
+EMAIL_SENT = counter("email_send_total", "Email send attempts by outcome", ("provider", "outcome"))
+
+
+# ================== ASGI Middleware ==================
+class MetricsMiddleware:
+    """Đo latency theo route template (không theo path thật để tránh bùng nổ label) + in-flight"""
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(self.service)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            # Router ghi route đã match vào scope sau khi xử lý
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.labels(self.service, scope["method"], route_path, status_holder["status"]).observe(
+                time.perf_counter() - start
+            )
+
+def instrument_app(app, service: str):
+    """Gắn middleware đo request và endpoint GET /metrics cho 1 FastAPI app"""
+    from fastapi.responses import Response
+
+    app.add_middleware(MetricsMiddleware, service=service)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint():
+        return Response(content=render(), media_type=CONTENT_TYPE)
+
+
+# ================== DB Instrumentation ==================
+class _MeteredCursor:
+    def __init__(self, cursor, database: str):
+        self._cursor = cursor
+        self._database = database
+
+    def execute(self, *args, **kwargs):
+        with DB_LATENCY.labels(self._database, "execute").time():
+            self._cursor.execute(*args, **kwargs)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class MeteredConnection:
+    """Bọc connection DB-API (pyodbc/sqlite3): đo thời gian execute và commit"""
+
+    def __init__(self, conn, database: str):
+        self._conn = conn
+        self._database = database
+
+    def cursor(self):
+        return _MeteredCursor(self._conn.cursor(), self._database)
+
+    def commit(self):
+        with DB_LATENCY.labels(self._database, "commit").time():
+            self._conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def metered_connection(conn, database: str) -> MeteredConnection:
+    return MeteredConnection(conn, database)
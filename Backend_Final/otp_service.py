@@ -2,7 +2,11 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import logging
-import pyodbc
+import metrics
+import storage
+from repositories import OtpRepository
+import tracing
+import log_config
 from datetime import datetime, timedelta
 import random
 from fastapi.middleware.cors import CORSMiddleware
@@ -24,24 +28,23 @@ app.add_middleware(
     allow_headers=["*"],          # cho phép mọi header
 )
 
+# Endpoint /metrics + đo latency theo route, trace span cho mỗi request
+metrics.instrument_app(app, "otp")
+tracing.instrument_app(app, "otp")
+
 
 # ================== Logging Config ==================
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = log_config.setup_logging("otp_service", level=logging.INFO)
 
 # ================== Global Exception Handler ==================
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logging.error(f"Unexpected error: {exc}")
+    logger.error("Unexpected error: %s", exc)
     return JSONResponse(status_code=500, content={"detail": "Internal Server Error. Please try again later."})
 
 # ================== DB Connection ==================
 def get_connection():
-    return pyodbc.connect(
-        "DRIVER={ODBC Driver 17 for SQL Server};"
-        "SERVER=DESKTOP-PV9Q0OQ\SQLEXPRESS;"
-        "DATABASE=OtpDB;"
-        "Trusted_Connection=yes;"
-    )
+    return storage.get_connection("OtpDB")
 
 # ================== Models ==================
 class OTPVerifyRequest(BaseModel):
@@ -52,16 +55,12 @@ class OTPVerifyRequest(BaseModel):
 @app.post("/otp/generate")
 def generate_otp(userId: int):
     conn = get_connection()
-    cur = conn.cursor()
     try:
         otp_code = str(random.randint(100000, 999999))
         expired_at = datetime.utcnow() + timedelta(seconds=120)
-        cur.execute(
-            "INSERT INTO otp (userId, otpCode, expired_at, is_used) VALUES (?, ?, ?, 0)",
-            (userId, otp_code, expired_at)
-        )
+        OtpRepository(conn).create(userId, otp_code, expired_at)
         conn.commit()
-        logging.info(f"OTP generated for user {userId}: {otp_code}")
+        logger.info("OTP generated for user %s", userId)  # không ghi mã OTP ra log
         return {"otpCode": otp_code, "expired_at": expired_at}
     finally:
         conn.close()
@@ -69,22 +68,20 @@ def generate_otp(userId: int):
 @app.post("/otp/verify")
 def verify_otp(data: OTPVerifyRequest):
     conn = get_connection()
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT otpId, expired_at, is_used FROM otp WHERE userId = ? AND otpCode = ?", (data.userId, data.otpCode))
-        row = cur.fetchone()
+        otps = OtpRepository(conn)
+        row = otps.find(data.userId, data.otpCode)
         if not row:
             raise HTTPException(status_code=404, detail="OTP not found")
 
-        otp_id, expired_at, is_used = row
-        if is_used:
+        if row["is_used"]:
             raise HTTPException(status_code=400, detail="OTP already used")
-        if datetime.utcnow() > expired_at:
+        if datetime.utcnow() > row["expired_at"]:
             raise HTTPException(status_code=400, detail="OTP expired")
 
-        cur.execute("UPDATE otp SET is_used = 1 WHERE otpId = ?", (otp_id,))
+        otps.mark_used(row["otpId"])
         conn.commit()
-        logging.info(f"OTP verified successfully for user {data.userId}")
+        logger.info("OTP verified successfully for user %s", data.userId)
         return {"message": "OTP verified successfully"}
     finally:
         conn.close()
@@ -2,11 +2,22 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import logging
-import pyodbc
+import http_cache
+import metrics
+import tracing
+import log_config
 import requests
+import resilience
+import storage
+from repositories import PaymentRepository, PaymentLockRepository
+from datetime import datetime, timedelta
 import json
 import decimal
+import group_commit
+import os
 import threading
+import time
+import uuid
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI(title="Payment Service")
@@ -26,17 +37,20 @@ app.add_middleware(
     allow_headers=["*"],          # cho phép mọi header
 )
 
+# ETag / 304 cho client poll + nén gzip/brotli response lớn (http_cache.py)
+http_cache.instrument_app(app)
+
+# Endpoint /metrics + đo latency theo route, trace span cho mỗi request
+metrics.instrument_app(app, "payment")
+tracing.instrument_app(app, "payment")
+
 # ================== Logging ==================
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# Log đi qua queue (không chặn request); các dòng "Da qua buoc ..." ở mức DEBUG
+logger = log_config.setup_logging("payment_service", level=logging.INFO)
 
 # ================== DB Connection ==================
-def get_connection():
-    return pyodbc.connect(
-        "DRIVER={ODBC Driver 17 for SQL Server};"
-        "SERVER=DESKTOP-PV9Q0OQ\SQLEXPRESS;"
-        "DATABASE=PaymentDB;"
-        "Trusted_Connection=yes;"
-    )
+def get_connection(readonly: bool = False):
+    return storage.get_connection("PaymentDB", readonly=readonly)
 
 # ================== Models ==================
 class CreatePaymentRequest(BaseModel):
@@ -49,7 +63,16 @@ class MakePaymentRequest(BaseModel):
     customerPaymentId: str
     accountId: str
 
-# ================== Global Lock Dictionary ==================
+# ================== Customer Lock ==================
+# IBANKING_PAYMENT_LOCK = local (mặc định): khóa trong process, CHỈ đúng khi chạy 1 worker
+#                       | db: khóa bằng bảng payment_lock, dùng chung cho mọi worker/máy
+PAYMENT_LOCK_MODE = os.getenv("IBANKING_PAYMENT_LOCK", "local").lower()
+# Khóa db giữ quá N giây (worker chết giữa giao dịch) thì coi như đã nhả
+PAYMENT_LOCK_TTL = float(os.getenv("IBANKING_PAYMENT_LOCK_TTL", "30"))
+
+if PAYMENT_LOCK_MODE not in ("local", "db"):
+    raise RuntimeError(f"Unknown IBANKING_PAYMENT_LOCK mode: {PAYMENT_LOCK_MODE}")
+
 # Dùng để đảm bảo không 2 giao dịch cùng lúc trên cùng 1 tài khoản
 account_locks = {}
 account_locks_lock = threading.Lock()  # khóa bảo vệ dictionary
@@ -61,6 +84,46 @@ def get_lock_for_customer(customer_id: int):
             account_locks[customer_id] = threading.Lock()
         return account_locks[customer_id]
 
+def try_lock_customer(customer_id: str):
+    """Không chờ: trả về token nếu lấy được khóa, None nếu customer đang có giao dịch khác"""
+    if PAYMENT_LOCK_MODE == "local":
+        lock = get_lock_for_customer(customer_id)
+        return lock if lock.acquire(blocking=False) else None
+
+    token = uuid.uuid4().hex
+    now = datetime.now()
+    conn = get_connection()
+    try:
+        claimed = PaymentLockRepository(conn).claim(customer_id, token, now, now - timedelta(seconds=PAYMENT_LOCK_TTL))
+        if claimed:
+            conn.commit()
+            return token
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+def unlock_customer(customer_id: str, token):
+    if PAYMENT_LOCK_MODE == "local":
+        token.release()
+        return
+
+    conn = get_connection()
+    try:
+        PaymentLockRepository(conn).release(customer_id, token)
+        conn.commit()
+    except storage.DB_ERRORS as e:
+        # Không xóa được thì khóa tự hết hạn sau PAYMENT_LOCK_TTL
+        logger.error("Failed to release payment lock for %s: %s", customer_id, e)
+        conn.rollback()
+    finally:
+        conn.close()
+
+# ================== Group commit ==================
+# IBANKING_GROUP_COMMIT=1: UPDATE payment SET status='paid' của các request đồng thời được commit chung 1 lô,
+# xem group_commit.py
+payment_writer = group_commit.GroupCommitWriter("payment", "PaymentDB") if group_commit.ENABLED else None
+
 # ================== Decimal Helper ==================
 def decimal_default(obj):
     if isinstance(obj, decimal.Decimal):
@@ -73,28 +136,26 @@ ACCOUNT_SERVICE_URL = "http://127.0.0.1:8001/account"
 # ================== Exception Handler ==================
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logging.error(f"Unexpected error: {exc}")
+    logger.error("Unexpected error: %s", exc)
     return JSONResponse(status_code=500, content={"detail": "Internal Server Error. Please try again later."})
 
+# ================== Resilience Status ==================
+@app.get("/resilience/status")
+def resilience_status():
+    return resilience.status()
+
 # ================== Create Payment ==================
 @app.post("/payment/create")
 def create_payment(data: CreatePaymentRequest):
     conn = get_connection()
-    cur = conn.cursor()
     try:
-        cur.execute(
-            """
-            INSERT INTO payment (customerId, amount, status, transaction_history)
-            VALUES (?, ?, ?, ?)
-            """,
-            (data.customerId, data.amount, "unpaid", data.description)
-        )
+        PaymentRepository(conn).create(data.customerId, data.amount, data.description)
         conn.commit()
-        logging.info(f"Created new payment for customer {data.customerId}")
+        logger.info("Created new payment for customer %s", data.customerId)
         return {"message": "Payment created successfully"}
     except Exception as e:
         conn.rollback()
-        logging.error(f"Error creating payment: {e}")
+        logger.error("Error creating payment: %s", e)
         raise HTTPException(status_code=500, detail="Error creating payment")
     finally:
         conn.close()
@@ -102,18 +163,12 @@ def create_payment(data: CreatePaymentRequest):
 # ================== Find Unpaid Payment ==================
 @app.get("/payment/unpaid/{customerId}")
 def find_unpaid_payment(customerId: int):
-    conn = get_connection()
-    cur = conn.cursor()
+    conn = get_connection(readonly=True)
     try:
-        cur.execute(
-            "SELECT TOP 1 transactionId, amount, status FROM payment WHERE customerId = ? AND status = 'unpaid'",
-            (customerId,)
-        )
-        row = cur.fetchone()
-        if not row:
+        result = PaymentRepository(conn).find_unpaid(customerId)
+        if not result:
             raise HTTPException(status_code=404, detail="No unpaid payment found")
 
-        result = {"transactionId": row[0], "amount": float(row[1]), "status": row[2]}
         return JSONResponse(content=json.loads(json.dumps(result, default=decimal_default)))
     
     except HTTPException as http_exc:
@@ -121,7 +176,7 @@ def find_unpaid_payment(customerId: int):
         raise http_exc
     
     except Exception as e:
-        logging.error(f"Error finding unpaid payment: {e}")
+        logger.error("Error finding unpaid payment: %s", e)
         raise HTTPException(status_code=500, detail="Error finding unpaid payment")
     finally:
         conn.close()
@@ -129,91 +184,65 @@ def find_unpaid_payment(customerId: int):
 # ================== Make Payment ==================
 @app.post("/payment/make")
 def make_payment(data: MakePaymentRequest):
-    lock = get_lock_for_customer(data.customerId)
+    # Thử acquire lock để ngăn giao dịch song song cùng tài khoản
+    wait_start = time.perf_counter()
+    lock_token = try_lock_customer(data.customerId)
+    if PAYMENT_LOCK_MODE == "db":
+        # Khóa local là acquire(blocking=False), luôn ~0: chỉ đo round trip giành dòng payment_lock
+        metrics.LOCK_WAIT.observe(time.perf_counter() - wait_start)
 
-    logging.info("Da qua buoc get customer lock")
+    logger.debug("Da qua buoc get customer lock")
 
-    # Thử acquire lock để ngăn giao dịch song song cùng tài khoản
-    if not lock.acquire(blocking=False):
-        logging.warning(f"Concurrent transaction detected for customer {data.customerId}.")
+    if lock_token is None:
+        metrics.LOCK_CONTENTION.inc()
+        logger.warning("Concurrent transaction detected for customer %s.", data.customerId)
         raise HTTPException(status_code=409, detail="Another transaction is being processed for this account. Please wait.")
+    hold_start = time.perf_counter()
 
     conn = get_connection()
-    cur = conn.cursor()
+    payments = PaymentRepository(conn)
 
     try:
-        logging.info("Da qua buoc get lock")
+        logger.debug("Da qua buoc get lock")
         # --- Kiểm tra unpaid payment (sau khi đã khóa tài khoản) ---
-        cur.execute(
-            "SELECT TOP 1 transactionId, amount FROM payment WHERE customerId = ? AND status = 'unpaid'",
-            (data.customerPaymentId,)
-        )
-        row = cur.fetchone()
+        row = payments.find_unpaid(data.customerPaymentId)
         if not row:
             raise HTTPException(status_code=404, detail="No unpaid payment found")
 
-        transactionId, amount = row
-        amount = float(amount)
+        transactionId, amount = row["transactionId"], row["amount"]
 
-        logging.info("Da qua buoc get unpaid")
+        logger.debug("Da qua buoc get unpaid")
 
-        # --- Lấy thông tin tài khoản từ Account Service ---
+        # --- Trừ tiền bên Account Service (kiểm tra chủ tài khoản + số dư + trừ trong 1 lần gọi) ---
+        debit_payload = {
+            "account_id": data.accountId,
+            "amount": amount,
+            "customer_id": data.customerId,
+            "description": f"Payment {transactionId}"
+        }
         try:
-            res = requests.get(f"{ACCOUNT_SERVICE_URL}/{data.customerId}", timeout=5)
-            if res.status_code != 200:
-                logging.error(f"Account Service error: {res.text}")
-                raise HTTPException(status_code=404, detail="Account not found")
-            account_data = res.json()
+            debit_res = resilience.call("account", "POST", f"{ACCOUNT_SERVICE_URL}/debit", json=debit_payload)
         except requests.exceptions.RequestException as e:
-            logging.error(f"Cannot connect to Account Service: {e}")
-            raise HTTPException(status_code=503, detail="Account Service unavailable")
-
-        if isinstance(account_data, list) and len(account_data) > 0:
-            account = account_data[0]
-        elif isinstance(account_data, dict):
-            account = account_data
-        else:
-            raise HTTPException(status_code=500, detail="Invalid account data format")
-        
-        logging.info("Da qua buoc get account")
-
-        # balance = float(account.get("balance", 0))
-        balance = float(account["balance"])
-
-        logging.info("Da qua buoc get balance")
+            logger.error("Debit API error: %s", e)
+            raise HTTPException(status_code=503, detail="Account Service unavailable during balance update")
 
-        if balance < amount:
-            logging.warning(f"Customer {data.customerId} insufficient funds. Balance: {balance}, Need: {amount}")
+        if debit_res.status_code == 400:
+            logger.warning("Customer %s insufficient funds. Need: %s", data.customerId, amount)
             raise HTTPException(status_code=400, detail="Insufficient funds")
-        
-        logging.info(f"Balance: {balance}")
-        logging.info(f"Amount: {amount}")
-        logging.info(f"Balance - Amount: {balance - amount}")
+        if debit_res.status_code in (403, 404):
+            logger.error("Account Service error: %s", debit_res.text)
+            raise HTTPException(status_code=404, detail="Account not found")
+        if debit_res.status_code != 200:
+            raise HTTPException(status_code=400, detail="Balance update failed")
 
-        # --- Cập nhật số dư bên Account Service ---
-        update_payload = {"account_id": data.accountId, "amount": amount, "description": ""}
-        try:
-            update_res = requests.put(
-                f"{ACCOUNT_SERVICE_URL}/update-balance",
-                json=update_payload,
-                timeout=5
-            )
-            if update_res.status_code != 200:
-                raise HTTPException(status_code=400, detail="Balance update failed")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Update balance API error: {e}")
-            raise HTTPException(status_code=503, detail="Account Service unavailable during balance update")
-        
-        logging.info("Da qua buoc update balance")
-
-        # --- Đánh dấu thanh toán hoàn tất ---
-        cur.execute(
-            "UPDATE payment SET status = 'paid', transaction_history = ? WHERE transactionId = ?",
-            (f"Paid {amount}", transactionId)
-        )
-        conn.commit()
+        logger.debug("Da qua buoc update balance")
+
+        # --- Đánh dấu thanh toán hoàn tất (commit riêng, hoặc chung lô với request khác) ---
+        group_commit.run_in_transaction(
+            "PaymentDB", lambda writer_conn: PaymentRepository(writer_conn).mark_paid(transactionId, f"Paid {amount}"),
+            payment_writer)
 
-        logging.info("Da qua buoc update payment")
+        logger.debug("Da qua buoc update payment")
 
         result = {
             "message": "Payment successful",
@@ -229,10 +258,11 @@ def make_payment(data: MakePaymentRequest):
         raise
     except Exception as e:
         conn.rollback()
-        logging.error(f"Payment processing failed: {e}")
+        logger.error("Payment processing failed: %s", e)
         raise HTTPException(status_code=500, detail="Payment transaction failed")
     finally:
-        lock.release()
+        unlock_customer(data.customerId, lock_token)
+        metrics.LOCK_HOLD.observe(time.perf_counter() - hold_start)
         conn.close()
 
 # ================== Run ==================
@@ -0,0 +1,570 @@
+import random
+
+import metrics
+import storage
+
+# ================== Repository layer ==================
+# Mỗi repository gói các câu SQL của 1 service, nhận connection từ storage.get_connection().
+# Repository không tự commit: service quyết định commit/rollback (giữ nguyên ranh giới transaction cũ).
+# Chỗ cú pháp khác nhau giữa SQL Server và SQLite (TOP/LIMIT, OUTPUT/RETURNING, GETDATE) đi qua _sql().
+
+class DebitRejected(Exception):
+    """Không trừ được tiền; reason = not_found | forbidden | insufficient_funds"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Repository:
+    def __init__(self, conn):
+        self.conn = conn
+        self.cur = conn.cursor()
+
+    @staticmethod
+    def _sql(mssql: str, sqlite: str) -> str:
+        return mssql if storage.is_mssql() else sqlite
+
+
+# ================== AccountDB ==================
+class AccountRepository(_Repository):
+    COLUMNS = "customer_id, account_id, balance, version"
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        return {"customer_id": row[0], "account_id": row[1], "balance": float(row[2]), "version": row[3]}
+
+    def list_by_customer(self, customer_id: str) -> list:
+        self.cur.execute(f"SELECT {self.COLUMNS} FROM account WHERE customer_id = ?", (customer_id,))
+        return [self._to_dict(row) for row in self.cur.fetchall()]
+
+    def get(self, account_id: str):
+        self.cur.execute(f"SELECT {self.COLUMNS} FROM account WHERE account_id = ?", (account_id,))
+        row = self.cur.fetchone()
+        return self._to_dict(row) if row else None
+
+    def _lock(self, account_id: str):
+        """Khóa account tới hết transaction (các debit của cùng account chạy tuần tự); trả customer_id, None nếu không có"""
+        self.cur.execute(
+            self._sql(
+                "SELECT customer_id FROM account WITH (UPDLOCK, ROWLOCK) WHERE account_id = ?",
+                # SQLite không có khóa dòng: 1 câu ghi no-op để giữ write lock của DB tới khi commit
+                "UPDATE account SET version = version WHERE account_id = ? RETURNING customer_id",
+            ),
+            (account_id,)
+        )
+        row = self.cur.fetchone()
+        return row[0] if row else None
+
+    def set_balance(self, account_id: str, balance: float, expected_version: int, description: str = ""):
+        """Ghi số dư nếu version chưa đổi kể từ lúc đọc; trả về dòng mới, None nếu đã có ai ghi trước"""
+        self.cur.execute(
+            self._sql(
+                """
+                UPDATE account SET balance = ?, version = version + 1
+                OUTPUT INSERTED.customer_id, INSERTED.account_id, INSERTED.balance, INSERTED.version
+                WHERE account_id = ? AND version = ?
+                """,
+                """
+                UPDATE account SET balance = ?, version = version + 1
+                WHERE account_id = ? AND version = ?
+                RETURNING customer_id, account_id, balance, version
+                """,
+            ),
+            (balance, account_id, expected_version)
+        )
+        row = self.cur.fetchone()
+        return self._to_dict(row) if row else None
+
+    def debit(self, account_id: str, amount: float, customer_id: str = None, description: str = "") -> dict:
+        """Kiểm tra chủ tài khoản + số dư và trừ tiền trong 1 câu UPDATE; trả về số dư mới"""
+        self.cur.execute(
+            self._sql(
+                """
+                UPDATE account SET balance = balance - ?, version = version + 1
+                OUTPUT INSERTED.customer_id, INSERTED.account_id, INSERTED.balance, INSERTED.version
+                WHERE account_id = ? AND balance >= ? AND (? IS NULL OR customer_id = ?)
+                """,
+                """
+                UPDATE account SET balance = balance - ?, version = version + 1
+                WHERE account_id = ? AND balance >= ? AND (? IS NULL OR customer_id = ?)
+                RETURNING customer_id, account_id, balance, version
+                """,
+            ),
+            (amount, account_id, amount, customer_id, customer_id)
+        )
+        row = self.cur.fetchone()
+        if row:
+            return self._to_dict(row)
+
+        # Không trừ được -> đọc lại để biết lý do
+        current = self.get(account_id)
+        if not current:
+            raise DebitRejected("not_found")
+        if customer_id is not None and current["customer_id"] != customer_id:
+            raise DebitRejected("forbidden")
+        raise DebitRejected("insufficient_funds")
+
+
+# Số dư theo ledger = snapshot mới nhất + tổng các bút toán sau snapshot đó (chỉ quét phần đuôi, không quét cả lịch sử).
+# Account chưa có snapshot (thêm sau ensure_opening_snapshots) -> account.balance là số dư mở đầu, tính từ entry_id 0
+_LAST_SNAPSHOT = "COALESCE((SELECT MAX(entry_id) FROM balance_snapshot WHERE account_id = a.account_id), 0)"
+_LEDGER_BALANCE = f"""(
+    COALESCE((SELECT s.balance FROM balance_snapshot s
+              WHERE s.account_id = a.account_id AND s.entry_id = {_LAST_SNAPSHOT}), a.balance)
+    + COALESCE((SELECT SUM(e.amount) FROM ledger_entry e
+                WHERE e.account_id = a.account_id AND e.entry_id > {_LAST_SNAPSHOT}), 0))"""
+# version = id bút toán cuối của account (tăng dần như version của dòng account)
+_LEDGER_VERSION = "COALESCE((SELECT MAX(entry_id) FROM ledger_entry WHERE account_id = a.account_id), 0)"
+
+
+class LedgerAccountRepository(AccountRepository):
+    """IBANKING_ACCOUNT_LEDGER=1: ledger_entry (chỉ INSERT) là nguồn sự thật, dòng account không còn bị ghi số dư.
+    balance_snapshot chốt số dư định kỳ; cột account.balance chỉ còn là số dư mở đầu (snapshot entry_id = 0).
+
+    - Ghi có (credit): chỉ INSERT, không khóa gì -> không tranh chấp dòng
+    - Ghi nợ (debit / set_balance): khóa dòng account (UPDLOCK, không ghi) để kiểm tra đủ tiền rồi INSERT"""
+
+    COLUMNS = f"a.customer_id, a.account_id, {_LEDGER_BALANCE}, {_LEDGER_VERSION}"
+
+    def list_by_customer(self, customer_id: str) -> list:
+        self.cur.execute(f"SELECT {self.COLUMNS} FROM account a WHERE a.customer_id = ?", (customer_id,))
+        return [self._to_dict(row) for row in self.cur.fetchall()]
+
+    def get(self, account_id: str):
+        self.cur.execute(f"SELECT {self.COLUMNS} FROM account a WHERE a.account_id = ?", (account_id,))
+        row = self.cur.fetchone()
+        return self._to_dict(row) if row else None
+
+    def _append(self, account_id: str, amount: float, description: str) -> int:
+        self.cur.execute(
+            self._sql(
+                """
+                INSERT INTO ledger_entry (account_id, amount, description, created_at)
+                OUTPUT INSERTED.entry_id
+                VALUES (?, ?, ?, SYSDATETIME())
+                """,
+                """
+                INSERT INTO ledger_entry (account_id, amount, description, created_at)
+                VALUES (?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+                RETURNING entry_id
+                """,
+            ),
+            (account_id, amount, description)
+        )
+        return int(self.cur.fetchone()[0])
+
+    def set_balance(self, account_id: str, balance: float, expected_version: int, description: str = ""):
+        if self._lock(account_id) is None:
+            return None
+        current = self.get(account_id)
+        if current["version"] != expected_version:
+            return None
+        entry_id = self._append(account_id, round(balance - current["balance"], 2), description)
+        return {**current, "balance": balance, "version": entry_id}
+
+    def debit(self, account_id: str, amount: float, customer_id: str = None, description: str = "") -> dict:
+        owner = self._lock(account_id)
+        if owner is None:
+            raise DebitRejected("not_found")
+        if customer_id is not None and owner != customer_id:
+            raise DebitRejected("forbidden")
+        current = self.get(account_id)
+        if current["balance"] < amount:
+            raise DebitRejected("insufficient_funds")
+        entry_id = self._append(account_id, -amount, description)
+        return {**current, "balance": round(current["balance"] - amount, 2), "version": entry_id}
+
+    def credit(self, account_id: str, amount: float, description: str = ""):
+        """Ghi có không cần khóa (không thể làm âm số dư); trả dòng account tính tới bút toán vừa ghi"""
+        self.cur.execute("SELECT customer_id FROM account WHERE account_id = ?", (account_id,))
+        row = self.cur.fetchone()
+        if not row:
+            return None
+        entry_id = self._append(account_id, amount, description)
+        return {"customer_id": row[0], "account_id": account_id,
+                "balance": self.balance_through(account_id, entry_id), "version": entry_id}
+
+    def balance_through(self, account_id: str, entry_id: int) -> float:
+        """Số dư ngay sau bút toán entry_id: snapshot gần nhất trước nó (không có -> account.balance) + các bút toán ở giữa"""
+        self.cur.execute(
+            """
+            SELECT COALESCE(s.balance, a.balance)
+                   + COALESCE((SELECT SUM(e.amount) FROM ledger_entry e
+                               WHERE e.account_id = a.account_id AND e.entry_id > COALESCE(s.entry_id, 0)
+                                 AND e.entry_id <= ?), 0)
+            FROM account a
+            LEFT JOIN balance_snapshot s ON s.account_id = a.account_id
+              AND s.entry_id = (SELECT MAX(entry_id) FROM balance_snapshot WHERE account_id = a.account_id AND entry_id <= ?)
+            WHERE a.account_id = ?
+            """,
+            (entry_id, entry_id, account_id)
+        )
+        return round(float(self.cur.fetchone()[0]), 2)
+
+    def balance_at(self, account_id: str, at):
+        """Số dư tại thời điểm `at`; None nếu trước khi account có trong ledger.
+        Account chưa có snapshot nào thì tính từ account.balance (số dư mở đầu)"""
+        self.cur.execute(
+            """
+            SELECT COALESCE(s.balance, a.balance)
+                   + COALESCE((SELECT SUM(e.amount) FROM ledger_entry e
+                               WHERE e.account_id = a.account_id AND e.entry_id > COALESCE(s.entry_id, 0)
+                                 AND e.created_at <= ?), 0)
+            FROM account a
+            LEFT JOIN balance_snapshot s ON s.account_id = a.account_id
+              AND s.entry_id = (SELECT MAX(entry_id) FROM balance_snapshot WHERE account_id = a.account_id AND as_of <= ?)
+            WHERE a.account_id = ?
+              AND (s.entry_id IS NOT NULL OR NOT EXISTS (SELECT 1 FROM balance_snapshot WHERE account_id = a.account_id))
+            """,
+            (at, at, account_id)
+        )
+        row = self.cur.fetchone()
+        return round(float(row[0]), 2) if row else None
+
+    def history(self, account_id: str, limit: int, before: int = None) -> list:
+        """Các bút toán mới nhất trước (entry_id < before), kèm số dư sau mỗi bút toán"""
+        self.cur.execute(
+            self._sql(
+                """
+                SELECT TOP (?) entry_id, amount, description, created_at FROM ledger_entry
+                WHERE account_id = ? AND (? IS NULL OR entry_id < ?) ORDER BY entry_id DESC
+                """,
+                """
+                SELECT entry_id, amount, description, created_at FROM ledger_entry
+                WHERE account_id = ? AND (? IS NULL OR entry_id < ?) ORDER BY entry_id DESC LIMIT ?
+                """,
+            ),
+            (limit, account_id, before, before) if storage.is_mssql() else (account_id, before, before, limit)
+        )
+        rows = self.cur.fetchall()
+        if not rows:
+            return []
+        # Số dư sau bút toán mới nhất của trang lấy từ snapshot, các dòng sau lùi dần theo amount
+        balance = self.balance_through(account_id, rows[0][0])
+        entries = []
+        for entry_id, amount, description, created_at in rows:
+            entries.append({"entry_id": entry_id, "amount": float(amount), "description": description,
+                            "created_at": created_at, "balance_after": round(balance, 2)})
+            balance -= float(amount)
+        return entries
+
+    def ensure_opening_snapshots(self) -> int:
+        """Snapshot entry_id = 0 từ account.balance cho account chưa có trong ledger (lần đầu bật ledger)"""
+        self.cur.execute(
+            self._sql(
+                """
+                INSERT INTO balance_snapshot (account_id, entry_id, balance, as_of)
+                SELECT a.account_id, 0, a.balance, SYSDATETIME() FROM account a
+                WHERE NOT EXISTS (SELECT 1 FROM balance_snapshot s WHERE s.account_id = a.account_id)
+                """,
+                """
+                INSERT INTO balance_snapshot (account_id, entry_id, balance, as_of)
+                SELECT a.account_id, 0, a.balance, strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') FROM account a
+                WHERE NOT EXISTS (SELECT 1 FROM balance_snapshot s WHERE s.account_id = a.account_id)
+                """,
+            )
+        )
+        return self.cur.rowcount
+
+    def take_snapshots(self, min_entries: int, settle_seconds: int = 5) -> int:
+        """Chốt snapshot cho các account có >= min_entries bút toán kể từ snapshot trước.
+        Bỏ qua bút toán mới hơn settle_seconds: transaction còn đang chạy có thể giữ entry_id nhỏ hơn mà chưa commit."""
+        self.cur.execute(
+            self._sql(
+                """
+                SELECT e.account_id, MAX(e.entry_id) FROM ledger_entry e
+                WHERE e.entry_id > (SELECT MAX(entry_id) FROM balance_snapshot WHERE account_id = e.account_id)
+                  AND e.created_at < DATEADD(second, -?, SYSDATETIME())
+                GROUP BY e.account_id HAVING COUNT(*) >= ?
+                """,
+                """
+                SELECT e.account_id, MAX(e.entry_id) FROM ledger_entry e
+                WHERE e.entry_id > (SELECT MAX(entry_id) FROM balance_snapshot WHERE account_id = e.account_id)
+                  AND e.created_at < strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime', '-' || ? || ' seconds')
+                GROUP BY e.account_id HAVING COUNT(*) >= ?
+                """,
+            ),
+            (settle_seconds, min_entries)
+        )
+        due = self.cur.fetchall()
+        for account_id, entry_id in due:
+            balance = self.balance_through(account_id, entry_id)
+            self.cur.execute(
+                """
+                INSERT INTO balance_snapshot (account_id, entry_id, balance, as_of)
+                SELECT ?, ?, ?, created_at FROM ledger_entry WHERE entry_id = ?
+                """,
+                (account_id, entry_id, balance, entry_id)
+            )
+        return len(due)
+
+
+# Account sharded: số dư = account.balance (về 0 khi chia bucket) + tổng các bucket; account thường không có bucket
+_BUCKET_BALANCE = """ROUND(a.balance + COALESCE((SELECT SUM(b.balance) FROM account_bucket b
+                                              WHERE b.account_id = a.account_id), 0), 2)"""
+# version = version của dòng account + tổng version các bucket (vẫn tăng mỗi lần số dư đổi)
+_BUCKET_VERSION = "a.version + COALESCE((SELECT SUM(b.version) FROM account_bucket b WHERE b.account_id = a.account_id), 0)"
+
+BUCKET_REBALANCES = metrics.counter("account_bucket_rebalances_total",
+                                    "Sharded-account debits that had to lock every bucket", ("outcome",))
+
+
+class ShardedAccountRepository(AccountRepository):
+    """IBANKING_SHARDED_ACCOUNTS: số dư của account "nóng" (merchant) được chia ra N dòng account_bucket.
+
+    - Debit / credit chỉ khóa 1 bucket chọn ngẫu nhiên -> tới N giao dịch cùng account chạy song song
+    - Bucket được chọn không đủ tiền -> khóa mọi bucket (theo thứ tự bucket_no, không deadlock), kiểm tra tổng
+      rồi chia đều phần còn lại cho các bucket (rebalance)
+    - Đọc số dư = tổng các bucket; account không có bucket đi đường cũ của AccountRepository"""
+
+    COLUMNS = f"a.customer_id, a.account_id, {_BUCKET_BALANCE}, {_BUCKET_VERSION}"
+
+    def list_by_customer(self, customer_id: str) -> list:
+        self.cur.execute(f"SELECT {self.COLUMNS} FROM account a WHERE a.customer_id = ?", (customer_id,))
+        return [self._to_dict(row) for row in self.cur.fetchall()]
+
+    def get(self, account_id: str):
+        self.cur.execute(f"SELECT {self.COLUMNS} FROM account a WHERE a.account_id = ?", (account_id,))
+        row = self.cur.fetchone()
+        return self._to_dict(row) if row else None
+
+    def _current(self, account_id: str):
+        """(dòng account, số bucket); đọc không khóa, trước khi ghi bucket nào -> không tạo vòng chờ giữa các bucket"""
+        self.cur.execute(
+            f"""
+            SELECT {self.COLUMNS}, (SELECT COUNT(*) FROM account_bucket b WHERE b.account_id = a.account_id)
+            FROM account a WHERE a.account_id = ?
+            """,
+            (account_id,)
+        )
+        row = self.cur.fetchone()
+        return (self._to_dict(row), row[4]) if row else (None, 0)
+
+    def _change_bucket(self, account_id: str, bucket_no: int, delta: float) -> bool:
+        """Cộng delta vào 1 bucket nếu bucket đó không bị âm; False nếu bucket không đủ tiền"""
+        self.cur.execute(
+            """
+            UPDATE account_bucket SET balance = balance + ?, version = version + 1
+            WHERE account_id = ? AND bucket_no = ? AND balance + ? >= 0
+            """,
+            (delta, account_id, bucket_no, delta)
+        )
+        return self.cur.rowcount == 1
+
+    def _lock_buckets(self, account_id: str) -> list:
+        """Khóa mọi bucket của account tới hết transaction; trả [(bucket_no, balance, version)]"""
+        if not storage.is_mssql():
+            # SQLite không có khóa dòng: 1 câu ghi no-op để giữ write lock của DB tới khi commit
+            self.cur.execute("UPDATE account_bucket SET version = version WHERE account_id = ?", (account_id,))
+        self.cur.execute(
+            self._sql(
+                """
+                SELECT bucket_no, balance, version FROM account_bucket WITH (UPDLOCK, ROWLOCK)
+                WHERE account_id = ? ORDER BY bucket_no
+                """,
+                "SELECT bucket_no, balance, version FROM account_bucket WHERE account_id = ? ORDER BY bucket_no",
+            ),
+            (account_id,)
+        )
+        return [(row[0], float(row[1]), row[2]) for row in self.cur.fetchall()]
+
+    def _spread(self, account_id: str, buckets: list, total: float):
+        """Chia đều total cho các bucket, tính theo xu để tổng các bucket đúng bằng total"""
+        share, rest = divmod(round(total * 100), len(buckets))
+        self.cur.executemany(
+            "UPDATE account_bucket SET balance = ?, version = version + 1 WHERE account_id = ? AND bucket_no = ?",
+            [((share + (i < rest)) / 100, account_id, bucket_no) for i, bucket_no in enumerate(buckets)]
+        )
+
+    def set_balance(self, account_id: str, balance: float, expected_version: int, description: str = ""):
+        current, buckets = self._current(account_id)
+        if not buckets:
+            return super().set_balance(account_id, balance, expected_version, description)
+        # Ghi số dư tuyệt đối phải khóa cả account như trước; update_balance dùng debit/credit cho account sharded
+        rows = self._lock_buckets(account_id)
+        current = self.get(account_id)
+        if current["version"] != expected_version:
+            return None
+        self._spread(account_id, [bucket_no for bucket_no, _, _ in rows], balance)
+        return self.get(account_id)
+
+    def debit(self, account_id: str, amount: float, customer_id: str = None, description: str = "") -> dict:
+        current, buckets = self._current(account_id)
+        if not buckets:
+            return super().debit(account_id, amount, customer_id, description)
+        if customer_id is not None and current["customer_id"] != customer_id:
+            raise DebitRejected("forbidden")
+        # Số dư / version trả về tính từ lần đọc ở trên (không khóa), giao dịch song song ở bucket khác không
+        # nằm trong đó -> chỉ là ước lượng, caller không được đưa dòng này vào cache. Không đọc lại tổng ở đây:
+        # đọc các bucket đang bị transaction khác giữ khóa sẽ chờ chéo nhau (deadlock) trên SQL Server.
+        if self._change_bucket(account_id, random.randrange(buckets), -amount):
+            return {**current, "balance": round(current["balance"] - amount, 2), "version": current["version"] + 1}
+
+        # Bucket này thiếu tiền: khóa hết các bucket, kiểm tra tổng rồi chia lại
+        rows = self._lock_buckets(account_id)
+        total = round(sum(balance for _, balance, _ in rows), 2)
+        if total < amount:
+            BUCKET_REBALANCES.labels("insufficient_funds").inc()
+            raise DebitRejected("insufficient_funds")
+        BUCKET_REBALANCES.labels("rebalanced").inc()
+        self._spread(account_id, [bucket_no for bucket_no, _, _ in rows], round(total - amount, 2))
+        return self.get(account_id)
+
+    def credit(self, account_id: str, amount: float, description: str = ""):
+        """Ghi có vào 1 bucket ngẫu nhiên (không bao giờ thiếu tiền); None nếu không có account.
+        Dòng trả về là ước lượng như nhánh nhanh của debit"""
+        current, buckets = self._current(account_id)
+        if current is None:
+            return None
+        if buckets:
+            self._change_bucket(account_id, random.randrange(buckets), amount)
+        else:
+            self.cur.execute("UPDATE account SET balance = balance + ?, version = version + 1 WHERE account_id = ?",
+                             (amount, account_id))
+        return {**current, "balance": round(current["balance"] + amount, 2), "version": current["version"] + 1}
+
+    def shard(self, account_id: str, buckets: int) -> bool:
+        """Chia số dư account ra `buckets` bucket (hoặc chia lại nếu đang có số bucket khác); False nếu không có account"""
+        if self._lock(account_id) is None:
+            return False
+        rows = self._lock_buckets(account_id)
+        if len(rows) == buckets:
+            return True
+        self.cur.execute("SELECT balance FROM account WHERE account_id = ?", (account_id,))
+        total = round(float(self.cur.fetchone()[0]) + sum(balance for _, balance, _ in rows), 2)
+        self.cur.execute("DELETE FROM account_bucket WHERE account_id = ?", (account_id,))
+        self.cur.executemany(
+            "INSERT INTO account_bucket (account_id, bucket_no, balance, version) VALUES (?, ?, 0, 0)",
+            [(account_id, bucket_no) for bucket_no in range(buckets)]
+        )
+        self._spread(account_id, list(range(buckets)), total)
+        # Cộng version cũ của các bucket vào dòng account để version tổng không đi lùi
+        self.cur.execute("UPDATE account SET balance = 0, version = version + ? WHERE account_id = ?",
+                         (sum(version for _, _, version in rows) + 1, account_id))
+        return True
+
+    def unshard(self, account_id: str):
+        """Gộp các bucket về lại cột account.balance"""
+        self._lock(account_id)
+        rows = self._lock_buckets(account_id)
+        if not rows:
+            return
+        self.cur.execute("DELETE FROM account_bucket WHERE account_id = ?", (account_id,))
+        self.cur.execute(
+            "UPDATE account SET balance = balance + ?, version = version + ? WHERE account_id = ?",
+            (round(sum(balance for _, balance, _ in rows), 2), sum(version for _, _, version in rows) + 1, account_id)
+        )
+
+    def sharded_accounts(self) -> list:
+        self.cur.execute("SELECT DISTINCT account_id FROM account_bucket")
+        return [row[0] for row in self.cur.fetchall()]
+
+
+# ================== CustomerDB ==================
+class CustomerRepository(_Repository):
+    def get(self, customer_id: str):
+        self.cur.execute(
+            "SELECT customer_id, full_name, phone_number, email FROM Customers WHERE customer_id = ?",
+            (customer_id,)
+        )
+        row = self.cur.fetchone()
+        if not row:
+            return None
+        return {"customer_id": row[0], "full_name": row[1], "phone_number": row[2], "email": row[3]}
+
+
+# ================== PaymentDB ==================
+class PaymentRepository(_Repository):
+    def create(self, customer_id: int, amount: float, description: str):
+        self.cur.execute(
+            "INSERT INTO payment (customerId, amount, status, transaction_history) VALUES (?, ?, ?, ?)",
+            (customer_id, amount, "unpaid", description)
+        )
+
+    def find_unpaid(self, customer_id):
+        self.cur.execute(
+            self._sql(
+                "SELECT TOP 1 transactionId, amount, status FROM payment WHERE customerId = ? AND status = 'unpaid'",
+                "SELECT transactionId, amount, status FROM payment WHERE customerId = ? AND status = 'unpaid' LIMIT 1",
+            ),
+            (customer_id,)
+        )
+        row = self.cur.fetchone()
+        if not row:
+            return None
+        return {"transactionId": row[0], "amount": float(row[1]), "status": row[2]}
+
+    def mark_paid(self, transaction_id, history: str):
+        self.cur.execute(
+            "UPDATE payment SET status = 'paid', transaction_history = ? WHERE transactionId = ?",
+            (history, transaction_id)
+        )
+
+
+class PaymentLockRepository(_Repository):
+    """Khóa theo customer dùng chung giữa các worker: 1 dòng payment_lock = 1 giao dịch đang chạy"""
+
+    def claim(self, customer_id: str, token: str, now, stale_before) -> bool:
+        # Khóa quá hạn (worker chết giữa chừng) thì được lấy lại
+        self.cur.execute("DELETE FROM payment_lock WHERE customerId = ? AND claimed_at < ?", (customer_id, stale_before))
+        try:
+            self.cur.execute(
+                "INSERT INTO payment_lock (customerId, token, claimed_at) VALUES (?, ?, ?)",
+                (customer_id, token, now)
+            )
+        except storage.INTEGRITY_ERRORS:
+            return False
+        return True
+
+    def release(self, customer_id: str, token: str):
+        # Chỉ xóa đúng khóa của mình (khóa quá hạn có thể đã bị worker khác lấy)
+        self.cur.execute("DELETE FROM payment_lock WHERE customerId = ? AND token = ?", (customer_id, token))
+
+
+# ================== OtpDB ==================
+class OtpRepository(_Repository):
+    def create(self, user_id: int, otp_code: str, expired_at):
+        self.cur.execute(
+            "INSERT INTO otp (userId, otpCode, expired_at, is_used) VALUES (?, ?, ?, 0)",
+            (user_id, otp_code, expired_at)
+        )
+
+    def find(self, user_id: int, otp_code: str):
+        self.cur.execute("SELECT otpId, expired_at, is_used FROM otp WHERE userId = ? AND otpCode = ?", (user_id, otp_code))
+        row = self.cur.fetchone()
+        if not row:
+            return None
+        return {"otpId": row[0], "expired_at": row[1], "is_used": bool(row[2])}
+
+    def mark_used(self, otp_id: int):
+        self.cur.execute("UPDATE otp SET is_used = 1 WHERE otpId = ?", (otp_id,))
+
+
+# ================== AuthenticationDB ==================
+class AuthRepository(_Repository):
+    def find_by_username(self, username: str):
+        self.cur.execute("SELECT userId, customer_id, password_hash FROM authentication WHERE username = ?", (username,))
+        row = self.cur.fetchone()
+        if not row:
+            return None
+        return {"userId": row[0], "customer_id": row[1], "password_hash": row[2]}
+
+
+# ================== EmailDB ==================
+class EmailLogRepository(_Repository):
+    def add(self, recipient: str, subject: str, status: str, error_message: str = None):
+        self.cur.execute(
+            self._sql(
+                "INSERT INTO EmailLogs (recipient, subject, status, error_message, sent_time) VALUES (?, ?, ?, ?, GETDATE())",
+                "INSERT INTO EmailLogs (recipient, subject, status, error_message, sent_time) VALUES (?, ?, ?, ?, datetime('now', 'localtime'))",
+            ),
+            (recipient, subject, status, error_message)
+        )
+
+    def list(self) -> list:
+        self.cur.execute("SELECT recipient, subject, status, sent_time FROM EmailLogs ORDER BY sent_time DESC")
+        return [
+            {"to": row[0], "subject": row[1], "status": row[2], "time": row[3]}
+            for row in self.cur.fetchall()
+        ]
@@ -0,0 +1,224 @@
+import os
+import threading
+import time
+import logging
+import requests
+import metrics
+import tracing
+
+# ================== Config ==================
+# Có thể chỉnh qua biến môi trường, áp dụng cho mọi dependency (trừ khi gọi configure() riêng)
+DEFAULT_TIMEOUT = float(os.getenv("IBANKING_DOWNSTREAM_TIMEOUT", "5"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("IBANKING_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("IBANKING_BREAKER_RESET_SECONDS", "10"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("IBANKING_BREAKER_HALF_OPEN_CALLS", "1"))
+BULKHEAD_MAX_CONCURRENT = int(os.getenv("IBANKING_BULKHEAD_MAX_CONCURRENT", "10"))
+BULKHEAD_MAX_WAIT_SECONDS = float(os.getenv("IBANKING_BULKHEAD_MAX_WAIT", "0.05"))
+
+logger = logging.getLogger("resilience")
+
+
+# ================== Errors ==================
+# Kế thừa ConnectionError để các chỗ đang bắt requests.exceptions.RequestException
+# (trả 503 "... unavailable") xử lý luôn trường hợp fail-fast mà không cần sửa
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+class BulkheadFullError(requests.exceptions.ConnectionError):
+    pass
+
+
+# ================== Circuit Breaker ==================
+class CircuitBreaker:
+    """closed -> open sau N lỗi liên tiếp; open -> half_open sau reset_timeout; half_open cho vài request thử"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_SECONDS, half_open_max_calls: int = BREAKER_HALF_OPEN_CALLS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self._rejected += 1
+                    return False
+                # Hết thời gian chờ -> cho request thử (half-open probing)
+                self._state = self.HALF_OPEN
+                self._half_open_in_flight = 0
+            if self._state == self.HALF_OPEN:
+                if self._half_open_in_flight >= self.half_open_max_calls:
+                    self._rejected += 1
+                    return False
+                self._half_open_in_flight += 1
+            return True
+
+    def cancel_request(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._half_open_in_flight > 0:
+                self._half_open_in_flight -= 1
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.warning("Circuit %s closed", self.name)
+            self._state = self.CLOSED
+            self._failures = 0
+            self._half_open_in_flight = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("Circuit %s opened after %d failures", self.name, self._failures)
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._half_open_in_flight = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            # Hiển thị half_open khi đã hết thời gian chờ dù chưa có request thử
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def snapshot(self) -> dict:
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "rejected": self._rejected,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+            }
+
+
+# ================== Bulkhead ==================
+class Bulkhead:
+    """Giới hạn số lời gọi đồng thời tới 1 dependency để không chiếm hết threadpool"""
+
+    def __init__(self, name: str, max_concurrent: int = BULKHEAD_MAX_CONCURRENT,
+                 max_wait: float = BULKHEAD_MAX_WAIT_SECONDS):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._in_flight = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        if not self._semaphore.acquire(timeout=self.max_wait):
+            with self._lock:
+                self._rejected += 1
+            return False
+        with self._lock:
+            self._in_flight += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_concurrent": self.max_concurrent,
+                "rejected": self._rejected,
+            }
+
+
+# ================== Dependency Registry ==================
+class Dependency:
+    def __init__(self, name: str, timeout: float = DEFAULT_TIMEOUT, **kwargs):
+        self.name = name
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(name, **{k: v for k, v in kwargs.items()
+                                               if k in ("failure_threshold", "reset_timeout", "half_open_max_calls")})
+        self.bulkhead = Bulkhead(name, **{k: v for k, v in kwargs.items() if k in ("max_concurrent", "max_wait")})
+        # Giữ kết nối keep-alive tới dependency thay vì mở TCP mới mỗi lần gọi
+        self.session = requests.Session()
+
+_dependencies: dict = {}
+_dependencies_lock = threading.Lock()
+
+def configure(name: str, **kwargs) -> Dependency:
+    """Đăng ký (hoặc thay) cấu hình cho 1 dependency, ví dụ configure("email", max_concurrent=4)"""
+    with _dependencies_lock:
+        _dependencies[name] = Dependency(name, **kwargs)
+        return _dependencies[name]
+
+def get_dependency(name: str) -> Dependency:
+    with _dependencies_lock:
+        if name not in _dependencies:
+            _dependencies[name] = Dependency(name)
+        return _dependencies[name]
+
+def call(name: str, method: str, url: str, **kwargs) -> requests.Response:
+    """Gọi HTTP tới dependency `name` qua circuit breaker + bulkhead.
+
+    Fail-fast bằng CircuitOpenError / BulkheadFullError (đều là RequestException).
+    Lỗi mạng và response 5xx được tính là failure; 4xx là lỗi nghiệp vụ, không mở mạch.
+    """
+    dep = get_dependency(name)
+    if not dep.breaker.allow_request():
+        metrics.DOWNSTREAM_LATENCY.labels(name, method, "circuit_open").observe(0)
+        raise CircuitOpenError(f"{name} circuit is open")
+    if not dep.bulkhead.acquire():
+        # Không gọi được thì trả lại lượt half-open cho request sau
+        dep.breaker.cancel_request()
+        metrics.DOWNSTREAM_LATENCY.labels(name, method, "bulkhead_full").observe(0)
+        raise BulkheadFullError(f"{name} bulkhead is full")
+    start = time.perf_counter()
+    try:
+        kwargs.setdefault("timeout", dep.timeout)
+        with tracing.start_span(f"{method} {name}", kind="client",
+                                attributes={"peer.service": name, "http.method": method, "http.url": url}) as span:
+            # Truyền trace context sang service đích
+            kwargs["headers"] = tracing.inject(dict(kwargs.get("headers") or {}))
+            res = dep.session.request(method, url, **kwargs)
+            if span is not None:
+                span.set_attribute("http.status_code", res.status_code)
+    except requests.exceptions.RequestException:
+        dep.breaker.record_failure()
+        metrics.DOWNSTREAM_LATENCY.labels(name, method, "error").observe(time.perf_counter() - start)
+        raise
+    except BaseException:
+        # Lỗi không do dependency (tham số sai, lỗi tracing, bị ngắt...): không tính failure
+        # nhưng vẫn trả lại lượt half-open, nếu không mạch kẹt ở half-open mãi
+        dep.breaker.cancel_request()
+        raise
+    finally:
+        dep.bulkhead.release()
+
+    metrics.DOWNSTREAM_LATENCY.labels(name, method, f"{res.status_code // 100}xx").observe(time.perf_counter() - start)
+    if res.status_code >= 500:
+        dep.breaker.record_failure()
+    else:
+        dep.breaker.record_success()
+    return res
+
+def status() -> dict:
+    with _dependencies_lock:
+        deps = list(_dependencies.values())
+    return {
+        dep.name: {"circuit": dep.breaker.snapshot(), "bulkhead": dep.bulkhead.snapshot()}
+        for dep in deps
+    }
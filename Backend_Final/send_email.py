@@ -1,115 +1,104 @@
-import os.path
-import base64
-import pyodbc
+import metrics
+import tracing
+import logging
+import storage
 
-from datetime import datetime
 from email.message import EmailMessage
 from email.utils import formataddr
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-
+from email_providers import EmailSendError, GmailProvider, get_provider
+from repositories import EmailLogRepository
 from typing import List
 
-# Gmail API scopes
-SCOPES = [
-    'https://www.googleapis.com/auth/gmail.readonly',
-    'https://www.googleapis.com/auth/gmail.send',
-    'https://www.googleapis.com/auth/gmail.compose'
-]
+logger = logging.getLogger("email_service.send_email")
 
-def get_connection():
-    return pyodbc.connect(
-        "DRIVER={ODBC Driver 17 for SQL Server};"
-        "SERVER=DESKTOP-PV9Q0OQ\SQLEXPRESS;" # Thay bằng tên sever trên máy đang chạy
-        "DATABASE=EmailDB;"   
-        "Trusted_Connection=yes;"
-    )
+def get_connection(readonly: bool = False):
+    return storage.get_connection("EmailDB", readonly=readonly)
         
 def log_email(recipient, subject, status, error_message=None):
     conn = get_connection()
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO EmailLogs (recipient, subject, status, error_message, sent_time) VALUES (?, ?, ?, ?, GETDATE())",
-            (recipient, subject, status, error_message)
-        )
+        EmailLogRepository(conn).add(recipient, subject, status, error_message)
         conn.commit()
     finally:
         conn.close()
 
 
-def send_email_v1(recipient: str, subject: str, content: str, port: int = 0, html: bool = False) -> bool:
-    """Send email using Gmail API"""
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials_desktop_apps.json', SCOPES)
-            creds = flow.run_local_server(port=port)
-
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
-    try:
-        service = build('gmail', 'v1', credentials=creds)
+def build_message(provider, recipient: str, subject: str, content: str, html: bool = False) -> EmailMessage:
+    message = EmailMessage()
+    message['Subject'] = subject 
+    message.set_content(content)
+    message['To'] = recipient
+    message['From'] = formataddr(('iBanking App', provider.sender_address()))
 
-        # Tạo email
-        message = EmailMessage()
-        message['Subject'] = subject 
+    if html:
+        message.add_alternative(content, subtype="html")
+    else:
         message.set_content(content)
-        message['To'] = recipient
-        message['From'] = formataddr(('iBanking App', service.users().getProfile(userId='me').execute()['emailAddress']))
+    return message
 
-        if html:
-            message.add_alternative(content, subtype="html")
-        else:
-            message.set_content(content)
-            
-        encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        create_message = {'raw': encoded_message}
-
-        service.users().messages().send(userId="me", body=create_message).execute()
+def record_result(provider, recipient: str, subject: str, error=None):
+    if error is None:
         # Lưu log khi thành công
+        metrics.EMAIL_SENT.labels(provider.name, "success").inc()
         log_email(recipient, subject, "success")
-        return True
-    except HttpError as e:
+    else:
         # Lưu log khi thất bại
-        log_email(recipient, subject, "failed", str(e))
-        print(f'Error occurred: {e}')
-        return False
+        metrics.EMAIL_SENT.labels(provider.name, "failed").inc()
+        log_email(recipient, subject, "failed", str(error))
+        logger.error("Error occurred: %s", error)
+
+
+def send_email_v1(recipient: str, subject: str, content: str, port: int = 0, html: bool = False) -> bool:
+    """Send email qua provider đã cấu hình (Gmail API mặc định, xem email_providers.py)"""
+    provider = get_provider()
+    if port and isinstance(provider, GmailProvider):
+        provider.port = port    # cổng local server cho lần đăng nhập OAuth đầu tiên
+
+    with tracing.start_span("email.send", kind="client", attributes={"email.provider": provider.name, "email.subject": subject}):
+        try:
+            # Tạo email
+            provider.send(build_message(provider, recipient, subject, content, html))
+            record_result(provider, recipient, subject)
+            return True
+        except EmailSendError as e:
+            record_result(provider, recipient, subject, e)
+            return False
     
     
-def send_bulk_email(to_list: List[str], subject: str, body: str):
-    success_count, failed = 0, []
-    for recipient in to_list:
-        if send_email_v1(recipient, subject, body,html= True):
-            success_count += 1
+def send_batch(items: list) -> list:
+    """items: list (recipient, subject, content, html). Gửi qua provider.send_many, trả list lỗi (None = ok) theo thứ tự.
+    Hàng đợi ưu tiên bên email_service gọi hàm này cho từng chunk."""
+    provider = get_provider()
+    span_name = "email.send" if len(items) == 1 else "email.send_bulk"
+    with tracing.start_span(span_name, kind="client", attributes={"email.provider": provider.name, "email.count": len(items)}):
+        try:
+            messages = [build_message(provider, recipient, subject, content, html) for recipient, subject, content, html in items]
+        except EmailSendError as e:
+            # Không lấy được địa chỉ gửi (vd. Gmail getProfile lỗi): cả lô thất bại
+            errors = [e] * len(items)
         else:
-            failed.append(recipient)
-    return success_count, failed
+            errors = provider.send_many(messages)
+
+    for (recipient, subject, _, _), error in zip(items, errors):
+        record_result(provider, recipient, subject, error)
+    return errors
+
+def record_failures(items: list, error):
+    """Ghi log thất bại cho các item không được gửi (vd. OTP hết hạn khi còn trong hàng đợi)"""
+    provider = get_provider()
+    for recipient, subject, _, _ in items:
+        record_result(provider, recipient, subject, error)
+
+def send_bulk_email(to_list: List[str], subject: str, body: str):
+    """Gửi cả danh sách qua provider.send_many (SMTP: chung 1 phiên thay vì mỗi người nhận 1 lần kết nối)"""
+    errors = send_batch([(recipient, subject, body, True) for recipient in to_list])
+    failed = [recipient for recipient, error in zip(to_list, errors) if error is not None]
+    return len(to_list) - len(failed), failed
 
 def get_email_logs():
-    conn = get_connection()
+    conn = get_connection(readonly=True)
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT recipient, subject, status, sent_time FROM EmailLogs ORDER BY sent_time DESC")
-        rows = cur.fetchall()
-        return [
-            {
-                "to": row[0],
-                "subject": row[1],
-                "status": row[2],
-                "time": row[3]
-            }
-            for row in rows
-        ]
+        return EmailLogRepository(conn).list()
     finally:
         conn.close()
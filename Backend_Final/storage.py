@@ -0,0 +1,286 @@
+import os
+import atexit
+import shutil
+import sqlite3
+import logging
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import metrics
+import tracing
+
+# ================== Config ==================
+# IBANKING_STORAGE = mssql (mặc định, SQL Server qua pyodbc) | sqlite (embedded, chạy được trên mọi máy)
+STORAGE_BACKEND = os.getenv("IBANKING_STORAGE", "mssql").lower()
+MSSQL_DRIVER = os.getenv("IBANKING_MSSQL_DRIVER", "ODBC Driver 17 for SQL Server")
+MSSQL_SERVER = os.getenv("IBANKING_MSSQL_SERVER", "DESKTOP-PV9Q0OQ\\SQLEXPRESS")   # Thay bằng tên sever trên máy đang chạy
+# Thư mục chứa file .db của backend sqlite; ":memory:" -> thư mục tạm, xóa khi tắt process
+SQLITE_DIR = os.getenv("IBANKING_SQLITE_DIR", ".data")
+
+# ================== Read replica ==================
+# IBANKING_READ_REPLICA=1: get_connection(db, readonly=True) mở connection tới replica
+#   - mssql: IBANKING_MSSQL_REPLICA_SERVER (mặc định cùng server/AG listener) + ApplicationIntent=ReadOnly
+#   - sqlite: connection mode=ro trên cùng file (chỉ để chạy thử đường routing)
+READ_REPLICA = os.getenv("IBANKING_READ_REPLICA", "0").lower() in ("1", "true", "yes")
+MSSQL_REPLICA_SERVER = os.getenv("IBANKING_MSSQL_REPLICA_SERVER", MSSQL_SERVER)
+# Replica có thể trễ so với primary: DB vừa được process này ghi trong N giây gần đây thì đọc từ primary
+REPLICA_MAX_STALENESS = float(os.getenv("IBANKING_REPLICA_MAX_STALENESS", "2"))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("IBANKING_REPLICA_CONNECT_TIMEOUT", "2"))
+# Replica lỗi -> dùng primary trong N giây rồi mới thử lại
+REPLICA_RETRY_AFTER = float(os.getenv("IBANKING_REPLICA_RETRY_AFTER", "30"))
+
+DB_READ_ROUTE = metrics.counter("db_read_route_total", "Read-only connections by where they were routed",
+                                ("database", "target"))
+
+logger = logging.getLogger("storage")
+
+if STORAGE_BACKEND == "mssql":
+    # Chỉ import pyodbc khi dùng SQL Server (máy Linux không có unixODBC vẫn chạy được sqlite)
+    import pyodbc
+    DB_ERRORS = (pyodbc.Error,)
+    INTEGRITY_ERRORS = (pyodbc.IntegrityError,)
+elif STORAGE_BACKEND == "sqlite":
+    DB_ERRORS = (sqlite3.Error,)
+    INTEGRITY_ERRORS = (sqlite3.IntegrityError,)
+else:
+    raise RuntimeError(f"Unknown IBANKING_STORAGE backend: {STORAGE_BACKEND}")
+
+
+# ================== SQLite schemas ==================
+# Cùng cấu trúc + dữ liệu mẫu với các file *.sql của SQL Server
+SQLITE_SCHEMAS = {
+    "AccountDB": """
+        CREATE TABLE IF NOT EXISTS account (
+            account_id TEXT PRIMARY KEY,
+            customer_id TEXT,
+            balance NUMERIC DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE TABLE IF NOT EXISTS ledger_entry (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id TEXT NOT NULL,
+            amount NUMERIC NOT NULL,
+            description TEXT,
+            created_at DATETIME NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ix_ledger_entry_account ON ledger_entry (account_id, entry_id);
+        CREATE TABLE IF NOT EXISTS balance_snapshot (
+            account_id TEXT NOT NULL,
+            entry_id INTEGER NOT NULL,
+            balance NUMERIC NOT NULL,
+            as_of DATETIME NOT NULL,
+            PRIMARY KEY (account_id, entry_id)
+        );
+        CREATE TABLE IF NOT EXISTS account_bucket (
+            account_id TEXT NOT NULL,
+            bucket_no INTEGER NOT NULL,
+            balance NUMERIC NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (account_id, bucket_no)
+        );
+    """,
+    "CustomerDB": """
+        CREATE TABLE IF NOT EXISTS Customers (
+            customer_id TEXT PRIMARY KEY,
+            full_name TEXT NOT NULL,
+            phone_number TEXT NOT NULL,
+            email TEXT NOT NULL
+        );
+    """,
+    "PaymentDB": """
+        CREATE TABLE IF NOT EXISTS payment (
+            transactionId INTEGER PRIMARY KEY AUTOINCREMENT,
+            customerId INTEGER NOT NULL,
+            amount NUMERIC NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('unpaid','paid')),
+            transaction_history TEXT
+        );
+        CREATE TABLE IF NOT EXISTS payment_lock (
+            customerId TEXT PRIMARY KEY,
+            token TEXT NOT NULL,
+            claimed_at DATETIME NOT NULL
+        );
+    """,
+    "OtpDB": """
+        CREATE TABLE IF NOT EXISTS otp (
+            otpId INTEGER PRIMARY KEY AUTOINCREMENT,
+            userId INTEGER NOT NULL,
+            otpCode TEXT NOT NULL,
+            expired_at DATETIME NOT NULL,
+            is_used INTEGER DEFAULT 0
+        );
+    """,
+    "AuthenticationDB": """
+        CREATE TABLE IF NOT EXISTS authentication (
+            userId INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id TEXT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        );
+    """,
+    "EmailDB": """
+        CREATE TABLE IF NOT EXISTS EmailLogs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            subject TEXT,
+            status TEXT,
+            error_message TEXT,
+            sent_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+    """,
+}
+
+SQLITE_SEED = {
+    "AccountDB": ("account", "INSERT INTO account (account_id, customer_id, balance) VALUES (?, ?, ?)", [
+        ("ACC001", "101", 1000000.50),
+        ("ACC002", "102", 250000.00),
+        ("ACC003", "103", 50000.75),
+        ("ACC004", "101", 0.00),
+        ("ACC005", "104", 99999999.99),
+        ("ACC006", "105", 99999999.99),
+        ("ACC007", "105", 99999999.99),
+    ]),
+    "CustomerDB": ("Customers", "INSERT INTO Customers (customer_id, full_name, phone_number, email) VALUES (?, ?, ?, ?)", [
+        ("101", "Nguyen Van A", "0909123456", "a@example.com"),
+        ("102", "Nguyen Van B", "0912345678", "b@example.com"),
+        ("103", "Nguyen Hong Phu", "0923456789", "p@example.com"),
+        ("104", "Tran Thi C", "0934567890", "c@example.com"),
+        ("105", "Le Van D", "0945678901", "d@example.com"),
+    ]),
+    "PaymentDB": ("payment", "INSERT INTO payment (customerId, amount, status, transaction_history) VALUES (?, ?, ?, ?)", [
+        (101, 900000, "unpaid", "Initial unpaid payment for customer 101"),
+        (102, 500000, "unpaid", "Initial unpaid payment for customer 102"),
+    ]),
+    "AuthenticationDB": ("authentication", "INSERT INTO authentication (username, customer_id, password_hash) VALUES (?, ?, ?)", [
+        ("a@example.com", "101", "$2b$12$wwN5O.TbLDNeYYR3pHZfWusdUCwcXLZTzXK4P2F15p5DG3LY1KxhW"),
+        ("b@example.com", "102", "$2b$12$wwN5O.TbLDNeYYR3pHZfWusdUCwcXLZTzXK4P2F15p5DG3LY1KxhW"),
+    ]),
+}
+
+# DATETIME lưu dạng ISO text, đọc ra lại datetime giống pyodbc
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(sep=" "))
+sqlite3.register_converter("DATETIME", lambda raw: datetime.fromisoformat(raw.decode()))
+
+_sqlite_dir = None
+_initialized = set()
+_init_lock = threading.Lock()
+
+def _sqlite_path(database: str) -> str:
+    global _sqlite_dir
+    if _sqlite_dir is None:
+        if SQLITE_DIR == ":memory:":
+            _sqlite_dir = tempfile.mkdtemp(prefix="ibanking-")
+            atexit.register(shutil.rmtree, _sqlite_dir, True)
+        else:
+            _sqlite_dir = SQLITE_DIR
+            os.makedirs(_sqlite_dir, exist_ok=True)
+    return os.path.join(_sqlite_dir, f"{database}.db")
+
+def _connect_sqlite(database: str, readonly: bool = False):
+    if readonly:
+        if database not in _initialized:
+            _connect_sqlite(database).close()   # tạo schema + seed trước khi mở read-only
+        return sqlite3.connect(f"file:{_sqlite_path(database)}?mode=ro", uri=True, timeout=30,
+                               detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+
+    conn = sqlite3.connect(_sqlite_path(database), timeout=30, detect_types=sqlite3.PARSE_DECLTYPES,
+                           check_same_thread=False)
+    if database not in _initialized:
+        with _init_lock:
+            if database not in _initialized:
+                # WAL: đọc không chặn ghi khi nhiều worker/thread cùng dùng 1 file
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SQLITE_SCHEMAS[database])
+                if database in SQLITE_SEED:
+                    table, sql, rows = SQLITE_SEED[database]
+                    if conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0:
+                        conn.executemany(sql, rows)
+                conn.commit()
+                _initialized.add(database)
+    return conn
+
+def _connect_mssql(database: str, readonly: bool = False):
+    if readonly:
+        return pyodbc.connect(
+            f"DRIVER={{{MSSQL_DRIVER}}};"
+            f"SERVER={MSSQL_REPLICA_SERVER};"
+            f"DATABASE={database};"
+            "Trusted_Connection=yes;"
+            "ApplicationIntent=ReadOnly;",
+            timeout=REPLICA_CONNECT_TIMEOUT
+        )
+    return pyodbc.connect(
+        f"DRIVER={{{MSSQL_DRIVER}}};"
+        f"SERVER={MSSQL_SERVER};"
+        f"DATABASE={database};"
+        "Trusted_Connection=yes;"
+    )
+
+def _connect(database: str, readonly: bool = False):
+    if STORAGE_BACKEND == "mssql":
+        return _connect_mssql(database, readonly)
+    return _connect_sqlite(database, readonly)
+
+
+# ================== Routing ==================
+_last_write = {}        # database -> time.monotonic() của lần commit gần nhất trên primary
+_replica_down = {}      # database -> time.monotonic() lúc replica được thử lại
+
+class _PrimaryConnection:
+    """Bọc connection tới primary: ghi nhận thời điểm commit để đọc sau đó không bị replica trễ"""
+
+    def __init__(self, conn, database: str):
+        self._conn = conn
+        self._database = database
+
+    def commit(self):
+        self._conn.commit()
+        _last_write[self._database] = time.monotonic()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def _route_read(database: str):
+    """Chọn connection cho 1 lần đọc: replica nếu bật, đủ 'nguội' và đang sống; ngược lại primary"""
+    now = time.monotonic()
+    if now - _last_write.get(database, float("-inf")) < REPLICA_MAX_STALENESS:
+        DB_READ_ROUTE.labels(database, "primary_recent_write").inc()
+        return _connect(database)
+    if now < _replica_down.get(database, 0):
+        DB_READ_ROUTE.labels(database, "primary_replica_down").inc()
+        return _connect(database)
+    try:
+        conn = _connect(database, readonly=True)
+    except DB_ERRORS as e:
+        logger.warning("Read replica for %s unavailable, falling back to primary for %ss: %s",
+                       database, REPLICA_RETRY_AFTER, e)
+        _replica_down[database] = now + REPLICA_RETRY_AFTER
+        DB_READ_ROUTE.labels(database, "primary_replica_down").inc()
+        return _connect(database)
+    DB_READ_ROUTE.labels(database, "replica").inc()
+    return conn
+
+
+# ================== Public API ==================
+def get_connection(database: str, readonly: bool = False, autocommit: bool = False):
+    """Mở connection DB-API tới `database` theo backend đã cấu hình (đã gắn metrics + tracing).
+
+    readonly=True: chỉ đọc, được phép đi tới read replica (nếu IBANKING_READ_REPLICA bật).
+    autocommit=True: driver không tự mở transaction (pyodbc autocommit / sqlite3 isolation_level=None);
+    caller tự BEGIN / COMMIT / ROLLBACK bằng câu SQL (vd. group_commit.py)."""
+    if readonly and READ_REPLICA:
+        conn = _route_read(database)
+    else:
+        raw = _connect(database)
+        if autocommit:
+            if STORAGE_BACKEND == "mssql":
+                raw.autocommit = True
+            else:
+                raw.isolation_level = None
+        conn = _PrimaryConnection(raw, database)
+    return tracing.traced_connection(metrics.metered_connection(conn, database), database)
+
+def is_mssql() -> bool:
+    return STORAGE_BACKEND == "mssql"
@@ -0,0 +1,80 @@
+"""Đọc file span JSON lines (IBANKING_TRACE_EXPORTER=file) và in critical path của từng trace.
+
+    python trace_report.py traces.jsonl [--top 10]
+"""
+import argparse
+import json
+from collections import defaultdict
+
+
+def load_traces(path: str) -> dict:
+    traces = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                span = json.loads(line)
+                traces[span["trace_id"]].append(span)
+    return traces
+
+def critical_path(spans: list) -> list:
+    """Từ root, mỗi bước đi vào span con kết thúc muộn nhất (span quyết định thời gian của cha)"""
+    children = defaultdict(list)
+    ids = {s["span_id"] for s in spans}
+    roots = []
+    for span in spans:
+        if span["parent_id"] in ids:
+            children[span["parent_id"]].append(span)
+        else:
+            roots.append(span)
+    if not roots:
+        return []
+    node = max(roots, key=lambda s: s["duration_ms"] or 0)
+    path = [node]
+    while children[node["span_id"]]:
+        node = max(children[node["span_id"]], key=lambda s: s["end_ns"] or 0)
+        path.append(node)
+    return path
+
+def self_time_by_span(spans: list) -> dict:
+    """Thời gian riêng (trừ thời gian các span con) gộp theo service + tên span"""
+    child_time = defaultdict(float)
+    for span in spans:
+        if span["parent_id"]:
+            child_time[span["parent_id"]] += span["duration_ms"] or 0
+    totals = defaultdict(float)
+    for span in spans:
+        own = max((span["duration_ms"] or 0) - child_time[span["span_id"]], 0)
+        totals[f'{span["service"]}: {span["name"]}'] += own
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Critical path report for exported spans")
+    parser.add_argument("path")
+    parser.add_argument("--top", type=int, default=10, help="số trace chậm nhất cần in")
+    args = parser.parse_args()
+
+    traces = load_traces(args.path)
+    ranked = sorted(traces.values(), key=lambda spans: max(s["duration_ms"] or 0 for s in spans), reverse=True)
+
+    aggregate = defaultdict(float)
+    for spans in traces.values():
+        for key, value in self_time_by_span(spans).items():
+            aggregate[key] += value
+
+    for spans in ranked[:args.top]:
+        path = critical_path(spans)
+        if not path:
+            continue
+        print(f'trace {path[0]["trace_id"]}  total {path[0]["duration_ms"]:.1f} ms')
+        for depth, span in enumerate(path):
+            print(f'  {"  " * depth}{span["service"]}: {span["name"]}  {span["duration_ms"]:.1f} ms')
+        print()
+
+    print("Self time by span (all traces):")
+    for key, value in sorted(aggregate.items(), key=lambda kv: kv[1], reverse=True):
+        print(f"  {value:10.1f} ms  {key}")
+
+
+if __name__ == "__main__":
+    main()
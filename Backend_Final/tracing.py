@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# ================== Config ==================
+# IBANKING_TRACE_EXPORTER: none | console | file   (file -> ghi JSON lines vào IBANKING_TRACE_FILE)
+TRACE_EXPORTER = os.getenv("IBANKING_TRACE_EXPORTER", "none")
+TRACE_FILE = os.getenv("IBANKING_TRACE_FILE", "traces.jsonl")
+TRACE_QUEUE_SIZE = int(os.getenv("IBANKING_TRACE_QUEUE_SIZE", "10000"))
+SERVICE_NAME = os.getenv("IBANKING_SERVICE_NAME", "unknown")
+
+logger = logging.getLogger("tracing")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+# ================== Span ==================
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, kind: str = "internal", attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.service = SERVICE_NAME
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_error(self, exc: BaseException):
+        self.status = "error"
+        self.attributes["error.type"] = type(exc).__name__
+        self.attributes["error.message"] = str(exc)[:500]
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "service": self.service,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6 if self.end_ns else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+# ================== Exporters ==================
+class SpanExporter:
+    """Interface exporter: nhận 1 batch span (list[dict]) đã kết thúc"""
+
+    def export(self, spans: list):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+class NoopExporter(SpanExporter):
+    def export(self, spans: list):
+        pass
+
+class ConsoleExporter(SpanExporter):
+    def export(self, spans: list):
+        for span in spans:
+            print(json.dumps(span, default=str))
+
+class JsonFileExporter(SpanExporter):
+    """Ghi mỗi span 1 dòng JSON để phân tích critical path offline"""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: list):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span, default=str) + "\n")
+
+
+# Export ở thread nền để ghi file không nằm trên đường đi của request
+class _BatchProcessor:
+    def __init__(self, exporter: SpanExporter, max_queue: int = TRACE_QUEUE_SIZE, max_batch: int = 256):
+        self.exporter = exporter
+        self.max_batch = max_batch
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, span: dict):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.exporter.export(batch)
+            except Exception as e:
+                logger.error("Span export failed: %s", e)
+
+_processor = None
+_processor_lock = threading.Lock()
+
+def set_exporter(exporter: SpanExporter):
+    """Thay exporter (ví dụ exporter gửi sang Jaeger/OTLP); NoopExporter -> tắt tracing"""
+    global _processor
+    with _processor_lock:
+        _processor = None if isinstance(exporter, NoopExporter) else _BatchProcessor(exporter)
+
+def _exporter_from_config() -> SpanExporter:
+    if TRACE_EXPORTER == "console":
+        return ConsoleExporter()
+    if TRACE_EXPORTER == "file":
+        return JsonFileExporter(TRACE_FILE)
+    return NoopExporter()
+
+set_exporter(_exporter_from_config())
+
+def enabled() -> bool:
+    return _processor is not None
+
+
+# ================== Context Propagation (W3C traceparent) ==================
+def _new_trace_id() -> str:
+    return f"{random.getrandbits(128):032x}"
+
+def parse_traceparent(header: str):
+    """'00-<trace_id>-<parent_span_id>-<flags>' -> (trace_id, parent_span_id) hoặc None"""
+    try:
+        version, trace_id, span_id, _flags = header.strip().split("-")
+        if version != "00" or len(trace_id) != 32 or len(span_id) != 16:
+            return None
+        int(trace_id, 16), int(span_id, 16)
+        return trace_id, span_id
+    except (ValueError, AttributeError):
+        return None
+
+def current_span():
+    return _current_span.get()
+
+def inject(headers: dict) -> dict:
+    """Thêm header traceparent của span hiện tại vào request đi ra"""
+    span = _current_span.get()
+    if span is not None:
+        headers["traceparent"] = f"00-{span.trace_id}-{span.span_id}-01"
+    return headers
+
+@contextmanager
+def start_span(name: str, kind: str = "internal", attributes=None, parent=None):
+    """Mở span con của span hiện tại (hoặc của `parent` = (trace_id, span_id) lấy từ traceparent)"""
+    if _processor is None:
+        yield None
+        return
+    current = _current_span.get()
+    if parent is not None:
+        trace_id, parent_id = parent
+    elif current is not None:
+        trace_id, parent_id = current.trace_id, current.span_id
+    else:
+        trace_id, parent_id = _new_trace_id(), None
+    span = Span(name, trace_id, parent_id, kind, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end_ns = time.time_ns()
+        processor = _processor
+        if processor is not None:
+            processor.submit(span.to_dict())
+
+
+# ================== ASGI Middleware ==================
+class TracingMiddleware:
+    """Tạo server span cho mỗi request, nối vào trace của service gọi tới (nếu có traceparent)"""
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _processor is None:
+            await self.app(scope, receive, send)
+            return
+
+        parent = None
+        for key, value in scope.get("headers", []):
+            if key == b"traceparent":
+                parent = parse_traceparent(value.decode("latin-1"))
+                break
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and span is not None:
+                span.set_attribute("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    span.status = "error"
+            await send(message)
+
+        with start_span(f"{scope['method']} {scope['path']}", kind="server", parent=parent,
+                        attributes={"http.method": scope["method"], "http.target": scope["path"]}) as span:
+            if span is not None:
+                span.service = self.service
+            await self.app(scope, receive, send_wrapper)
+            route = scope.get("route")
+            if span is not None and route is not None:
+                span.name = f"{scope['method']} {route.path}"
+                span.set_attribute("http.route", route.path)
+
+def instrument_app(app, service: str):
+    global SERVICE_NAME
+    SERVICE_NAME = service
+    app.add_middleware(TracingMiddleware, service=service)
+
+
+# ================== DB Instrumentation ==================
+class _TracedCursor:
+    def __init__(self, cursor, database: str):
+        self._cursor = cursor
+        self._database = database
+
+    def execute(self, sql, *args, **kwargs):
+        with start_span("db.execute", kind="client",
+                        attributes={"db.name": self._database, "db.statement": " ".join(str(sql).split())[:300]}):
+            self._cursor.execute(sql, *args, **kwargs)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class TracedConnection:
+    def __init__(self, conn, database: str):
+        self._conn = conn
+        self._database = database
+
+    def cursor(self):
+        return _TracedCursor(self._conn.cursor(), self._database)
+
+    def commit(self):
+        with start_span("db.commit", kind="client", attributes={"db.name": self._database}):
+            self._conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def traced_connection(conn, database: str) -> TracedConnection:
+    return TracedConnection(conn, database)